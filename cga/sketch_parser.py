@@ -8,10 +8,8 @@ import os
 from configparser import ConfigParser, ExtendedInterpolation
 from enum import Enum
 
-from PIL import Image
-
-from rico.generator import draw_colored_image
 from utils.files import check_make_dir, listdir_nohidden
+from utils.sketch import SketchCanvas
 from utils.widget import Widget
 
 cfg = ConfigParser(interpolation=ExtendedInterpolation())
@@ -34,6 +32,9 @@ sketch_sequences_fp = cfg.get('sketch', 'sequences')
 # NMT 运行所需的文件：图像、编号的映射文件
 sketch_lst_fp = cfg.get('sketch', 'dummy_lst')
 
+# 着色图画布（直接绘制为旋转 90 度后的方向）
+colored_canvas = SketchCanvas(SKETCH_WIDTH, SKETCH_HEIGHT, rotate=True)
+
 
 # 草图形状编号
 class Shape(Enum):
@@ -144,8 +145,6 @@ def create_colored_pic(sketch_data_fp, out_fp):
             # 修改最小包围矩形的内部形状计数值矩阵
             direct_rect.inside_shapes_cnt[component.shape.value] += 1
 
-        im_colored = Image.new('RGB', (SKETCH_WIDTH, SKETCH_HEIGHT), (255, 255, 255))
-
         # 矩形: 先画 List，再画其他控件
         for rect in rectangles:
             rect.set_widget_type()  # 根据计数值矩阵判断控件类型
@@ -153,14 +152,11 @@ def create_colored_pic(sketch_data_fp, out_fp):
             rect.bounds = (13, 10, 187, 31) if rect.widget == Widget.Toolbar else (
                 int(rect.x0 / contour_width * SKETCH_WIDTH), int(rect.y0 / contour_height * SKETCH_HEIGHT),
                 int(rect.x1 / contour_width * SKETCH_WIDTH), int(rect.y1 / contour_height * SKETCH_HEIGHT))
-            if rect.widget == Widget.List:
-                draw_colored_image(im_colored, rect.widget, rect.bounds)
-
-        for rect in rectangles:
-            if rect.widget != Widget.List:
-                draw_colored_image(im_colored, rect.widget, rect.bounds)
+        drawn_rects = [rect for rect in rectangles if rect.widget == Widget.List] + \
+                      [rect for rect in rectangles if rect.widget != Widget.List]
 
-        im_colored.rotate(90, expand=1).save(out_fp)
+        colored_canvas.draw([rect.widget.value for rect in drawn_rects], [rect.bounds for rect in drawn_rects])
+        colored_canvas.image().save(out_fp)
         print(out_fp, "saved.")
 
 
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" 批量计算布局序列文件（如 NMT 模型在测试集上生成的布局序列，每行一个序列）与资产库的相似度。
+    资产库索引只加载一次，每个候选布局只读取一次并与所有输入序列比较，结果以 JSON lines 格式输出，每行对应一个输入序列：
+        {"line": 行号, "query": 输入序列, "results": [[layout_id, similarity_score], ...]}
+    无法解析的序列输出 "error" 字段，results 为空。
+
+    用法：python batch.py -i layout_sequence.lst -o results.jsonl [-k 30] [-w 4] [-c 500]
+"""
+
+import argparse
+import json
+import time
+
+from decomp.layout_index import LayoutIndex, array_tree_from_sequence
+from decomp.search import index_dir, top_k, num_workers, chunk_size, search_batch
+
+
+def read_queries(queries_fp):
+    """
+    读取输入序列文件，返回 (序列列表, ArrayTree 列表, 错误信息列表)
+    """
+    sequences, i_trees, errors = [], [], []
+    with open(queries_fp, 'r') as f:
+        for line in f:
+            seq = line.strip()
+            try:
+                i_tree = array_tree_from_sequence(seq)
+                error = None
+            except (KeyError, IndexError) as e:
+                i_tree = array_tree_from_sequence('')
+                error = 'Invalid layout sequence: ' + str(e)
+            sequences.append(seq)
+            i_trees.append(i_tree)
+            errors.append(error)
+    return sequences, i_trees, errors
+
+
+def write_results(output_fp, sequences, errors, results):
+    with open(output_fp, 'w') as f:
+        for i, (seq, error, result) in enumerate(zip(sequences, errors, results)):
+            record = {'line': i, 'query': seq, 'results': [[layout_id, float(score)] for layout_id, score in result]}
+            if error is not None:
+                record['error'] = error
+            f.write(json.dumps(record) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score a file of layout sequences against the layout repo.')
+    parser.add_argument('-i', '--input', required=True, help='layout sequence file, one sequence per line')
+    parser.add_argument('-o', '--output', required=True, help='output JSON lines file')
+    parser.add_argument('-k', '--top-k', type=int, default=top_k, help='number of results per sequence')
+    parser.add_argument('-w', '--workers', type=int, default=num_workers, help='number of worker processes')
+    parser.add_argument('-c', '--chunk-size', type=int, default=chunk_size, help='candidate layouts per task')
+    parser.add_argument('--index', default=index_dir, help='layout index directory')
+    parser.add_argument('--no-prune', action='store_true', help='disable upper bound pruning')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    print('---------------------------------')
+
+    layout_index = LayoutIndex(args.index)
+    sequences, i_trees, errors = read_queries(args.input)
+    print('>>> Scoring', len(sequences), 'sequences against', len(layout_index), 'layouts ...', end=' ')
+    search_stats = {}
+    results = search_batch(i_trees, layout_index, k=args.top_k, workers=args.workers, chunk=args.chunk_size,
+                           prune=not args.no_prune, stats=search_stats)
+    print('OK')
+    write_results(args.output, sequences, errors, results)
+    print('<<< Results saved in', args.output)
+    print('Scored pairs:', search_stats['scored'], '| Pruned pairs:', search_stats['pruned'],
+          '| Memo hits:', search_stats['memo_hits'], '| Memo misses:', search_stats['memo_misses'])
+
+    print('---------------------------------')
+    print('Duration: {:.2f} s'.format(time.time() - start_time))
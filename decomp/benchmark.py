@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" decomp 中核心函数的性能基准测试。
+    测试数据：
+        synthetic-<n>: 随机生成的布局树（节点数 n，最大深度与分支数可调，随机种子固定），每种规模 NUM_SYNTHETIC 棵
+        real: 从 apk_tokens_dir/rico-layout.lst 中按固定种子抽取的 NUM_REAL 行布局序列
+    测试函数：create_layout_tree、optimize_sequence、array_tree_from_sequence、max_score（参照实现）、max_score_array
+    （每次新建缓冲区 / 复用 DPWorkspace / float32 DPWorkspace）。
+    每个 (函数, 数据) 组合重复计时 repeat 次，取最快一次的单次调用平均耗时，结果以 JSON 格式保存；
+    提供基准结果时逐项比较，耗时超过基准的 threshold 倍视为性能退化，退出码为 1。
+
+    用法：python benchmark.py [-o results.json] [-b baseline.json] [-t 1.2] [-r 5] [--update-baseline]
+"""
+
+import argparse
+import functools
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+from configparser import ConfigParser
+
+import numpy as np
+
+from decomp.layout_index import array_tree_from_sequence, array_tree_from_nodes
+from decomp.layout_utils import create_layout_tree, optimize_sequence, post_order_traversal
+from decomp.score import DPWorkspace, max_score, max_score_array
+
+cfg = ConfigParser()
+cfg.read('../config.ini')
+
+seq_dir = cfg.get('decode', 'apk_tokens_dir')
+benchmark_dir = cfg.get('benchmark', 'benchmark_dir')
+baseline_fp = cfg.get('benchmark', 'baseline')
+regression_threshold = cfg.getfloat('benchmark', 'regression_threshold')
+
+SEED = 2020
+SYNTHETIC_SIZES = [10, 25, 50, 100, 200]
+NUM_SYNTHETIC = 10  # 每种规模生成的布局树数目
+NUM_REAL = 100  # 抽取的真实布局序列数目
+MAX_DEPTH = 8
+MAX_BRANCHING = 5
+MIN_RUN_SECONDS = 0.2  # 每次计时的最短时间
+
+CONTAINER_WIDGETS = ['Layout', 'Layout', 'Layout', 'List']
+LEAF_WIDGETS = ['TextView', 'TextLink', 'EditText', 'ImageView', 'ImageLink', 'Button', 'RadioButton', 'Switch',
+                'CheckBox', 'Toolbar']
+
+
+def make_synthetic_sequence(num_nodes, max_depth, max_branching, rng):
+    """
+    随机生成一棵布局树并输出其布局序列。容器节点为 Layout / List，叶子节点为其他控件
+    :param num_nodes: 节点数
+    :param max_depth: 最大深度（根节点深度为 1）
+    :param max_branching: 每个节点最多的子节点数
+    :param rng: random.Random
+    :return: 布局序列
+    """
+    children = [[]]
+    depth = [1]
+    expandable = [0]  # 还可以添加子节点的节点
+    while len(children) < num_nodes and expandable:
+        parent = rng.choice(expandable)
+        children[parent].append(len(children))
+        children.append([])
+        depth.append(depth[parent] + 1)
+        if depth[-1] < max_depth:
+            expandable.append(len(children) - 1)
+        if len(children[parent]) >= max_branching:
+            expandable.remove(parent)
+
+    tokens = []
+    stack = [(0, False)]
+    while stack:
+        node, closing = stack.pop()
+        if closing:
+            tokens.append('}')
+            continue
+        if children[node]:
+            tokens.extend([rng.choice(CONTAINER_WIDGETS), '{'])
+            stack.append((node, True))
+            stack.extend((c, False) for c in reversed(children[node]))
+        else:
+            tokens.append(rng.choice(LEAF_WIDGETS))
+    return ' '.join(tokens)
+
+
+def load_real_sequences(file_path, num_samples, rng):
+    """
+    按固定种子从布局资产库文件中抽取布局序列（资产库文件不变时抽样结果不变）
+    """
+    sequences = []
+    with open(file_path, 'r') as f:
+        for line in f:
+            line_sp = line.split()
+            if len(line_sp) > 3 and int(line_sp[2]) > 0:
+                sequences.append(' '.join(line_sp[3:]))
+    return rng.sample(sequences, min(num_samples, len(sequences)))
+
+
+def make_cases(sizes, max_depth, max_branching, real_fp):
+    """
+    :return: { 数据名: 布局序列列表 }
+    """
+    rng = random.Random(SEED)
+    cases = {}
+    for size in sizes:
+        cases['synthetic-%d' % size] = [make_synthetic_sequence(size, max_depth, max_branching, rng)
+                                        for _ in range(NUM_SYNTHETIC)]
+    if os.path.isfile(real_fp):
+        cases['real'] = load_real_sequences(real_fp, NUM_REAL, rng)
+    return cases
+
+
+def prepare_pairs(sequences):
+    """
+    将布局序列两两配对（第 j 个与第 j + 1 个），分别生成 max_score 与 max_score_array 的输入
+    """
+    trees = []
+    for seq in sequences:
+        root, nd = create_layout_tree(seq)
+        post_order = post_order_traversal(root)
+        trees.append((nd, post_order, array_tree_from_nodes(nd, post_order)))
+    pairs = [(trees[j], trees[(j + 1) % len(trees)]) for j in range(len(trees))]
+    return [(t1[0], t1[1], t2[0], t2[1]) for t1, t2 in pairs], [(t1[2], t2[2]) for t1, t2 in pairs]
+
+
+def time_calls(func, args_list, repeat):
+    """
+    :return: 单次调用的平均耗时（秒，取 repeat 次中最快的一次）。与 timeit 相同，计时期间关闭垃圾回收，
+             并将 args_list 循环多遍使每次计时不少于 MIN_RUN_SECONDS
+    """
+    def run(loops):
+        start_time = time.perf_counter()
+        for _ in range(loops):
+            for args in args_list:
+                func(*args)
+        return time.perf_counter() - start_time
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        loops = max(1, int(MIN_RUN_SECONDS / max(run(1), 1e-9)) + 1)  # 同时作为预热
+        best = min(run(loops) for _ in range(repeat))
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best / loops / len(args_list)
+
+
+def run_benchmarks(cases, repeat):
+    """
+    :return: { '函数/数据名': {'seconds_per_call': ..., 'calls': ...} }
+    """
+    results = {}
+    for case_name, sequences in cases.items():
+        seq_args = [(seq,) for seq in sequences]
+        pair_args, array_pair_args = prepare_pairs(sequences)
+        benchmarks = [('create_layout_tree', create_layout_tree, seq_args),
+                      ('optimize_sequence', optimize_sequence, seq_args),
+                      ('array_tree_from_sequence', array_tree_from_sequence, seq_args),
+                      ('max_score', max_score, pair_args),
+                      ('max_score_array', max_score_array, array_pair_args),
+                      ('max_score_array[workspace]', functools.partial(max_score_array, workspace=DPWorkspace()),
+                       array_pair_args),
+                      ('max_score_array[float32]',
+                       functools.partial(max_score_array, workspace=DPWorkspace(np.float32)), array_pair_args)]
+        for func_name, func, args_list in benchmarks:
+            key = func_name + '/' + case_name
+            results[key] = {'seconds_per_call': time_calls(func, args_list, repeat), 'calls': len(args_list)}
+            print(key, '| {:.3f} ms'.format(results[key]['seconds_per_call'] * 1000))
+    return results
+
+
+def compare_with_baseline(results, baseline, threshold):
+    """
+    :return: 性能退化项列表 [(key, 当前耗时, 基准耗时, 比例)]
+    """
+    regressions = []
+    for key, result in sorted(results.items()):
+        if key not in baseline['results']:
+            continue
+        base = baseline['results'][key]['seconds_per_call']
+        ratio = result['seconds_per_call'] / base if base > 0 else 1
+        print(key, '| {:.3f} ms -> {:.3f} ms | {:.2f}x'.format(base * 1000, result['seconds_per_call'] * 1000, ratio))
+        if ratio > threshold:
+            regressions.append((key, result['seconds_per_call'], base, ratio))
+    return regressions
+
+
+def save_json(obj, file_path):
+    out_dir = os.path.dirname(file_path)
+    if out_dir and not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    with open(file_path, 'w') as f:
+        json.dump(obj, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark max_score and the layout tree utilities.')
+    parser.add_argument('-o', '--output', default=os.path.join(benchmark_dir, 'results.json'),
+                        help='output JSON file')
+    parser.add_argument('-b', '--baseline', default=baseline_fp, help='baseline JSON file to compare with')
+    parser.add_argument('-t', '--threshold', type=float, default=regression_threshold,
+                        help='slowdown ratio treated as a regression')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='repetitions per benchmark (best is kept)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SYNTHETIC_SIZES, help='synthetic tree sizes')
+    parser.add_argument('--max-depth', type=int, default=MAX_DEPTH, help='synthetic tree max depth')
+    parser.add_argument('--max-branching', type=int, default=MAX_BRANCHING, help='synthetic tree max branching')
+    parser.add_argument('--real', default=os.path.join(seq_dir, 'rico-layout.lst'),
+                        help='layout repo file to sample real sequences from')
+    parser.add_argument('--update-baseline', action='store_true', help='save the results as the new baseline')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    print('---------------------------------')
+
+    benchmark_cases = make_cases(args.sizes, args.max_depth, args.max_branching, args.real)
+    print('>>> Running benchmarks on', ', '.join(benchmark_cases), '...')
+    benchmark_results = {
+        'meta': {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+                 'numpy': np.__version__, 'machine': platform.platform(), 'seed': SEED, 'repeat': args.repeat,
+                 'max_depth': args.max_depth, 'max_branching': args.max_branching},
+        'results': run_benchmarks(benchmark_cases, args.repeat)
+    }
+    save_json(benchmark_results, args.output)
+    print('<<< Results saved in', args.output)
+
+    num_regressions = 0
+    if args.update_baseline:
+        save_json(benchmark_results, args.baseline)
+        print('<<< Baseline saved in', args.baseline)
+    elif os.path.isfile(args.baseline):
+        print('---------------------------------')
+        print('>>> Comparing with baseline', args.baseline, '(threshold: %.2fx)' % args.threshold)
+        with open(args.baseline, 'r') as f:
+            regressions = compare_with_baseline(benchmark_results['results'], json.load(f), args.threshold)
+        num_regressions = len(regressions)
+        for key, seconds, base, ratio in regressions:
+            print('### Regression:', key, '| {:.3f} ms -> {:.3f} ms ({:.2f}x)'.format(base * 1000, seconds * 1000, ratio))
+        print('Regressions:', num_regressions)
+
+    print('---------------------------------')
+    print('Duration: {:.2f} s'.format(time.time() - start_time))
+    sys.exit(1 if num_regressions > 0 else 0)
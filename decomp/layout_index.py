@@ -0,0 +1,666 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" 将布局资产库（apk_tokens_dir 中的 *-layout.lst 及 rico-layout.lst）预编译为二进制索引，查询时以 mmap 方式只读加载。
+    资产库中大量布局的序列完全相同，类型与序列均相同的行合并为一个评分单元（unit），每个单元只保存一棵布局树、只计算一次
+    得分，再通过倒排表（postings）分发给产生它的每一行。
+    索引目录中的文件：
+        node_offsets.npy: 每个单元在全局节点数组中的起始位置（长度为单元数 + 1）
+        types.npy: 每个节点的控件类型编号（Widget.value），节点编号与 create_layout_tree 一致（'0' 为 Dummy Root）
+        parents.npy: 每个节点的父节点编号（单元内编号，Dummy Root 为 -1）
+        child_ptr.npy / children.npy: 子节点 CSR 数组，节点 g 的子节点为 children[child_ptr[g]:child_ptr[g + 1]]
+        post_order.npy: 每个单元的后序遍历（单元内编号）
+        subtree_ids.npy: 以每个节点为根的子树的结构编号（hash-consing，结构相同的子树编号相同，子节点顺序不计）
+        unit_types.npy: 每个单元的布局类型（1: layout, 2: item）
+        unit_digests.npy: 每个单元的 (类型, 序列) 摘要，用于合并相同的布局
+        unit_origins.npy: 增量更新时每个单元在更新前索引中的编号（新解析的单元为 -1），用于沿用按单元缓存的结果
+        posting_ptr.npy / postings.npy: 倒排表 CSR 数组，单元 u 对应的行为 postings[posting_ptr[u]:posting_ptr[u + 1]]
+        layout_types.npy / num_tokens.npy / file_ids.npy / entry_units.npy: 每行布局的类型、序列长度、来源文件与所属单元
+        subtree_types.npy / subtree_child_ptr.npy / subtree_children.npy: 子树结构编号表，增量更新时继续使用
+        meta.json: 索引编号、来源文件名、包名、每行布局的 xml 名称，以及来源文件清单（大小、修改时间、sha1）
+    资产库更新（exec.py 新增 *-layout.lst，generator.py 重写 rico-layout.lst）后以 MODE = 'update' 运行，
+    只重新解析新增或内容改变的文件。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from configparser import ConfigParser
+
+import numpy as np
+
+from utils.widget import Widget, MatchTreeNode
+
+cfg = ConfigParser()
+cfg.read('../config.ini')
+
+seq_dir = cfg.get('decode', 'apk_tokens_dir')
+index_dir = cfg.get('decode', 'layout_index_dir')
+
+MODE = 'update'  # build update
+
+INDEX_VERSION = 4
+
+ARRAY_NAMES = ['node_offsets', 'types', 'parents', 'child_ptr', 'children', 'post_order', 'subtree_ids', 'unit_types',
+               'unit_digests', 'unit_origins', 'posting_ptr', 'postings', 'layout_types', 'num_tokens', 'file_ids',
+               'entry_units', 'subtree_types', 'subtree_child_ptr', 'subtree_children']
+
+
+class IndexTreeNode(object):
+    """
+    max_score 所需的轻量树节点（仅有 name 与 children 两个属性），用于代替 anytree.Node
+    """
+    __slots__ = ('name', 'children')
+
+    def __init__(self, name):
+        self.name = name
+        self.children = []
+
+
+def parse_sequence(seq):
+    """
+    解析布局序列为 (节点类型列表, 父节点列表)，节点编号规则与 layout_utils.create_layout_tree 完全一致
+    :param seq: 布局序列
+    :return: types, parents（均以先序编号为下标，0 为 Dummy Root）
+    """
+    types = [Widget.Unclassified.value]
+    parents = [-1]
+
+    stack_parent = [0]
+    stack_cnt_children = [0]
+    parent = 0
+
+    for token in seq.split():
+        if token == '{':
+            parent = stack_parent[-1]
+            stack_cnt_children.append(0)
+        elif token == '}':
+            cnt_children = stack_cnt_children.pop()
+            if cnt_children > 0:
+                del stack_parent[-cnt_children:]
+            parent = stack_parent[-1 - stack_cnt_children[-1]]
+        else:
+            types.append(Widget[token].value)
+            parents.append(parent)
+            stack_parent.append(len(types) - 1)
+            stack_cnt_children[-1] += 1
+
+    return types, parents
+
+
+def make_children_lists(parents):
+    children = [[] for _ in parents]
+    for node, parent in enumerate(parents):
+        if parent >= 0:
+            children[parent].append(node)
+    return children
+
+
+def make_post_order(children):
+    """
+    非递归地生成后序遍历（与 layout_utils.post_order_traversal 顺序一致）
+    """
+    post_order = []
+    stack = [(0, 0)]
+    while stack:
+        node, i = stack.pop()
+        if i < len(children[node]):
+            stack.append((node, i + 1))
+            stack.append((children[node][i], 0))
+        else:
+            post_order.append(node)
+    return post_order
+
+
+class ArrayTree(object):
+    """
+    数组形式的布局树（供 score.max_score_array 使用）。节点为布局内编号，子节点以 CSR 形式保存：
+    节点 u 的子节点为 children[child_ptr[u]:child_ptr[u + 1]]
+    """
+    __slots__ = ('types', 'child_ptr', 'children', 'post_order', 'subtree_ids', '_levels')
+
+    def __init__(self, types, child_ptr, children, post_order, subtree_ids=None):
+        self.types = types
+        self.child_ptr = child_ptr
+        self.children = children
+        self.post_order = post_order
+        self.subtree_ids = subtree_ids  # 子树结构编号（仅来自索引的布局树有）
+        self._levels = None
+
+    def __len__(self):
+        return len(self.types)
+
+    def num_children(self):
+        return np.diff(self.child_ptr)
+
+    def node_children(self, u):
+        return self.children[self.child_ptr[u]:self.child_ptr[u + 1]]
+
+    def levels(self):
+        """
+        按高度（叶子为 0）对非叶子节点分组，同一组内节点互不为祖先，可以整组向量化计算
+        :return: [(nodes, children_concat, starts)]，按高度升序；starts 为各节点子节点在 children_concat 中的起点
+        """
+        if self._levels is None:
+            height = np.zeros(len(self), dtype=np.int32)
+            for u in self.post_order:
+                u_children = self.node_children(u)
+                if len(u_children) > 0:
+                    height[u] = height[u_children].max() + 1
+            self._levels = []
+            for h in range(1, height.max() + 1 if len(self) > 0 else 1):
+                nodes = np.flatnonzero(height == h)
+                segments = [self.node_children(u) for u in nodes]
+                starts = np.cumsum([0] + [len(seg) for seg in segments[:-1]])
+                self._levels.append((nodes, np.concatenate(segments), starts))
+        return self._levels
+
+
+def make_array_tree(types, parents):
+    l_children = make_children_lists(parents)
+    child_ptr = np.cumsum([0] + [len(c) for c in l_children])
+    children = np.array([c for cs in l_children for c in cs], dtype=np.int32)
+    return ArrayTree(np.array(types, dtype=np.int8), child_ptr, children,
+                     np.array(make_post_order(l_children), dtype=np.int32))
+
+
+def array_tree_from_sequence(seq):
+    """
+    解析布局序列为 ArrayTree（节点编号与 create_layout_tree 一致）
+    """
+    types, parents = parse_sequence(seq)
+    return make_array_tree(types, parents)
+
+
+def array_tree_from_nodes(nd, post_order):
+    """
+    将 create_layout_tree 生成的节点字典（或其中以 post_order 表示的一棵子树）转换为 ArrayTree，节点按先序重新编号
+    :param nd: 节点字典 { idx(str): MatchTreeNode }
+    :param post_order: 树（子树）的后序遍历
+    :return: ArrayTree
+    """
+    root = nd[post_order[-1]].tree_node
+    types, parents = [], []
+    stack = [(root, -1)]
+    while stack:
+        tree_node, parent = stack.pop()
+        types.append(nd[tree_node.name].widget_type.value)
+        parents.append(parent)
+        for child in reversed(tree_node.children):
+            stack.append((child, len(types) - 1))
+    return make_array_tree(types, parents)
+
+
+def split_list_items(tree):
+    """
+    与 layout_utils.split_list_item_subtree 相同：解除 tree 中所有 List 节点的子项，第一个（先序）含有子项的 List 的第一个
+    子项作为输入布局的表项。score.cal_simi_score 中的主布局与表项即为这里返回的两棵树
+    :param tree: 输入布局的 ArrayTree
+    :return: (主布局 ArrayTree, 表项 ArrayTree)，不含 List 表项时为 (tree, None)
+    """
+    list_value = Widget.List.value
+    item_root = None
+    stack = [0]
+    while stack and item_root is None:
+        u = stack.pop()
+        u_children = tree.node_children(u)
+        if tree.types[u] == list_value and len(u_children) > 0:
+            item_root = int(u_children[0])
+        stack.extend(reversed(u_children.tolist()))
+    if item_root is None:
+        return tree, None
+
+    def subtree(root):
+        # 先序重新编号（与 array_tree_from_nodes 一致），不进入 List 的子节点
+        types, parents = [], []
+        stack = [(root, -1)]
+        while stack:
+            u, parent = stack.pop()
+            types.append(int(tree.types[u]))
+            parents.append(parent)
+            if tree.types[u] != list_value:
+                for child in reversed(tree.node_children(u).tolist()):
+                    stack.append((child, len(types) - 1))
+        return make_array_tree(types, parents)
+
+    return subtree(0), subtree(item_root)
+
+
+def num_sequence_tokens(tree):
+    """
+    ArrayTree 对应的布局序列长度（每个节点一个 token，有子节点时另加 '{' 与 '}'）
+    """
+    return len(tree) + 2 * int(np.count_nonzero(tree.num_children()))
+
+
+def make_subtree_ids(types, l_children, post_order, subtree_table):
+    """
+    hash-consing：为每个节点所在子树分配结构编号。max_score 的递推与子节点顺序无关，因此以
+    (节点类型, 排序后的子节点编号) 作为键，结构相同（忽略子节点顺序）的子树得到相同编号
+    :param subtree_table: 键到编号的字典（在整个索引中共享）
+    :return: 子树编号列表
+    """
+    subtree_ids = [0] * len(types)
+    for node in post_order:
+        key = (types[node], tuple(sorted(subtree_ids[c] for c in l_children[node])))
+        subtree_ids[node] = subtree_table.setdefault(key, len(subtree_table))
+    return subtree_ids
+
+
+def list_repo_files(repo_dir):
+    """
+    资产库中的布局序列文件（不含 exec.py 正在写入的 *.tmp.lst 中间文件）
+    """
+    return sorted(f for f in os.listdir(repo_dir)
+                  if f.endswith('.lst') and not f.endswith('.tmp.lst') and not f.startswith('.'))
+
+
+def file_sha1(file_path):
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def make_manifest(repo_dir, files, previous=None):
+    """
+    生成资产库文件清单 { 文件名: {'size', 'mtime', 'sha1'} }。大小与修改时间均未改变的文件直接沿用 previous 中的 sha1
+    :param previous: 上一次的文件清单（可选）
+    """
+    manifest = {}
+    for file_name in files:
+        stat = os.stat(os.path.join(repo_dir, file_name))
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        old_entry = previous.get(file_name) if previous is not None else None
+        if old_entry is not None and old_entry['size'] == entry['size'] and old_entry['mtime'] == entry['mtime']:
+            entry['sha1'] = old_entry['sha1']
+        else:
+            entry['sha1'] = file_sha1(os.path.join(repo_dir, file_name))
+        manifest[file_name] = entry
+    return manifest
+
+
+def unit_digest(layout_type, seq):
+    return hashlib.sha1((str(layout_type) + ' ' + seq).encode('utf-8')).hexdigest()
+
+
+class IndexBuilder(object):
+    """
+    逐文件、逐行收集索引数组。新的单元由布局序列解析得到（add_sequence_unit），或从已有索引中直接复制（add_index_unit）
+    """
+
+    def __init__(self, subtree_table=None):
+        self.files, self.packages, self.names = [], [], []
+        self.node_offsets = [0]
+        self.types, self.parents, self.child_ptr, self.children, self.post_order, self.subtree_ids = \
+            [], [], [0], [], [], []
+        self.unit_types, self.unit_digests, self.unit_origins = [], [], []
+        self.layout_types, self.num_tokens, self.file_ids, self.entry_units = [], [], [], []
+        self.subtree_table = subtree_table if subtree_table is not None else {}
+        self.unit_table = {}  # 单元摘要 -> 单元编号
+
+    def add_file(self, file_name):
+        self.files.append(file_name)
+        self.packages.append(file_name.split('-')[0])
+        return len(self.files) - 1
+
+    def add_entry(self, file_id, layout_type, name, num_tokens, unit):
+        self.layout_types.append(layout_type)
+        self.num_tokens.append(num_tokens)
+        self.file_ids.append(file_id)
+        self.entry_units.append(unit)
+        self.names.append(name)
+
+    def add_sequence_unit(self, layout_type, seq, digest):
+        l_types, l_parents = parse_sequence(seq)
+        l_children = make_children_lists(l_parents)
+
+        self.types.extend(l_types)
+        self.parents.extend(l_parents)
+        for c in l_children:
+            self.children.extend(c)
+            self.child_ptr.append(len(self.children))
+        l_post_order = make_post_order(l_children)
+        self.post_order.extend(l_post_order)
+        self.subtree_ids.extend(make_subtree_ids(l_types, l_children, l_post_order, self.subtree_table))
+        return self.finish_unit(layout_type, digest, -1)
+
+    def add_index_unit(self, index, u):
+        """
+        复制已有索引中的第 u 个单元（子树编号沿用，要求 subtree_table 来自同一个索引）
+        """
+        beg, end = int(index.node_offsets[u]), int(index.node_offsets[u + 1])
+        types, child_ptr, children, post_order = index.layout_arrays(u)
+        self.types.extend(types.tolist())
+        self.parents.extend(index.parents[beg:end].tolist())
+        self.child_ptr.extend((child_ptr[1:] + len(self.children)).tolist())
+        self.children.extend(children.tolist())
+        self.post_order.extend(post_order.tolist())
+        self.subtree_ids.extend(index.subtree_ids[beg:end].tolist())
+        return self.finish_unit(int(index.unit_types[u]), index.unit_digests[u].decode('ascii'), u)
+
+    def finish_unit(self, layout_type, digest, origin):
+        self.node_offsets.append(len(self.types))
+        self.unit_types.append(layout_type)
+        self.unit_digests.append(digest)
+        self.unit_origins.append(origin)
+        unit = self.unit_table[digest] = len(self.unit_table)
+        return unit
+
+    def add_lst_file(self, repo_dir, file_name):
+        """
+        解析一个布局序列文件，类型与序列均相同的行合并为同一个评分单元
+        """
+        file_id = self.add_file(file_name)
+        with open(os.path.join(repo_dir, file_name), 'r') as f:
+            for line in f:
+                line_sp = line.split()
+                if len(line_sp) < 3 or int(line_sp[2]) == 0:
+                    continue
+                layout_type = int(line_sp[0])
+                seq = ' '.join(line_sp[3:])
+                digest = unit_digest(layout_type, seq)
+                unit = self.unit_table.get(digest)
+                if unit is None:
+                    unit = self.add_sequence_unit(layout_type, seq, digest)
+                self.add_entry(file_id, layout_type, line_sp[1], int(line_sp[2]), unit)
+
+    def add_index_file(self, index, old_file_id):
+        """
+        从已有索引中复制一个文件的所有行（文件内容未改变时使用，不再解析序列）
+        """
+        file_id = self.add_file(index.files[old_file_id])
+        beg, end = np.searchsorted(index.file_ids, [old_file_id, old_file_id + 1])
+        for i in range(beg, end):
+            u = int(index.entry_units[i])
+            unit = self.unit_table.get(index.unit_digests[u].decode('ascii'))
+            if unit is None:
+                unit = self.add_index_unit(index, u)
+            self.add_entry(file_id, int(index.layout_types[i]), index.names[i], int(index.num_tokens[i]), unit)
+
+    def subtree_arrays(self):
+        """
+        将 subtree_table 保存为数组：编号 s 的子树根类型为 subtree_types[s]，子节点子树编号（已排序）为
+        subtree_children[subtree_child_ptr[s]:subtree_child_ptr[s + 1]]
+        """
+        keys = sorted(self.subtree_table, key=self.subtree_table.get)
+        subtree_types = np.array([key[0] for key in keys], dtype=np.int8)
+        subtree_child_ptr = np.cumsum([0] + [len(key[1]) for key in keys])
+        subtree_children = np.array([c for key in keys for c in key[1]], dtype=np.int32)
+        return subtree_types, subtree_child_ptr.astype(np.int64), subtree_children
+
+    def save(self, out_dir, manifest, previous_index_id=None, keep_files=()):
+        """
+        写入临时目录后整体替换 out_dir
+        :param manifest: 资产库文件清单
+        :param previous_index_id: 增量更新时为更新前索引的编号（unit_origins 中的单元编号属于该索引）
+        :param keep_files: 需要从旧索引目录中保留的其他文件（如自身得分缓存）
+        """
+        subtree_types, subtree_child_ptr, subtree_children = self.subtree_arrays()
+        entry_units = np.array(self.entry_units, dtype=np.int32)
+        # 倒排表：每个单元对应的行按行号升序排列
+        postings = np.argsort(entry_units, kind='stable').astype(np.int32)
+        posting_ptr = np.concatenate([[0], np.cumsum(np.bincount(entry_units, minlength=len(self.unit_types)))])
+
+        arrays = {
+            'node_offsets': np.array(self.node_offsets, dtype=np.int64),
+            'types': np.array(self.types, dtype=np.int8),
+            'parents': np.array(self.parents, dtype=np.int32),
+            'child_ptr': np.array(self.child_ptr, dtype=np.int64),
+            'children': np.array(self.children, dtype=np.int32),
+            'post_order': np.array(self.post_order, dtype=np.int32),
+            'subtree_ids': np.array(self.subtree_ids, dtype=np.int32),
+            'unit_types': np.array(self.unit_types, dtype=np.int8),
+            'unit_digests': np.array(self.unit_digests, dtype='S40'),
+            'unit_origins': np.array(self.unit_origins, dtype=np.int32),
+            'posting_ptr': posting_ptr.astype(np.int64),
+            'postings': postings,
+            'layout_types': np.array(self.layout_types, dtype=np.int8),
+            'num_tokens': np.array(self.num_tokens, dtype=np.int32),
+            'file_ids': np.array(self.file_ids, dtype=np.int32),
+            'entry_units': entry_units,
+            'subtree_types': subtree_types,
+            'subtree_child_ptr': subtree_child_ptr,
+            'subtree_children': subtree_children,
+        }
+        meta = {'version': INDEX_VERSION, 'index_id': uuid.uuid4().hex, 'previous_index_id': previous_index_id,
+                'files': self.files, 'packages': self.packages, 'names': self.names, 'manifest': manifest}
+
+        tmp_dir = out_dir.rstrip(os.sep) + '.tmp'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmp_dir, name + '.npy'), arr)
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        for file_name in keep_files:
+            shutil.copy2(os.path.join(out_dir, file_name), os.path.join(tmp_dir, file_name))
+
+        replace_dir(tmp_dir, out_dir)
+
+
+def build_index(repo_dir, out_dir):
+    """
+    读取 repo_dir 中的所有布局序列文件，编译为二进制索引保存到 out_dir（先写入临时目录再整体替换）。
+    类型与序列均相同的行合并为同一个评分单元
+    :param repo_dir: 布局序列文件目录
+    :param out_dir: 索引目录
+    :return: (索引中的布局数目, 评分单元数目)
+    """
+    files = list_repo_files(repo_dir)
+    builder = IndexBuilder()
+    for file_name in files:
+        builder.add_lst_file(repo_dir, file_name)
+    builder.save(out_dir, make_manifest(repo_dir, files))
+    return len(builder.names), len(builder.unit_types)
+
+
+def read_index_version(path):
+    meta_path = os.path.join(path, 'meta.json')
+    if not os.path.isfile(meta_path):
+        return None
+    with open(meta_path, 'r') as f:
+        return json.load(f).get('version')
+
+
+def update_index(repo_dir, out_dir):
+    """
+    根据文件清单增量更新索引：只重新解析新增或内容改变的文件，删除已不存在的文件，未改变文件的行直接从旧索引中复制。
+    索引不存在或版本不符时完整重建。
+    更新后的单元编号、布局顺序与完整重建的结果一致（子树编号沿用旧索引，仅编号数值可能不同）
+    :param repo_dir: 布局序列文件目录
+    :param out_dir: 索引目录
+    :return: (新增文件数, 改变文件数, 删除文件数, 未改变文件数)
+    """
+    files = list_repo_files(repo_dir)
+    if read_index_version(out_dir) != INDEX_VERSION:
+        build_index(repo_dir, out_dir)
+        return len(files), 0, 0, 0
+
+    index = LayoutIndex(out_dir)
+    manifest = make_manifest(repo_dir, files, index.manifest)
+    old_file_ids = {file_name: file_id for file_id, file_name in enumerate(index.files)}
+    added = [f for f in files if f not in old_file_ids]
+    changed = [f for f in files if f in old_file_ids and manifest[f]['sha1'] != index.manifest[f]['sha1']]
+    removed = [f for f in index.files if f not in manifest]
+    num_unchanged = len(files) - len(added) - len(changed)
+    if len(added) == 0 and len(changed) == 0 and len(removed) == 0:
+        if manifest != index.manifest:  # 仅修改时间改变，只更新清单
+            index.save_manifest(manifest)
+        return 0, 0, 0, num_unchanged
+
+    builder = IndexBuilder(index.subtree_table())
+    for file_name in files:
+        if file_name in old_file_ids and file_name not in changed:
+            builder.add_index_file(index, old_file_ids[file_name])
+        else:
+            builder.add_lst_file(repo_dir, file_name)
+
+    index_files = set(name + '.npy' for name in ARRAY_NAMES) | {'meta.json'}
+    keep_files = [f for f in os.listdir(out_dir) if f not in index_files and not f.endswith('.tmp')]
+    builder.save(out_dir, manifest, index.index_id, keep_files)
+    return len(added), len(changed), len(removed), num_unchanged
+
+
+def replace_dir(src_dir, dst_dir):
+    """
+    用 src_dir 替换 dst_dir（已打开的 mmap 仍然指向旧文件，不受影响）
+    """
+    old_dir = dst_dir.rstrip(os.sep) + '.old'
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+    if os.path.exists(dst_dir):
+        os.rename(dst_dir, old_dir)
+    os.rename(src_dir, dst_dir)
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+
+
+class LayoutIndex(object):
+    """
+    只读加载的布局资产库索引。数组通过 np.load(mmap_mode='r') 映射，多个进程可共享同一份页缓存。
+    len(index) 为资产库中的布局（行）数，行号 i 用于 layout_id / package；布局树相关的方法均以评分单元编号 u 为参数
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        if meta['version'] != INDEX_VERSION:
+            raise Exception('Layout index version ' + str(meta['version']) + ' is not supported, please rebuild.')
+        self.index_id = meta['index_id']
+        self.previous_index_id = meta['previous_index_id']
+        self.files = meta['files']
+        self.packages = meta['packages']
+        self.names = meta['names']
+        self.manifest = meta['manifest']
+        for name in ARRAY_NAMES:
+            setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+        self._histograms = None
+        self._items = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def num_units(self):
+        return len(self.unit_types)
+
+    def subtree_table(self):
+        """
+        还原子树结构编号表 { (类型, 子节点子树编号): 编号 }
+        """
+        subtree_types = self.subtree_types.tolist()
+        subtree_child_ptr = self.subtree_child_ptr.tolist()
+        subtree_children = self.subtree_children.tolist()
+        return {(t, tuple(subtree_children[subtree_child_ptr[s]:subtree_child_ptr[s + 1]])): s
+                for s, t in enumerate(subtree_types)}
+
+    def save_manifest(self, manifest):
+        meta_path = os.path.join(self.path, 'meta.json')
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        meta['manifest'] = manifest
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+        self.manifest = manifest
+
+    def package(self, i):
+        return self.packages[self.file_ids[i]]
+
+    def layout_id(self, i):
+        return self.package(i) + ':' + self.names[i]
+
+    def unit_postings(self, u):
+        """
+        第 u 个单元对应的所有行号（升序）
+        """
+        return self.postings[self.posting_ptr[u]:self.posting_ptr[u + 1]]
+
+    def unit_layout_ids(self, u):
+        return [self.layout_id(i) for i in self.unit_postings(u)]
+
+    def num_nodes(self, u):
+        return int(self.node_offsets[u + 1] - self.node_offsets[u])
+
+    def layout_arrays(self, u):
+        """
+        第 u 个单元的数组视图（节点编号均为单元内编号）
+        :return: types, child_ptr（从 0 开始）, children, post_order
+        """
+        beg, end = int(self.node_offsets[u]), int(self.node_offsets[u + 1])
+        child_ptr = np.asarray(self.child_ptr[beg:end + 1])
+        return (np.asarray(self.types[beg:end]), child_ptr - child_ptr[0],
+                np.asarray(self.children[child_ptr[0]:child_ptr[-1]]), np.asarray(self.post_order[beg:end]))
+
+    def package_items(self, package):
+        """
+        包中所有 item（布局类型为 2）的行号及序列长度，按 (序列长度, 行号) 升序排列，可用二分查找选出长度相近的 item。
+        首次调用时为所有包建立
+        :return: (行号数组, 序列长度数组)
+        """
+        if self._items is None:
+            items = np.flatnonzero(np.asarray(self.layout_types) == 2)
+            num_tokens = np.asarray(self.num_tokens)[items]
+            items = items[np.lexsort((items, num_tokens))]
+            item_packages = np.array([self.package(i) for i in items], dtype=object)
+            self._items = {}
+            for item_package in set(item_packages):
+                package_items = items[item_packages == item_package]
+                self._items[item_package] = (package_items, np.asarray(self.num_tokens)[package_items])
+        return self._items.get(package, (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32)))
+
+    def type_histograms(self):
+        """
+        每个单元中各控件类型的节点数目（单元数 x 控件类型数），首次调用时计算
+        """
+        if self._histograms is None:
+            num_units = self.num_units()
+            unit_of_node = np.repeat(np.arange(num_units), np.diff(self.node_offsets))
+            num_types = len(Widget)
+            self._histograms = np.bincount(unit_of_node * num_types + self.types,
+                                           minlength=num_units * num_types).reshape(num_units, num_types)
+        return self._histograms
+
+    def array_tree(self, u):
+        beg, end = int(self.node_offsets[u]), int(self.node_offsets[u + 1])
+        return ArrayTree(*self.layout_arrays(u), subtree_ids=np.asarray(self.subtree_ids[beg:end]))
+
+    def tree(self, u):
+        """
+        还原第 u 个单元为 max_score 可直接使用的节点字典与后序遍历
+        :return: nd { idx(str): MatchTreeNode }, post_order [idx(str)]
+        """
+        types, child_ptr, children, post_order = self.layout_arrays(u)
+        tree_nodes = [IndexTreeNode(str(j)) for j in range(len(types))]
+        nd = {}
+        for j, tree_node in enumerate(tree_nodes):
+            tree_node.children = [tree_nodes[c] for c in children[child_ptr[j]:child_ptr[j + 1]]]
+            nd[tree_node.name] = MatchTreeNode(Widget(int(types[j])), tree_node)
+        return nd, [str(j) for j in post_order]
+
+
+if __name__ == '__main__':
+    start_time = time.time()
+    print('---------------------------------')
+
+    if MODE == 'build':
+        print('>>> Building layout index from', seq_dir, '...', end=' ')
+        num_layouts, num_units = build_index(seq_dir, index_dir)
+        print('OK')
+        print('<<<', num_layouts, 'layouts (' + str(num_units), 'distinct) saved in', index_dir)
+
+    if MODE == 'update':
+        print('>>> Updating layout index', index_dir, 'from', seq_dir, '...', end=' ')
+        num_added, num_changed, num_removed, num_unchanged = update_index(seq_dir, index_dir)
+        print('OK')
+        print('<<< Files added:', num_added, '| Changed:', num_changed, '| Removed:', num_removed,
+              '| Unchanged:', num_unchanged)
+
+    print('---------------------------------')
+    print('Duration: {:.2f} s'.format(time.time() - start_time))
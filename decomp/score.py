@@ -4,21 +4,29 @@
 """ 计算输入的布局序列与资产库序列列表之间的相似度，降序输出相似度高的序列
 """
 
+import hashlib
+import itertools
+import json
 import operator
 import os
 import time
+from collections import OrderedDict
 from configparser import ConfigParser
 
-import networkx as nx
 import numpy as np
 
-from decomp.layout_utils import create_layout_tree, post_order_traversal, dfs_make_tokens
+from decomp.layout_index import LayoutIndex, array_tree_from_sequence, array_tree_from_nodes
+from decomp.layout_utils import create_layout_tree, post_order_traversal, dfs_make_tokens, split_list_item_subtree
+from decomp.matching import max_weight_assignment
+from utils.widget import Widget
 
 cfg = ConfigParser()
 cfg.read('../config.ini')
 
 # Notice: 将 config.ini 中的 apk_tokens_dir 路径改为所有 layout 文件所在的目录文件夹地址，然后替换最下面的 'replace_here'
 seq_dir = cfg.get('decode', 'apk_tokens_dir')
+# 预编译索引目录（存在时优先使用索引，避免每次查询重新解析整个资产库）
+index_dir = cfg.get('decode', 'layout_index_dir')
 
 # Layout = 0
 # TextView = 1
@@ -54,6 +62,21 @@ weights = [[5, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 10, 0],  # 0
 dist_penalty = 5
 num_children_penalty = 5
 
+MODE = 'search'  # search check
+
+# 查询时间预算（秒），为 None 时完整扫描资产库
+TIME_BUDGET = None
+
+# 资产库中节点数不小于该值的 layout 不参与匹配
+MAX_LAYOUT_NODES = 200
+
+# 只匹配序列长度与输入布局表项相差不超过该值的 item
+ITEM_TOKENS_WINDOW = 10
+
+# 保存在索引目录中的候选布局自身得分 max_score(c, c) 及其对应的权重/惩罚指纹
+SELF_SCORES_NPY = 'self_scores.npy'
+SELF_SCORES_JSON = 'self_scores.json'
+
 
 def max_score(nd1, post_order1, nd2, post_order2):
     """
@@ -82,20 +105,12 @@ def max_score(nd1, post_order1, nd2, post_order2):
 
             matrix[int(u)][int(v)][1] = max(m1a, m1b, m2a, m2b) - dist_penalty
 
-            bi_graph = nx.Graph()
-            bi_graph.add_nodes_from([int(c.name) for c in u_children])
-            bi_graph.add_nodes_from([int(c.name) + 1000 for c in v_children])
-
             max_weighted_match = 0
             children_mismatch_penalty = 0
             if len(u_children) > 0 and len(v_children) > 0:
-                for uc in u_children:
-                    for vc in v_children:
-                        weight = max(matrix[int(uc.name)][int(vc.name)][1],
-                                     matrix[int(uc.name)][int(vc.name)][0] + 0)
-                        bi_graph.add_edge(int(uc.name), int(vc.name) + 1000, weight=weight)
-                pairs = nx.max_weight_matching(bi_graph)
-                max_weighted_match = sum([bi_graph[pair[0]][pair[1]]['weight'] for pair in pairs])
+                # 子节点之间的边权取 "匹配" 与 "跳过一层后匹配" 两者中的较大值
+                sub_matrix = matrix[np.ix_([int(c.name) for c in u_children], [int(c.name) for c in v_children])]
+                max_weighted_match = max_weight_assignment(sub_matrix.max(axis=2))
 
                 # 加入惩罚机制。子节点数目不匹配的两个节点，按照子节点数目
                 children_mismatch_penalty = abs(len(u_children) - len(v_children)) * num_children_penalty
@@ -106,6 +121,307 @@ def max_score(nd1, post_order1, nd2, post_order2):
     return matrix[:, :, 0].max()
 
 
+class SubtreeMemo(object):
+    """
+    单个输入布局的 DP 列缓存。matrix[:, v] 只取决于输入布局和以 v 为根的候选子树，因此以候选子树的结构编号
+    （LayoutIndex 中的 subtree_ids）为键缓存整列及该子树内的最大得分，资产库中重复出现的子树对同一个输入布局只计算一次。
+    容量以列数计，超出时淘汰最久未使用的列
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.columns = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.columns.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.columns.move_to_end(key)
+        return entry
+
+    def put(self, key, column, subtree_max):
+        self.columns[key] = (column, subtree_max)
+        if len(self.columns) > self.capacity:
+            self.columns.popitem(last=False)
+
+
+class DPWorkspace(object):
+    """
+    max_score_array 的 DP 缓冲区，在一次搜索的所有候选布局之间复用，只在候选布局更大时扩大，避免每个候选重新分配
+    (候选节点数 x 输入节点数 x 2) 的数组。同一个 DPWorkspace 不能被多个线程同时使用。
+    dtype 可选 float32 以减少内存带宽：权重与惩罚均为整数，DP 中的所有值都是绝对值小于 2^24 的整数
+    （MAX_LAYOUT_NODES 个节点、最大权重 100 时不超过 2 * 10^4），float32 的结果与 float64 完全相同；
+    若改用非整数权重，得分的相对误差约为 节点数 * 2^-24（200 个节点时约 1.2e-5）
+    """
+
+    def __init__(self, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        self.weights = np.array(weights, dtype=self.dtype)  # 创建时的权重矩阵
+        self.buffer = np.empty(0, dtype=self.dtype)
+        self.vectors = np.empty((4, 0), dtype=self.dtype)
+
+    def matrix(self, num_nodes2, num_nodes1):
+        """
+        :return: (num_nodes2, num_nodes1, 2) 的连续数组（内容未初始化）
+        """
+        size = num_nodes2 * num_nodes1 * 2
+        if size > len(self.buffer):
+            self.buffer = np.empty(max(size, 2 * len(self.buffer)), dtype=self.dtype)
+        return self.buffer[:size].reshape(num_nodes2, num_nodes1, 2)
+
+    def column_vectors(self, num_nodes1):
+        """
+        :return: 逐列计算所需的 4 个长度为 num_nodes1 的向量（内容未初始化）
+        """
+        if num_nodes1 > self.vectors.shape[1]:
+            self.vectors = np.empty((4, max(num_nodes1, 2 * self.vectors.shape[1])), dtype=self.dtype)
+        return self.vectors[:, :num_nodes1]
+
+
+def max_score_array(tree1, tree2, memo=None, workspace=None):
+    """
+    max_score 的数组实现（与 max_score 的递推完全相同，max_score 保留作为参照实现）。
+    按 tree2 的后序逐列计算 matrix[:, v]，每一列对 tree1 的所有节点向量化：
+        m2a/m2b 只依赖 v 的子节点所在的列，整列一次归约得到；
+        m1a/m1b 依赖同一列中 u 的子节点，按 tree1 的节点高度分层归约；
+        子节点匹配中 1 x k 的情形整列向量化，其余情形调用 max_weight_assignment。
+    :param tree1: ArrayTree（待匹配布局树）
+    :param tree2: ArrayTree（资产库布局树）
+    :param memo: tree1 对应的 SubtreeMemo（可选，仅对带有 subtree_ids 的 tree2 生效）。命中的子树不再向下遍历
+    :param workspace: DPWorkspace（可选，为 None 时使用临时的 float64 缓冲区）
+    :return: 最大近似度分数
+    """
+    if workspace is None:
+        workspace = DPWorkspace()
+    num_nodes1 = len(tree1)
+    ptr1, children1 = tree1.child_ptr, tree1.children
+    num_children1 = tree1.num_children()
+    leaves1 = np.flatnonzero(num_children1 == 0)
+    inner1 = np.flatnonzero(num_children1 > 0)
+    single1 = inner1[num_children1[inner1] == 1]
+    multi1 = inner1[num_children1[inner1] > 1]
+    levels1 = tree1.levels()
+
+    # pair_weights[u, v] = weights[type(u)][type(v)]
+    pair_weights = workspace.weights[tree1.types][:, tree2.types]
+    matrix = workspace.matrix(len(tree2), num_nodes1)  # matrix[v, u] 对应 max_score 中的 matrix[u][v]
+    col0, col1, m2, max_weighted_match = workspace.column_vectors(num_nodes1)
+
+    def compute_column(v):
+        v_children = tree2.node_children(v)
+        num_v_children = len(v_children)
+        col0[:] = pair_weights[:, v]
+
+        if num_v_children > 0:
+            children_cols = matrix[v_children]
+            np.maximum(children_cols[:, :, 0].max(axis=0), children_cols[:, :, 1].max(axis=0), out=m2)
+            if len(inner1) > 0:
+                child_weights = children_cols.max(axis=2)
+                max_weighted_match.fill(0)
+                if num_v_children == 1:
+                    max_weighted_match[inner1] = np.maximum(
+                        np.maximum.reduceat(child_weights[0, children1], ptr1[inner1]), 0)
+                else:
+                    max_weighted_match[single1] = np.maximum(
+                        child_weights[:, children1[ptr1[single1]]].max(axis=0), 0)
+                    for u in multi1:
+                        max_weighted_match[u] = max_weight_assignment(child_weights[:, children1[ptr1[u]:ptr1[u + 1]]])
+                np.add(col0, max_weighted_match, out=col0)
+                col0[inner1] -= np.abs(num_children1[inner1] - num_v_children) * num_children_penalty
+        else:
+            m2.fill(0)
+
+        col1[leaves1] = np.maximum(m2[leaves1], 0) - dist_penalty
+        for nodes, nodes_children, starts in levels1:
+            m1 = np.maximum(np.maximum.reduceat(col0[nodes_children], starts),
+                            np.maximum.reduceat(col1[nodes_children], starts))
+            col1[nodes] = np.maximum(m1, m2[nodes]) - dist_penalty
+
+        matrix[v, :, 0] = col0
+        matrix[v, :, 1] = col1
+
+    if memo is None or tree2.subtree_ids is None:
+        for v in tree2.post_order:
+            compute_column(v)
+        return float(matrix[:, :, 0].max())
+
+    # 自顶向下遍历 tree2，命中缓存的子树直接取整列结果，未命中的节点在其子节点之后计算（后序）
+    subtree_max = np.empty(len(tree2))
+    stack = [(tree2.post_order[-1], False)]
+    while stack:
+        v, expanded = stack.pop()
+        key = int(tree2.subtree_ids[v])
+        if not expanded:
+            entry = memo.get(key)
+            if entry is not None:
+                matrix[v], subtree_max[v] = entry
+                continue
+            stack.append((v, True))
+            stack.extend((c, False) for c in tree2.node_children(v))
+        else:
+            compute_column(v)
+            v_children = tree2.node_children(v)
+            subtree_max[v] = matrix[v, :, 0].max()
+            if len(v_children) > 0:
+                subtree_max[v] = max(subtree_max[v], subtree_max[v_children].max())
+            memo.put(key, matrix[v].copy(), subtree_max[v])
+    return float(subtree_max[tree2.post_order[-1]])
+
+
+def max_score_upper_bounds(tree1, histograms):
+    """
+    对每个候选布局计算 max_score(tree1, c) 的上界（可用于剪枝，保证不小于精确得分）。
+    max_score 中的每个 DP 值都是两棵树之间一组互不重叠的节点配对的权重之和减去非负的惩罚，因此不超过两棵树节点类型
+    多重集之间的最大权匹配。这里将该匹配按类型放松：类型为 a 的节点至多与一个节点配对，得分不超过它与对方已有类型之间
+    的最大权重，且配对数不超过对方与 a 之间权重为正的节点总数；分别从两侧估计并取较小者。
+    :param tree1: 输入布局的 ArrayTree
+    :param histograms: 候选布局的控件类型计数矩阵（布局数 x 控件类型数）
+    :return: 上界数组
+    """
+    w = np.array(weights, dtype=np.float64)
+    positive = (w > 0).astype(np.float64)
+    q = np.bincount(tree1.types, minlength=len(w)).astype(np.float64)
+    h = np.asarray(histograms, dtype=np.float64)
+
+    # 从输入布局一侧估计：max_w1[c, a] 为类型 a 与候选布局 c 中已有类型之间的最大权重
+    max_w1 = (w[None, :, :] * (h > 0)[:, None, :]).max(axis=2)
+    ub1 = (np.minimum(q[None, :], h @ positive.T) * max_w1).sum(axis=1)
+
+    # 从候选布局一侧估计
+    max_w2 = (w * (q > 0)[:, None]).max(axis=0)
+    ub2 = (np.minimum(h, (q @ positive)[None, :]) * max_w2[None, :]).sum(axis=1)
+
+    return np.minimum(ub1, ub2)
+
+
+# 特征向量：各控件类型的节点数、最大/平均深度、最大/平均分支数、叶子数、是否含有 List / Toolbar
+NUM_FEATURES = len(Widget) + 7
+
+
+def layout_features(types, parents, num_children, node_offsets):
+    """
+    计算一组布局的特征向量（向量化，布局的节点依次拼接，每个布局的第一个节点为 Dummy Root）
+    :param types: 节点类型
+    :param parents: 节点的父节点（全局编号，Dummy Root 为 -1）
+    :param num_children: 节点的子节点数
+    :param node_offsets: 每个布局的起始节点（长度为布局数 + 1）
+    :return: 布局数 x NUM_FEATURES 的特征矩阵
+    """
+    num_layouts = len(node_offsets) - 1
+    sizes = np.diff(node_offsets)
+    layout_of_node = np.repeat(np.arange(num_layouts), sizes)
+    roots = node_offsets[:-1]
+
+    # 指针跳跃计算深度（Dummy Root 为 0），循环次数为最大深度
+    depth = np.zeros(len(types), dtype=np.int32)
+    ancestors = np.asarray(parents, dtype=np.int64)
+    while True:
+        has_ancestor = ancestors >= 0
+        if not has_ancestor.any():
+            break
+        depth += has_ancestor
+        ancestors = np.where(has_ancestor, parents[np.maximum(ancestors, 0)], -1)
+
+    num_types = len(Widget)
+    counts = np.bincount(layout_of_node * num_types + types, minlength=num_layouts * num_types)
+    counts = counts.reshape(num_layouts, num_types).astype(np.float64)
+    counts[:, Widget.Unclassified.value] -= 1  # 不计 Dummy Root
+
+    num_widgets = np.maximum(sizes - 1, 1)
+    is_internal = num_children > 0
+    features = np.empty((num_layouts, NUM_FEATURES))
+    features[:, :num_types] = counts
+    features[:, num_types] = np.maximum.reduceat(depth, roots)
+    features[:, num_types + 1] = (np.bincount(layout_of_node, weights=depth, minlength=num_layouts)) / num_widgets
+    features[:, num_types + 2] = np.maximum.reduceat(num_children, roots)
+    features[:, num_types + 3] = np.bincount(layout_of_node, weights=num_children, minlength=num_layouts) / \
+        np.maximum(np.bincount(layout_of_node, weights=is_internal, minlength=num_layouts), 1)
+    features[:, num_types + 4] = np.bincount(layout_of_node, weights=~is_internal, minlength=num_layouts)
+    features[:, num_types + 5] = counts[:, Widget.List.value] > 0
+    features[:, num_types + 6] = counts[:, Widget.Toolbar.value] > 0
+    return features
+
+
+def index_features(index):
+    """
+    索引中所有评分单元的特征向量
+    """
+    node_offsets = np.asarray(index.node_offsets)
+    unit_of_node = np.repeat(np.arange(index.num_units()), np.diff(node_offsets))
+    parents = np.asarray(index.parents, dtype=np.int64)
+    parents = np.where(parents >= 0, parents + node_offsets[unit_of_node], -1)
+    return layout_features(np.asarray(index.types, dtype=np.int64), parents, np.diff(index.child_ptr), node_offsets)
+
+
+def tree_features(tree):
+    """
+    单个 ArrayTree 的特征向量
+    """
+    parents = np.full(len(tree), -1, dtype=np.int64)
+    num_children = tree.num_children()
+    parents[tree.children] = np.repeat(np.arange(len(tree)), num_children)
+    return layout_features(np.asarray(tree.types, dtype=np.int64), parents, num_children,
+                           np.array([0, len(tree)]))[0]
+
+
+class FeatureShortlist(object):
+    """
+    近似搜索的第一阶段：将候选单元的特征向量取 log(1 + x) 后按各维标准差归一化，用欧氏距离暴力查找最近的 n 个候选。
+    第二阶段（search.search_shortlist）只对这些候选计算精确的 max_score
+    """
+
+    def __init__(self, index):
+        units = np.arange(index.num_units())
+        self.units = units[(np.asarray(index.unit_types) == 1) &
+                           (np.diff(index.node_offsets) < MAX_LAYOUT_NODES)]
+        features = np.log1p(index_features(index)[self.units])
+        scale = features.std(axis=0)
+        self.scale = np.where(scale > 0, scale, 1)
+        self.features = features / self.scale
+
+    def query(self, tree, n):
+        """
+        :param tree: 输入布局的 ArrayTree
+        :param n: 候选数
+        :return: 距离最近的 n 个候选单元编号（按距离升序，距离相同时按单元编号升序）
+        """
+        q = np.log1p(tree_features(tree)) / self.scale
+        distances = ((self.features - q) ** 2).sum(axis=1)
+        if n < len(self.units):
+            nearest = np.argpartition(distances, n - 1)[:n]
+        else:
+            nearest = np.arange(len(self.units))
+        nearest = nearest[np.lexsort((self.units[nearest], distances[nearest]))]
+        return self.units[nearest]
+
+
+def check_max_score_equivalence(index, num_queries=20):
+    """
+    在资产库上验证 max_score_array 与参照实现 max_score 结果一致：依次取资产库中的单元作为查询，与所有候选单元逐对比较
+    :param index: LayoutIndex
+    :param num_queries: 作为查询的单元数目
+    :return: 比较的布局对数
+    """
+    candidates = [u for u in range(index.num_units()) if index.num_nodes(u) < MAX_LAYOUT_NODES]
+    num_pairs = 0
+    for q in candidates[:num_queries]:
+        q_nd, q_pot = index.tree(q)
+        q_tree = index.array_tree(q)
+        for c in candidates:
+            c_nd, c_pot = index.tree(c)
+            expected = max_score(q_nd, q_pot, c_nd, c_pot)
+            actual = max_score_array(q_tree, index.array_tree(c))
+            if expected != actual:
+                raise Exception('max_score mismatch on ' + index.unit_layout_ids(q)[0] + ' vs ' + index.unit_layout_ids(c)[0] +
+                                ': ' + str(expected) + ' != ' + str(actual))
+            num_pairs += 1
+    return num_pairs
+
+
 def create_tree(sequence):
     """
     输出布局序列的根节点（用于遍历）、节点字典、后序遍历（用于依次比较）
@@ -117,18 +433,191 @@ def create_tree(sequence):
     return root, nd, post_order
 
 
-def cal_simi_score(tree_root, nd, post_order):
+def score_fingerprint():
+    """
+    权重矩阵与惩罚参数的指纹，任一参数改变后缓存的自身得分即失效
+    """
+    params = [weights, dist_penalty, num_children_penalty]
+    return hashlib.sha1(json.dumps(params).encode('utf-8')).hexdigest()
+
+
+def compute_self_scores(index, units=None, self_scores=None):
+    """
+    计算索引中每个评分单元的自身得分。不会参与匹配的单元（节点过多的 layout）记为 nan
+    :param index: LayoutIndex
+    :param units: 需要计算的单元编号（可选，默认全部）
+    :param self_scores: 写入结果的数组（可选，默认新建）
+    :return: 自身得分数组（以单元编号为下标）
+    """
+    if self_scores is None:
+        self_scores = np.full(index.num_units(), np.nan)
+    workspace = DPWorkspace()
+    for u in (range(index.num_units()) if units is None else units):
+        if index.unit_types[u] == 2 or index.num_nodes(u) < MAX_LAYOUT_NODES:
+            c_tree = index.array_tree(u)
+            self_scores[u] = max_score_array(c_tree, c_tree, workspace=workspace)
+    return self_scores
+
+
+def load_self_scores(index):
+    """
+    读取保存在索引目录中的自身得分；不存在、指纹不一致或不属于当前索引时重新计算并保存。
+    索引经过增量更新（layout_index.update_index）时，沿用更新前已计算的单元得分，只计算新解析的单元
+    :param index: LayoutIndex
+    :return: 自身得分数组（mmap 只读）
+    """
+    npy_path = os.path.join(index.path, SELF_SCORES_NPY)
+    json_path = os.path.join(index.path, SELF_SCORES_JSON)
+    fingerprint = score_fingerprint()
+    meta = None
+
+    if os.path.isfile(npy_path) and os.path.isfile(json_path):
+        with open(json_path, 'r') as f:
+            meta = json.load(f)
+        if meta['fingerprint'] != fingerprint:
+            meta = None
+        elif meta.get('index_id') == index.index_id:
+            return np.load(npy_path, mmap_mode='r')
+
+    if meta is not None and index.previous_index_id is not None and meta.get('index_id') == index.previous_index_id:
+        origins = np.asarray(index.unit_origins)
+        new_units = np.flatnonzero(origins < 0)
+        print('>>> Computing self scores of', len(new_units), 'new layouts ...', end=' ')
+        self_scores = np.full(index.num_units(), np.nan)
+        self_scores[origins >= 0] = np.load(npy_path)[origins[origins >= 0]]
+        compute_self_scores(index, new_units, self_scores)
+    else:
+        print('>>> Computing self scores of', index.num_units(), 'layouts ...', end=' ')
+        self_scores = compute_self_scores(index)
+    with open(npy_path + '.tmp', 'wb') as f:
+        np.save(f, self_scores)
+    os.replace(npy_path + '.tmp', npy_path)
+    with open(json_path + '.tmp', 'w') as f:
+        json.dump({'fingerprint': fingerprint, 'index_id': index.index_id}, f)
+    os.replace(json_path + '.tmp', json_path)
+    print('OK')
+    return np.load(npy_path, mmap_mode='r')
+
+
+def iter_lst_layouts(file_path):
+    with open(file_path, 'r') as f:
+        for line in f:
+            line_sp = line.split()
+            len_tks_c = int(line_sp[2])
+            if len_tks_c == 0:
+                continue
+            yield None, int(line_sp[0]), line_sp[1], len_tks_c, array_tree_from_sequence(' '.join(line_sp[3:]))
+
+
+def iter_index_layouts(index, layout_ids):
+    for i in layout_ids:
+        u = int(index.entry_units[i])
+        yield u, int(index.layout_types[i]), index.names[i], int(index.num_tokens[i]), index.array_tree(u)
+
+
+def iter_repo_files(index=None):
+    """
+    按文件遍历布局资产库，依次产生 (package, layouts)。
+    layouts 的每一项为 (u, layout_type, xml_name, len_tks, c_tree)，其中 u 为索引中的评分单元编号（无索引时为 None，
+    序列相同的布局 u 相同），c_tree 为布局的 ArrayTree
+    :param index: 预编译的 LayoutIndex，为 None 时直接解析 seq_dir 中的文件
+    :return:
+    """
+    if index is None:
+        for file_name in os.listdir(seq_dir):
+            if file_name.endswith('.lst'):
+                yield str(file_name.split('-')[0]), iter_lst_layouts(os.path.join(seq_dir, file_name))
+    else:
+        for file_id, layout_ids in itertools.groupby(range(len(index)), key=lambda i: index.file_ids[i]):
+            yield index.packages[file_id], iter_index_layouts(index, layout_ids)
+
+
+def match_package_items(index, package, item_tree, item_self_score_i, len_tks_item, self_scores, item_scores,
+                        workspace=None):
+    """
+    在包的 item 中查找与输入布局的表项最相似的一个。只计算序列长度与表项相差不超过 ITEM_TOKENS_WINDOW 的 item，
+    序列相同的 item 只计算一次（结果保存在 item_scores 中）。相似度相同时取行号最小的 item（与逐行遍历的结果一致）
+    :param index: LayoutIndex
+    :param package: 包名
+    :param item_tree: 输入布局表项的 ArrayTree
+    :param item_self_score_i: 输入布局表项的自身得分
+    :param len_tks_item: 输入布局表项的序列长度
+    :param self_scores: 评分单元的自身得分
+    :param item_scores: { 单元编号: 与输入表项的得分 }，在所有包之间共享
+    :return: (自身得分, 得分, 相似度, xml 名称)，没有匹配的 item 时为 (0, 0, 0, None)
+    """
+    items, item_tokens = index.package_items(package)
+    beg = np.searchsorted(item_tokens, len_tks_item - ITEM_TOKENS_WINDOW, side='left')
+    end = np.searchsorted(item_tokens, len_tks_item + ITEM_TOKENS_WINDOW, side='right')
+    best = (0, 0, 0, None)
+    best_line = None
+    for i in items[beg:end]:
+        u = int(index.entry_units[i])
+        item_self_score_c = self_scores[u]
+        if not item_self_score_c > 0:
+            continue
+        if u not in item_scores:
+            item_scores[u] = max_score_array(item_tree, index.array_tree(u), workspace=workspace)
+        item_lawecse_score_c = item_scores[u]
+        item_simi_score_c = item_lawecse_score_c * item_lawecse_score_c / item_self_score_c / item_self_score_i
+        if item_simi_score_c > best[2] or item_simi_score_c == best[2] and best_line is not None and i < best_line:
+            best = (item_self_score_c, item_lawecse_score_c, item_simi_score_c, index.names[i])
+            best_line = i
+    return best
+
+
+def file_item_matches(index, item_tree, item_self_score_i, len_tks_item, self_scores, workspace=None):
     """
-    将 seq_dir 中每个布局序列与输入布局序列进行相似度计算，返回相似度降序排列结果
+    为资产库的每个文件计算所在包中与输入布局表项最相似的 item（match_package_items），供按评分单元计算的搜索
+    （search.search 等）将 layout 与 item 的得分合并
+    :return: (item 自身得分数组, item 得分数组, item xml 名称列表)，以文件编号为下标，没有匹配的 item 时为 (0, 0, None)
+    """
+    item_self_scores = np.zeros(len(index.files))
+    item_lawecse_scores = np.zeros(len(index.files))
+    item_names = [None] * len(index.files)
+    package_matches = {}
+    item_scores = {}
+    for file_id, package in enumerate(index.packages):
+        if package not in package_matches:
+            package_matches[package] = match_package_items(index, package, item_tree, item_self_score_i, len_tks_item,
+                                                           self_scores, item_scores, workspace)
+        item_self_scores[file_id], item_lawecse_scores[file_id], _, item_names[file_id] = package_matches[package]
+    return item_self_scores, item_lawecse_scores, item_names
+
+
+def budget_candidate_units(index, len_tks):
+    """
+    限时搜索的候选单元：layout（类型为 1）中节点数小于 MAX_LAYOUT_NODES 的单元，按序列长度与输入布局的接近程度排序
+    （越接近越先计算，长度差相同时按单元编号）
+    :param index: LayoutIndex
+    :param len_tks: 输入布局的序列长度
+    :return: 单元编号数组
+    """
+    units = np.flatnonzero((np.asarray(index.unit_types) == 1) & (np.diff(index.node_offsets) < MAX_LAYOUT_NODES))
+    unit_tokens = np.asarray(index.num_tokens)[np.asarray(index.postings)[np.asarray(index.posting_ptr)[units]]]
+    return units[np.argsort(np.abs(unit_tokens - len_tks), kind='stable')]
+
+
+def cal_simi_score(tree_root, nd, post_order, index=None, time_budget=None, stats=None):
+    """
+    将 seq_dir 中每个布局序列与输入布局序列进行相似度计算，返回相似度降序排列结果。
+    给定 time_budget 时为限时搜索：使用索引时按序列长度与输入布局的接近程度依次计算候选布局，超时后返回已计算的结果；
+    不使用索引时按文件顺序计算，超时后不再读取新的文件
     :param tree_root: 待匹配布局树根节点
     :param nd: 待匹配布局树节点字典
     :param post_order: 待匹配布局树后序遍历
+    :param index: 预编译的 LayoutIndex（可选），为 None 时逐个解析 seq_dir 中的文件
+    :param time_budget: 时间预算（秒），为 None 时完整扫描资产库
+    :param stats: dict（可选），写入 complete（是否完整扫描）、coverage（已计算的比例，使用索引时按候选布局数，
+                  否则按文件数）、scored（已计算的布局数）
     :return: 按相似度排序的字典（key: layout_id, value: similarity_score）
     """
+    deadline = time.perf_counter() + time_budget if time_budget is not None else None
     scores_map = {}
 
+    # 输入布局含有 List 时拆出表项，主布局与表项分别匹配（表项得分按 1.5 倍计入）
     item_roots = []
-    # split_list_item_subtree(tree_root, nd, item_roots)
+    split_list_item_subtree(tree_root, nd, item_roots)
     tks_main = []
     tks_item = []
 
@@ -138,87 +627,135 @@ def cal_simi_score(tree_root, nd, post_order):
     print('Input: ' + str(tks_main), len_tks_main)
     print('Searching ...')
 
-    # contains_list = len(item_roots) > 0
-    contains_list = False
+    contains_list = len(item_roots) > 0
 
-    # 新建变量代表待匹配 item 树根节点及其后序遍历，仅当 contains_list 为真时有效
-    post_order_item = None
+    # 新建变量代表待匹配 item 树，仅当 contains_list 为真时有效
+    item_tree = None
 
-    total_self_score_i = max_score(nd, post_order, nd, post_order)  # 自身得分/最大可能得分
+    workspace = DPWorkspace()  # 所有候选布局共用的 DP 缓冲区
+    i_tree = array_tree_from_nodes(nd, post_order)
+    total_self_score_i = max_score_array(i_tree, i_tree, workspace=workspace)  # 自身得分/最大可能得分
+    self_scores = load_self_scores(index) if index is not None else None  # 候选布局的自身得分
+    unit_scores = {}  # 评分单元与输入布局的得分，序列相同的布局只计算一次
+    item_scores = {}  # 评分单元与输入布局表项的得分
     item_self_score_i = 0
 
     if contains_list:
         # todo 目前只处理了所有表项的第一个
         item_root = item_roots[0]
         post_order_item = post_order_traversal(item_root)
-        item_self_score_i = max_score(nd, post_order_item, nd, post_order_item)
+        item_tree = array_tree_from_nodes(nd, post_order_item)
+        item_self_score_i = max_score_array(item_tree, item_tree, workspace=workspace)
         total_self_score_i += item_self_score_i * 1.5
         dfs_make_tokens(item_root, nd, tks_item)
         len_tks_item = len(tks_item)
         print(tks_item, len_tks_item)
 
-    for file_name in os.listdir(seq_dir):
-        if file_name.endswith('.lst'):
-            with open(os.path.join(seq_dir, file_name), 'r') as f:
-
-                # 新建变量代表当需要 item 匹配时记录当前最大近似的 item 文件名和分值
-                max_match_item_self_score = 0
-                max_match_item_lawecse_score = 0
-                max_match_item_simi_score = 0
-                max_match_item_fname = None
-
-                package = str(file_name.split('-')[0])
-
-                for i, line in enumerate(f):
-                    line_sp = line.split()
-                    layout_type = int(line_sp[0])
-                    len_tks_c = int(line_sp[2])
-                    if len_tks_c == 0:
+    def add_layout_score(layout_id, u, c_tree, item_match):
+        """
+        计算一个 layout（与包中最相似的 item 合并）的近似度得分并放入 scores_map
+        """
+        max_match_item_self_score, max_match_item_lawecse_score, _, max_match_item_fname = item_match
+        # 用 package name + main layout + item layout 作为索引
+        key_id = layout_id + '/' + max_match_item_fname if contains_list and max_match_item_fname is not None else layout_id
+        layout_self_score_c = self_scores[u] if u is not None else max_score_array(c_tree, c_tree, workspace=workspace)
+        if u is None:
+            layout_lawecse_score_c = max_score_array(i_tree, c_tree, workspace=workspace)
+        elif u in unit_scores:
+            layout_lawecse_score_c = unit_scores[u]
+        else:
+            layout_lawecse_score_c = unit_scores[u] = max_score_array(i_tree, c_tree, workspace=workspace)
+
+        # 放到 map 中的是计算后的 "近似度得分"
+        total_lawecse_score = layout_lawecse_score_c + max_match_item_lawecse_score * 1.5
+        scores_map[key_id] = total_lawecse_score * total_lawecse_score / total_self_score_i / \
+                             (layout_self_score_c + max_match_item_self_score * 1.5)
+
+        # print(key_id, layout_lawecse_score_c, layout_self_score_c, max_match_item_lawecse_score,
+        #       max_match_item_self_score, total_self_score_i)
+
+    num_scored = 0
+    complete = True
+    if index is not None and deadline is not None:
+        # 限时搜索：按序列长度接近程度依次计算评分单元，得分分发给单元对应的所有行，包的 item 匹配在首次用到时计算
+        candidates = budget_candidate_units(index, len_tks_main)
+        num_candidates = int(np.sum(np.diff(index.posting_ptr)[candidates]))
+        package_item_matches = {}
+        for u in candidates:
+            if time.perf_counter() >= deadline:
+                complete = False
+                break
+            u = int(u)
+            c_tree = index.array_tree(u)
+            for i in index.unit_postings(u):
+                package = index.package(i)
+                if package not in package_item_matches:
+                    package_item_matches[package] = match_package_items(
+                        index, package, item_tree, item_self_score_i, len_tks_item, self_scores, item_scores,
+                        workspace) if contains_list else (0, 0, 0, None)
+                add_layout_score(package + ':' + index.names[i], u, c_tree, package_item_matches[package])
+                num_scored += 1
+        coverage = num_scored / num_candidates if num_candidates > 0 else 1.0
+    else:
+        num_files = 0
+        for package, layouts in iter_repo_files(index):
+            if deadline is not None and time.perf_counter() >= deadline:
+                complete = False
+                break
+            num_files += 1
+
+            # 新建变量代表当需要 item 匹配时记录当前最大近似的 item 文件名和分值
+            max_match_item_self_score = 0
+            max_match_item_lawecse_score = 0
+            max_match_item_simi_score = 0
+            max_match_item_fname = None
+
+            if contains_list and index is not None:
+                # 使用索引中按包建立的 item 列表（文件中 item 总是在 layout 之前，结果与逐行遍历相同）
+                max_match_item_self_score, max_match_item_lawecse_score, max_match_item_simi_score, \
+                    max_match_item_fname = match_package_items(index, package, item_tree, item_self_score_i,
+                                                               len_tks_item, self_scores, item_scores, workspace)
+
+            for u, layout_type, file_name, len_tks_c, c_tree in layouts:
+
+                # if layout_type == 1:
+                #     if abs(
+                #             len_tks_c - len_tks_main) > 30 + len_tks_main / 3 or contains_list and 'List' not in tks_main:
+                #         # print('layout skipped')
+                #         continue
+
+                layout_id = package + ':' + file_name
+
+                # 文件中 2(item) 总是放在 1(layout) 前面
+                if contains_list and layout_type == 2 and index is None:
+                    if abs(len_tks_c - len_tks_item) > ITEM_TOKENS_WINDOW:
                         continue
-
-                    # if layout_type == 1:
-                    #     if abs(
-                    #             len_tks_c - len_tks_main) > 30 + len_tks_main / 3 or contains_list and 'List' not in tks_main:
-                    #         # print('layout skipped')
-                    #         continue
-
-                    file_name = line_sp[1]
-                    layout_id = package + ':' + file_name
-                    tokens = line_sp[3:]
-
-                    cfile_tree_root, cfile_nd, cfile_pot = create_tree(' '.join(tokens))
-
-                    # 文件中 2(item) 总是放在 1(layout) 前面
-                    if contains_list and layout_type == 2:
-                        if abs(len_tks_c - len_tks_item) > 10:
-                            continue
-                        item_lawecse_score_c = max_score(nd, post_order_item, cfile_nd, cfile_pot)
-                        item_self_score_c = max_score(cfile_nd, cfile_pot, cfile_nd, cfile_pot)
-
-                        item_simi_score_c = item_lawecse_score_c * item_lawecse_score_c / \
-                                            item_self_score_c / item_self_score_i if item_self_score_c > 0 else 0
-
-                        if item_simi_score_c > max_match_item_simi_score:
-                            max_match_item_self_score = item_self_score_c
-                            max_match_item_lawecse_score = item_lawecse_score_c
-                            max_match_item_simi_score = item_simi_score_c
-                            max_match_item_fname = file_name
-
-                    # 将每一行代表的 layout 所对应的近似得分保存到 map 中
-                    if layout_type == 1 and len(cfile_nd) < 200:
-                        # 用 package name + main layout + item layout 作为索引
-                        key_id = layout_id + '/' + max_match_item_fname if contains_list and max_match_item_fname is not None else layout_id
-                        layout_self_score_c = max_score(cfile_nd, cfile_pot, cfile_nd, cfile_pot)
-                        layout_lawecse_score_c = max_score(nd, post_order, cfile_nd, cfile_pot)
-
-                        # 放到 map 中的是计算后的 "近似度得分"
-                        total_lawecse_score = layout_lawecse_score_c + max_match_item_lawecse_score * 1.5
-                        scores_map[key_id] = total_lawecse_score * total_lawecse_score / total_self_score_i / \
-                                             (layout_self_score_c + max_match_item_self_score * 1.5)
-
-                        # print(key_id, layout_lawecse_score_c, layout_self_score_c, max_match_item_lawecse_score,
-                        #       max_match_item_self_score, total_self_score_i)
-
+                    item_lawecse_score_c = max_score_array(item_tree, c_tree, workspace=workspace)
+                    item_self_score_c = max_score_array(c_tree, c_tree, workspace=workspace)
+
+                    item_simi_score_c = item_lawecse_score_c * item_lawecse_score_c / \
+                                        item_self_score_c / item_self_score_i if item_self_score_c > 0 else 0
+
+                    if item_simi_score_c > max_match_item_simi_score:
+                        max_match_item_self_score = item_self_score_c
+                        max_match_item_lawecse_score = item_lawecse_score_c
+                        max_match_item_simi_score = item_simi_score_c
+                        max_match_item_fname = file_name
+
+                # 将每一行代表的 layout 所对应的近似得分保存到 map 中
+                if layout_type == 1 and len(c_tree) < MAX_LAYOUT_NODES:
+                    add_layout_score(layout_id, u, c_tree, (max_match_item_self_score, max_match_item_lawecse_score,
+                                                            max_match_item_simi_score, max_match_item_fname))
+                    num_scored += 1
+        if complete:
+            coverage = 1.0
+        else:
+            num_repo_files = len(index.files) if index is not None else \
+                len([file_name for file_name in os.listdir(seq_dir) if file_name.endswith('.lst')])
+            coverage = num_files / num_repo_files
+
+    if stats is not None:
+        stats.update(complete=complete, coverage=coverage, scored=num_scored)
     return sorted(scores_map.items(), key=operator.itemgetter(1), reverse=True)
 
 
@@ -228,14 +765,30 @@ if __name__ == '__main__':
     start_time = time.time()
     print('---------------------------------')
 
-    tree_root, nd, post_order_main = create_tree(seq)
-    sorted_map = cal_simi_score(tree_root, nd, post_order_main)
-
-    print('---------------------------------')
-    print('Matched results:')
-
-    for i, (key, value) in enumerate(sorted_map[:30]):
-        print(i + 1, key, '| %.2f' % (value * 100) + '%')
+    layout_index = LayoutIndex(index_dir) if os.path.isdir(index_dir) else None
+
+    if MODE == 'search':
+        tree_root, nd, post_order_main = create_tree(seq)
+        search_stats = {}
+        sorted_map = cal_simi_score(tree_root, nd, post_order_main, layout_index, TIME_BUDGET, search_stats)
+
+        print('---------------------------------')
+        print('### Complete:', search_stats['complete'], '| Coverage: {:.1%}'.format(search_stats['coverage']),
+              '| Scored:', search_stats['scored'])
+        print('Matched results:')
+
+        for i, (key, value) in enumerate(sorted_map[:30]):
+            print(i + 1, key, '| %.2f' % (value * 100) + '%')
+
+    if MODE == 'check':
+        if layout_index is None:
+            print('### Layout index', index_dir, 'not found, please build the index first (layout_index.py, '
+                  'MODE = \'build\').')
+        else:
+            print('>>> Checking max_score_array against max_score on', index_dir, '...', end=' ')
+            num_pairs = check_max_score_equivalence(layout_index)
+            print('OK')
+            print('<<<', num_pairs, 'layout pairs have identical scores.')
 
     print('---------------------------------')
     print('Duration: {:.2f} s'.format(time.time() - start_time))
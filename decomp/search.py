@@ -0,0 +1,552 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" 基于预编译索引（decomp/layout_index.py）的资产库 top-k 相似度搜索。
+    资产库按 chunk_size 个评分单元（序列相同的布局合并为一个单元）分片，由进程池中的 worker 分别计算，每个单元的得分
+    分发给该单元对应的所有布局，每个 worker 只保留 top-k 结果，最后按 (相似度降序, layout_id 升序) 合并，
+    结果与进程数、分片大小及完成顺序无关。
+    剪枝：每个分片先用 score.max_score_upper_bounds 计算所有候选的相似度上界，按上界降序计算精确得分，
+    一旦上界低于当前第 k 名的相似度，剩余候选均不可能进入 top-k，直接跳过。剪枝不改变搜索结果。
+    子树缓存：同一个输入布局与结构相同的候选子树的 DP 列只计算一次（score.SubtreeMemo），worker 在处理同一次搜索的
+    多个分片时复用缓存。DP 数组使用 score.DPWorkspace 在候选之间复用，精度由 dp_dtype 配置（float64 / float32）。
+    表项匹配：输入布局含有 List 时与 score.cal_simi_score 相同，拆出表项与每个包中的 item 匹配（SearchQuery），
+    搜索结果与 cal_simi_score 完全一致（MODE = 'check' 验证）。
+"""
+
+import heapq
+import itertools
+import os
+import time
+from configparser import ConfigParser
+from multiprocessing import Pool
+
+import numpy as np
+
+from decomp.layout_index import LayoutIndex, array_tree_from_sequence, split_list_items, num_sequence_tokens
+from decomp.score import MAX_LAYOUT_NODES, DPWorkspace, FeatureShortlist, SubtreeMemo, max_score_array, \
+    max_score_upper_bounds, load_self_scores, file_item_matches, cal_simi_score, create_tree
+
+cfg = ConfigParser()
+cfg.read('../config.ini')
+
+index_dir = cfg.get('decode', 'layout_index_dir')
+num_workers = cfg.getint('search', 'workers')
+chunk_size = cfg.getint('search', 'chunk_size')
+top_k = cfg.getint('search', 'top_k')
+memo_size = cfg.getint('search', 'memo_size')
+shortlist_size = cfg.getint('search', 'shortlist_size')
+dp_dtype = cfg.get('search', 'dp_dtype')
+
+MODE = 'search'  # search recall check
+
+NUM_RECALL_QUERIES = 50  # recall 模式中作为查询的布局数
+RECALL_SHORTLIST_SIZES = [25, 50, 100, 200, 400]  # recall 模式中比较的候选数
+
+# check 模式中与 cal_simi_score 比较的输入布局（含有 List 表项与不含 List 两类）
+CHECK_SEQUENCES = [
+    'Layout { Toolbar Layout { TextView TextView List { Layout { ImageView TextView TextView } } } }',
+    'Layout { List { Layout { ImageView TextView } Layout { ImageView TextView } } Button }',
+    'Layout { List { Layout { TextView List { TextView TextView } } } EditText Button }',
+    'Layout { TextView Button }',
+]
+CHECK_TOP_K = [1, 10, 30]  # check 模式中另外比较的结果数（启用剪枝时只计算部分候选）
+
+# worker 进程中加载的索引与自身得分，以及批量搜索时的输入布局（由 init_worker 设置）
+worker_index = None
+worker_self_scores = None
+worker_queries = None
+worker_workspace = None
+# worker 进程中当前搜索的子树缓存（搜索编号, SubtreeMemo）
+worker_memo = (None, None)
+
+# 每次搜索的编号，用于 worker 判断分片是否属于同一次搜索
+search_ids = itertools.count()
+
+
+class RankedItem(object):
+    """
+    top-k 堆中的一项。堆顶为排名最靠后的一项：相似度更低，或相似度相同而 layout_id 更大
+    """
+    __slots__ = ('score', 'layout_id')
+
+    def __init__(self, score, layout_id):
+        self.score = score
+        self.layout_id = layout_id
+
+    def __lt__(self, other):
+        return self.score < other.score or self.score == other.score and self.layout_id > other.layout_id
+
+
+class TopK(object):
+    """
+    容量为 k 的有界堆，保留相似度最高的 k 个布局
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self.heap = []
+
+    def __len__(self):
+        return len(self.heap)
+
+    def threshold(self):
+        """
+        当前第 k 名的相似度（不足 k 项时为 None）
+        """
+        return self.heap[0].score if len(self.heap) >= self.k else None
+
+    def push(self, score, layout_id):
+        item = RankedItem(score, layout_id)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, item)
+        elif self.heap[0] < item:
+            heapq.heapreplace(self.heap, item)
+
+    def items(self):
+        return [(item.score, item.layout_id) for item in self.heap]
+
+
+class SearchQuery(object):
+    """
+    一个输入布局的主布局、自身得分与每个文件的表项匹配结果。
+    与 score.cal_simi_score 相同，输入布局含有 List 时拆出表项（layout_index.split_list_items），主布局与候选 layout 匹配，
+    表项与候选所在包中最相似的 item 匹配，两者得分合并计算相似度（表项按 1.5 倍计入），结果的 layout_id 后附加 item 名称
+    """
+    __slots__ = ('tree', 'self_score', 'item_self_scores', 'item_scores', 'item_names')
+
+    def __init__(self, i_tree, index, self_scores, workspace=None):
+        """
+        :param i_tree: 输入布局的 ArrayTree
+        :param index: LayoutIndex
+        :param self_scores: 评分单元的自身得分
+        :param workspace: DPWorkspace（可选）
+        """
+        self.tree, item_tree = split_list_items(i_tree)
+        self.self_score = max_score_array(self.tree, self.tree, workspace=workspace)
+        self.item_self_scores, self.item_scores, self.item_names = None, None, None
+        if item_tree is not None:
+            item_self_score_i = max_score_array(item_tree, item_tree, workspace=workspace)
+            self.self_score += item_self_score_i * 1.5
+            self.item_self_scores, self.item_scores, self.item_names = file_item_matches(
+                index, item_tree, item_self_score_i, num_sequence_tokens(item_tree), self_scores, workspace)
+
+    def similarity_upper_bounds(self, index, candidates, lawecse_bounds, self_scores_c):
+        """
+        候选单元相似度的上界。含有表项时，表项得分取单元对应的各行所在文件中最有利的值
+        :param candidates: 候选单元编号数组（非空）
+        :param lawecse_bounds: 候选单元 max_score 的上界
+        :param self_scores_c: 候选单元的自身得分
+        """
+        if self.item_names is None:
+            return lawecse_bounds * lawecse_bounds / self.self_score / self_scores_c
+        posting_ptr = np.asarray(index.posting_ptr)
+        counts = posting_ptr[candidates + 1] - posting_ptr[candidates]
+        starts = np.cumsum(counts) - counts
+        layouts = np.asarray(index.postings)[np.arange(counts.sum()) - np.repeat(starts - posting_ptr[candidates], counts)]
+        file_ids = np.asarray(index.file_ids)[layouts]
+        item_lawecse_bounds = np.maximum.reduceat(self.item_scores[file_ids], starts)
+        item_self_bounds = np.minimum.reduceat(self.item_self_scores[file_ids], starts)
+        total_lawecse_bounds = lawecse_bounds + item_lawecse_bounds * 1.5
+        return total_lawecse_bounds * total_lawecse_bounds / self.self_score / (self_scores_c + item_self_bounds * 1.5)
+
+
+def merge_top_k(results, k):
+    """
+    合并多个 top-k 列表，按相似度降序、layout_id 升序排列
+    :param results: [(score, layout_id)] 列表的列表
+    :param k: 保留结果数
+    :return: [(layout_id, score)]
+    """
+    merged = [item for items in results for item in items]
+    merged.sort(key=lambda item: (-item[0], item[1]))
+    return [(layout_id, score) for score, layout_id in merged[:k]]
+
+
+def push_unit(index, result, query, lawecse_score, self_score_c, u):
+    """
+    将单元 u 的得分换算为相似度，分发给它对应的所有布局（含有表项时与每行所在文件的表项匹配结果合并）
+    :param query: SearchQuery
+    :param lawecse_score: 主布局与单元的 max_score
+    :param self_score_c: 单元的自身得分
+    """
+    if query.item_names is None:
+        similarity_score = lawecse_score * lawecse_score / query.self_score / self_score_c
+        for i in index.unit_postings(u):
+            result.push(similarity_score, index.layout_id(i))
+        return
+    for i in index.unit_postings(u):
+        file_id = index.file_ids[i]
+        total_lawecse_score = lawecse_score + query.item_scores[file_id] * 1.5
+        similarity_score = total_lawecse_score * total_lawecse_score / query.self_score / \
+            (self_score_c + query.item_self_scores[file_id] * 1.5)
+        item_name = query.item_names[file_id]
+        layout_id = index.layout_id(i)
+        result.push(similarity_score, layout_id + '/' + item_name if item_name is not None else layout_id)
+
+
+def unit_candidates(index, beg, end):
+    """
+    [beg, end) 范围内参与匹配的单元（layout 类型且节点数小于 MAX_LAYOUT_NODES）
+    """
+    candidates = np.arange(beg, end)
+    return candidates[(np.asarray(index.unit_types[beg:end]) == 1) &
+                      (np.diff(index.node_offsets[beg:end + 1]) < MAX_LAYOUT_NODES)]
+
+
+def score_range(index, self_scores, query, result, beg, end, prune=True, memo=None, workspace=None):
+    """
+    计算索引中 [beg, end) 范围内的评分单元与输入布局的相似度，结果放入 result 中
+    :param query: SearchQuery
+    :param result: TopK
+    :param prune: 是否使用上界剪枝
+    :param memo: 输入布局的 SubtreeMemo（可选）
+    :param workspace: DPWorkspace（可选）
+    :return: (精确计算的单元数, 被剪枝的单元数)
+    """
+    return score_units(index, self_scores, query, result, unit_candidates(index, beg, end), prune, memo, workspace)
+
+
+def score_units(index, self_scores, query, result, candidates, prune=True, memo=None, workspace=None):
+    """
+    计算给定评分单元与输入布局的相似度，结果放入 result 中（参数与返回值同 score_range）
+    """
+    if prune and len(candidates) > 0:
+        upper_bounds = query.similarity_upper_bounds(
+            index, candidates, max_score_upper_bounds(query.tree, index.type_histograms()[candidates]),
+            np.asarray(self_scores)[candidates])
+        order = np.argsort(-upper_bounds, kind='stable')
+        candidates, upper_bounds = candidates[order], upper_bounds[order]
+
+    for j, u in enumerate(candidates):
+        threshold = result.threshold()
+        if prune and threshold is not None and upper_bounds[j] < threshold:
+            return j, len(candidates) - j
+        lawecse_score = max_score_array(query.tree, index.array_tree(u), memo, workspace)
+        push_unit(index, result, query, lawecse_score, self_scores[u], u)
+    return len(candidates), 0
+
+
+def score_batch_range(index, self_scores, queries, results, beg, end, prune=True, memos=None, workspace=None):
+    """
+    批量搜索：[beg, end) 范围内每个评分单元只读取一次，依次与所有输入布局计算相似度
+    :param queries: SearchQuery 列表
+    :param results: 与 queries 一一对应的 TopK 列表
+    :param prune: 是否使用上界剪枝（对每个 (输入布局, 候选布局) 对分别判断）
+    :param memos: 与 queries 一一对应的 SubtreeMemo 列表（可选）
+    :param workspace: DPWorkspace（可选）
+    :return: (精确计算的 (输入布局, 单元) 对数, 被剪枝的对数)
+    """
+    candidates = unit_candidates(index, beg, end)
+    if len(candidates) == 0 or len(queries) == 0:
+        return 0, 0
+
+    if prune:
+        histograms = index.type_histograms()[candidates]
+        c_self_scores = np.asarray(self_scores)[candidates]
+        upper_bounds = np.array([query.similarity_upper_bounds(index, candidates,
+                                                               max_score_upper_bounds(query.tree, histograms),
+                                                               c_self_scores) for query in queries])
+        # 先计算对任一输入布局最有希望的候选，使各输入布局的剪枝阈值尽早提高
+        order = np.argsort(-upper_bounds.max(axis=0), kind='stable')
+        candidates, upper_bounds = candidates[order], upper_bounds[:, order]
+
+    num_scored, num_pruned = 0, 0
+    for j, u in enumerate(candidates):
+        c_tree = index.array_tree(u)
+        for q, query in enumerate(queries):
+            threshold = results[q].threshold()
+            if prune and threshold is not None and upper_bounds[q, j] < threshold:
+                num_pruned += 1
+                continue
+            lawecse_score = max_score_array(query.tree, c_tree, memos[q] if memos is not None else None, workspace)
+            push_unit(index, results[q], query, lawecse_score, self_scores[u], u)
+            num_scored += 1
+    return num_scored, num_pruned
+
+
+def init_worker(index_path, queries=None):
+    global worker_index, worker_self_scores, worker_queries, worker_workspace
+    worker_index = LayoutIndex(index_path)
+    worker_workspace = DPWorkspace(dp_dtype)
+    worker_self_scores = load_self_scores(worker_index)
+    worker_queries = queries
+
+
+def worker_memo_for(search_id, capacity, count=1):
+    """
+    取得 worker 中当前搜索的子树缓存；搜索编号改变时重新创建（批量搜索时为每个输入布局各创建一个）
+    """
+    global worker_memo
+    if capacity <= 0:
+        return None
+    if worker_memo[0] != search_id:
+        memos = [SubtreeMemo(capacity) for _ in range(count)]
+        worker_memo = (search_id, memos)
+    return worker_memo[1]
+
+
+def memo_stats(memos):
+    return sum(memo.hits for memo in memos), sum(memo.misses for memo in memos)
+
+
+def worker_score_range(args):
+    search_id, query, k, beg, end, prune, memo_capacity = args
+    memos = worker_memo_for(search_id, memo_capacity)
+    hits_misses = memo_stats(memos) if memos is not None else (0, 0)
+    result = TopK(k)
+    num_scored, num_pruned = score_range(worker_index, worker_self_scores, query, result, beg, end, prune,
+                                         memos[0] if memos is not None else None, worker_workspace)
+    hits, misses = memo_stats(memos) if memos is not None else (0, 0)
+    return result.items(), num_scored, num_pruned, hits - hits_misses[0], misses - hits_misses[1]
+
+
+def worker_score_batch_range(args):
+    search_id, k, beg, end, prune, memo_capacity = args
+    memos = worker_memo_for(search_id, memo_capacity, len(worker_queries))
+    hits_misses = memo_stats(memos) if memos is not None else (0, 0)
+    results = [TopK(k) for _ in worker_queries]
+    num_scored, num_pruned = score_batch_range(worker_index, worker_self_scores, worker_queries, results, beg, end,
+                                               prune, memos, worker_workspace)
+    hits, misses = memo_stats(memos) if memos is not None else (0, 0)
+    return ([result.items() for result in results], num_scored, num_pruned,
+            hits - hits_misses[0], misses - hits_misses[1])
+
+
+def make_pool(index, workers, queries=None):
+    """
+    创建搜索用进程池。每个 worker 以 mmap 方式打开同一个索引，共享页缓存
+    :param queries: 批量搜索的输入布局，创建 worker 时一次性传入
+    """
+    load_self_scores(index)  # 在主进程中确保自身得分已经缓存，避免 worker 重复计算
+    return Pool(processes=workers, initializer=init_worker, initargs=(index.path, queries))
+
+
+def unit_ranges(index, chunk):
+    num_units = index.num_units()
+    return [(beg, min(beg + chunk, num_units)) for beg in range(0, num_units, chunk)]
+
+
+def next_search_id():
+    return os.getpid(), next(search_ids)
+
+
+def record_stats(stats, counts):
+    """
+    汇总各分片的统计信息 (scored, pruned, memo_hits, memo_misses)
+    """
+    if stats is not None:
+        for key, values in zip(['scored', 'pruned', 'memo_hits', 'memo_misses'], zip(*counts)):
+            stats[key] = sum(values)
+
+
+def search(i_tree, index, k=top_k, workers=num_workers, chunk=chunk_size, pool=None, prune=True, memo_capacity=memo_size,
+           stats=None, self_scores=None):
+    """
+    在资产库中搜索与输入布局最相似的 k 个布局
+    :param i_tree: 输入布局的 ArrayTree
+    :param index: LayoutIndex
+    :param k: 返回结果数
+    :param workers: 进程数（为 1 且未提供 pool 时在当前进程中计算）
+    :param chunk: 每个任务包含的评分单元数
+    :param pool: 已创建的进程池（可选，由 make_pool 创建，可在多次搜索间复用）
+    :param prune: 是否使用上界剪枝（不影响结果）
+    :param memo_capacity: 子树缓存容量（列数），为 0 时不使用缓存（不影响结果）
+    :param stats: 可选的 dict，用于返回统计信息（scored: 精确计算的单元数, pruned: 被剪枝的单元数,
+                  memo_hits / memo_misses: 子树缓存命中/未命中次数）
+    :param self_scores: 已加载的自身得分（可选，由 load_self_scores 返回，常驻服务中可在多次搜索间复用）
+    :return: [(layout_id, similarity_score)]，按相似度降序、layout_id 升序排列
+    """
+    workspace = DPWorkspace(dp_dtype)
+    if self_scores is None:
+        self_scores = load_self_scores(index)
+    query = SearchQuery(i_tree, index, self_scores, workspace)
+    ranges = unit_ranges(index, chunk)
+
+    if pool is None and workers <= 1:
+        # 单进程时所有分片共享同一个 top-k、子树缓存与 DP 缓冲区，剪枝阈值在分片之间传递
+        result = TopK(k)
+        memo = SubtreeMemo(memo_capacity) if memo_capacity > 0 else None
+        counts = [score_range(index, self_scores, query, result, beg, end, prune, memo, workspace)
+                  for beg, end in ranges]
+        results = [result.items()]
+        counts = [(sum(c[0] for c in counts), sum(c[1] for c in counts),
+                   memo.hits if memo is not None else 0, memo.misses if memo is not None else 0)]
+    else:
+        search_id = next_search_id()
+        tasks = [(search_id, query, k, beg, end, prune, memo_capacity) for beg, end in ranges]
+        if pool is None:
+            with make_pool(index, workers) as pool:
+                outputs = list(pool.imap_unordered(worker_score_range, tasks))
+        else:
+            outputs = list(pool.imap_unordered(worker_score_range, tasks))
+        results = [output[0] for output in outputs]
+        counts = [output[1:] for output in outputs]
+
+    record_stats(stats, counts)
+    return merge_top_k(results, k)
+
+
+def search_batch(i_trees, index, k=top_k, workers=num_workers, chunk=chunk_size, prune=True, memo_capacity=memo_size,
+                 stats=None):
+    """
+    批量搜索：一次遍历资产库，为每个输入布局分别返回 top-k 结果。
+    自身得分为 0 的输入布局（如空序列）没有可比较的相似度，结果为空列表
+    :param i_trees: 输入布局的 ArrayTree 列表
+    :param index: LayoutIndex
+    :param k: 每个输入布局返回的结果数
+    :param workers: 进程数
+    :param chunk: 每个任务包含的评分单元数
+    :param prune: 是否使用上界剪枝（不影响结果）
+    :param memo_capacity: 子树缓存的总容量（列数），平均分配给各个输入布局，为 0 时不使用缓存
+    :param stats: 可选的 dict，用于返回统计信息（scored / pruned 为 (输入布局, 单元) 对数，memo_hits / memo_misses 同 search）
+    :return: 与 i_trees 一一对应的 [(layout_id, similarity_score)] 列表
+    """
+    workspace = DPWorkspace(dp_dtype)
+    self_scores = load_self_scores(index)
+    all_queries = [SearchQuery(i_tree, index, self_scores, workspace) for i_tree in i_trees]
+    valid = [q for q, query in enumerate(all_queries) if query.self_score > 0]
+    queries = [all_queries[q] for q in valid]
+    ranges = unit_ranges(index, chunk)
+    query_memo_capacity = memo_capacity // len(queries) if len(queries) > 0 else 0
+
+    if workers <= 1:
+        results = [TopK(k) for _ in queries]
+        memos = [SubtreeMemo(query_memo_capacity) for _ in queries] if query_memo_capacity > 0 else None
+        counts = [score_batch_range(index, self_scores, queries, results, beg, end, prune, memos, workspace)
+                  for beg, end in ranges]
+        partials = [[result.items()] for result in results]
+        hits, misses = memo_stats(memos) if memos is not None else (0, 0)
+        counts = [(sum(c[0] for c in counts), sum(c[1] for c in counts), hits, misses)]
+    else:
+        search_id = next_search_id()
+        tasks = [(search_id, k, beg, end, prune, query_memo_capacity) for beg, end in ranges]
+        with make_pool(index, workers, queries) as pool:
+            outputs = list(pool.imap_unordered(worker_score_batch_range, tasks))
+        partials = [[output[0][q] for output in outputs] for q in range(len(queries))]
+        counts = [output[1:] for output in outputs]
+
+    record_stats(stats, counts)
+
+    merged = [[] for _ in i_trees]
+    for q, partial in zip(valid, partials):
+        merged[q] = merge_top_k(partial, k)
+    return merged
+
+
+def search_shortlist(i_tree, index, shortlist, k=top_k, num_candidates=shortlist_size, prune=True,
+                     memo_capacity=memo_size, stats=None, self_scores=None):
+    """
+    两阶段近似搜索：先由 FeatureShortlist 按特征向量选出最近的 num_candidates 个候选单元，再只对这些候选计算精确得分。
+    结果不保证与 search 一致，召回率见 shortlist_recall
+    :param shortlist: FeatureShortlist
+    :param num_candidates: 第一阶段的候选单元数
+    :param stats: 可选的 dict，scored / pruned 为第二阶段精确计算与剪枝的单元数，skipped 为第一阶段排除的单元数
+    :param self_scores: 已加载的自身得分（可选，同 search）
+    :return: [(layout_id, similarity_score)]，按相似度降序、layout_id 升序排列
+    """
+    workspace = DPWorkspace(dp_dtype)
+    if self_scores is None:
+        self_scores = load_self_scores(index)
+    query = SearchQuery(i_tree, index, self_scores, workspace)
+    candidates = shortlist.query(query.tree, num_candidates)
+    result = TopK(k)
+    memo = SubtreeMemo(memo_capacity) if memo_capacity > 0 else None
+    num_scored, num_pruned = score_units(index, self_scores, query, result, candidates, prune, memo, workspace)
+    if stats is not None:
+        stats['scored'], stats['pruned'] = num_scored, num_pruned
+        stats['skipped'] = len(shortlist.units) - len(candidates)
+        stats['memo_hits'] = memo.hits if memo is not None else 0
+        stats['memo_misses'] = memo.misses if memo is not None else 0
+    return merge_top_k([result.items()], k)
+
+
+def shortlist_recall(exact_results, approx_results):
+    """
+    近似搜索的 recall@k：近似结果中包含的精确 top-k 布局所占的比例（对所有输入布局取平均）
+    :param exact_results: 每个输入布局的精确搜索结果（search / search_batch）
+    :param approx_results: 对应的近似搜索结果（search_shortlist）
+    :return: 平均 recall@k
+    """
+    recalls = []
+    for exact_result, approx_result in zip(exact_results, approx_results):
+        if len(exact_result) > 0:
+            approx_ids = set(layout_id for layout_id, _ in approx_result)
+            recalls.append(sum(layout_id in approx_ids for layout_id, _ in exact_result) / len(exact_result))
+    return float(np.mean(recalls)) if len(recalls) > 0 else 1.0
+
+
+def check_search_equivalence(index, sequences, workers=num_workers):
+    """
+    在资产库上验证 search 与 score.cal_simi_score（使用同一个索引）的结果完全一致，包括含有 List 表项的输入布局。
+    cal_simi_score 的结果按 (相似度降序, layout_id 升序) 排列后与 search 的完整结果及 CHECK_TOP_K 中各个 top-k 比较
+    :param index: LayoutIndex
+    :param sequences: 输入布局序列列表
+    :param workers: 多进程搜索的进程数（另外总是比较单进程搜索）
+    :return: 比较的结果数
+    """
+    num_results = 0
+    for seq in sequences:
+        tree_root, nd, post_order = create_tree(seq)
+        expected = sorted(cal_simi_score(tree_root, nd, post_order, index), key=lambda item: (-item[1], item[0]))
+        i_tree = array_tree_from_sequence(seq)
+        for k in [max(len(expected), 1)] + CHECK_TOP_K:
+            for search_workers in sorted({1, workers}):
+                actual = search(i_tree, index, k=k, workers=search_workers)
+                if actual != expected[:k]:
+                    raise Exception('Search mismatch on ' + seq + ' (k = ' + str(k) + ', workers = ' +
+                                    str(search_workers) + '): ' + str(actual[:3]) + ' != ' + str(expected[:3]))
+                num_results += len(actual)
+    return num_results
+
+
+if __name__ == '__main__':
+    seq = 'Layout { Toolbar Layout { TextView TextView List { Layout { ImageView TextView TextView } } } }'
+
+    start_time = time.time()
+    print('---------------------------------')
+
+    layout_index = LayoutIndex(index_dir)
+
+    if MODE == 'search':
+        print('Input:', seq)
+        print('Searching', len(layout_index), 'layouts (' + str(layout_index.num_units()), 'distinct) with',
+              num_workers, 'workers ...')
+        search_stats = {}
+        if shortlist_size > 0:
+            sorted_map = search_shortlist(array_tree_from_sequence(seq), layout_index, FeatureShortlist(layout_index),
+                                          stats=search_stats)
+        else:
+            sorted_map = search(array_tree_from_sequence(seq), layout_index, stats=search_stats)
+        print('Scored:', search_stats['scored'], '| Pruned:', search_stats['pruned'],
+              '| Memo hits:', search_stats['memo_hits'], '| Memo misses:', search_stats['memo_misses'])
+
+        print('---------------------------------')
+        print('Matched results:')
+
+        for i, (key, value) in enumerate(sorted_map):
+            print(i + 1, key, '| %.2f' % (value * 100) + '%')
+
+    if MODE == 'recall':
+        # 以资产库中均匀间隔的布局作为查询，比较不同候选数下近似搜索的 recall@k 与耗时
+        feature_shortlist = FeatureShortlist(layout_index)
+        step = max(len(feature_shortlist.units) // NUM_RECALL_QUERIES, 1)
+        query_trees = [layout_index.array_tree(u) for u in feature_shortlist.units[::step][:NUM_RECALL_QUERIES]]
+        print('>>> Measuring recall@%d of' % top_k, len(query_trees), 'queries on', len(feature_shortlist.units),
+              'candidates')
+        query_start_time = time.time()
+        exact_results = search_batch(query_trees, layout_index)
+        print('Exact search: {:.2f} s'.format(time.time() - query_start_time))
+        for n in RECALL_SHORTLIST_SIZES:
+            query_start_time = time.time()
+            approx_results = [search_shortlist(i_tree, layout_index, feature_shortlist, num_candidates=n)
+                              for i_tree in query_trees]
+            print('N = %d | recall@%d: %.3f | shortlist search: %.2f s' %
+                  (n, top_k, shortlist_recall(exact_results, approx_results), time.time() - query_start_time))
+
+    if MODE == 'check':
+        print('>>> Checking search against cal_simi_score on', index_dir, '...')
+        num_checked = check_search_equivalence(layout_index, CHECK_SEQUENCES)
+        print('<<<', num_checked, 'search results are identical to cal_simi_score.')
+
+    print('---------------------------------')
+    print('Duration: {:.2f} s'.format(time.time() - start_time))
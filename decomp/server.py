@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" 常驻的布局相似度查询服务（供草图识别前端调用）。启动时加载一次资产库索引、自身得分与搜索进程池，
+    之后通过 localhost HTTP 接口响应查询，请求由多线程并发处理，同时执行的搜索数由 max_concurrent 限制。
+    config.ini 中 shortlist_size 大于 0 时使用两阶段近似搜索（search.search_shortlist）以降低延迟。
+    接口：
+        POST /search   请求 {"sequence": 布局序列, "k": 结果数（可选）}
+                       返回 {"results": [[layout_id, similarity_score], ...], "latency_ms": ..., "scored": ..., "pruned": ...}
+                       请求无效时返回 400、搜索失败时返回 500，内容为 {"error": 错误信息}
+        GET /metrics   请求数、错误数、正在执行与排队等待的请求数、最近请求的延迟统计
+        GET /health    服务状态与资产库布局数
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from configparser import ConfigParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from decomp.layout_index import LayoutIndex, array_tree_from_sequence
+from decomp.score import FeatureShortlist, load_self_scores
+from decomp.search import index_dir, top_k, num_workers, chunk_size, shortlist_size, make_pool, search, \
+    search_shortlist
+
+cfg = ConfigParser()
+cfg.read('../config.ini')
+
+host = cfg.get('server', 'host')
+port = cfg.getint('server', 'port')
+max_concurrent = cfg.getint('server', 'max_concurrent')
+
+NUM_RECENT_LATENCIES = 1000  # 用于计算延迟分位数的最近请求数
+
+
+class SearchMetrics(object):
+    """
+    服务运行指标（线程安全）
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.num_requests = 0
+        self.num_errors = 0
+        self.in_flight = 0  # 正在执行搜索的请求数
+        self.queue_depth = 0  # 等待执行的请求数
+        self.latencies = deque(maxlen=NUM_RECENT_LATENCIES)
+
+    def enqueue(self):
+        with self.lock:
+            self.queue_depth += 1
+
+    def start(self):
+        with self.lock:
+            self.queue_depth -= 1
+            self.in_flight += 1
+
+    def finish(self, latency, error=False):
+        with self.lock:
+            self.in_flight -= 1
+            self.num_requests += 1
+            if error:
+                self.num_errors += 1
+            else:
+                self.latencies.append(latency)
+
+    def snapshot(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            snapshot = {'requests': self.num_requests, 'errors': self.num_errors,
+                        'in_flight': self.in_flight, 'queue_depth': self.queue_depth}
+        if len(latencies) > 0:
+            snapshot['latency_ms'] = {'mean': float(latencies.mean()), 'p50': float(np.percentile(latencies, 50)),
+                                      'p95': float(np.percentile(latencies, 95)), 'max': float(latencies.max())}
+        return snapshot
+
+
+class SimilarityService(object):
+    """
+    持有资产库索引与搜索进程池，响应单个布局序列的相似度查询
+    """
+
+    def __init__(self, index_path, workers=num_workers, chunk=chunk_size, concurrency=max_concurrent,
+                 num_candidates=shortlist_size):
+        self.index = LayoutIndex(index_path)
+        self.self_scores = load_self_scores(self.index)  # 只在启动时读取一次，所有请求共用
+        self.index.type_histograms()  # 预先计算剪枝所需的类型计数
+        self.workers = workers
+        self.chunk = chunk
+        self.num_candidates = num_candidates
+        if num_candidates > 0:
+            self.shortlist = FeatureShortlist(self.index)
+            self.pool = None
+        else:
+            self.shortlist = None
+            self.pool = make_pool(self.index, workers) if workers > 1 else None
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.metrics = SearchMetrics()
+
+    def query(self, seq, k=top_k):
+        """
+        :param seq: 布局序列
+        :param k: 结果数
+        :return: 响应 dict
+        """
+        if k < 1:
+            raise ValueError('k must be a positive integer.')
+        start_time = time.time()
+        self.metrics.enqueue()
+        self.slots.acquire()
+        self.metrics.start()
+        try:
+            i_tree = array_tree_from_sequence(seq)
+            if len(i_tree) <= 1:
+                raise ValueError('Empty layout sequence.')
+            stats = {}
+            if self.shortlist is not None:
+                results = search_shortlist(i_tree, self.index, self.shortlist, k=k, num_candidates=self.num_candidates,
+                                           stats=stats, self_scores=self.self_scores)
+            else:
+                results = search(i_tree, self.index, k=k, workers=self.workers, chunk=self.chunk, pool=self.pool,
+                                 stats=stats, self_scores=self.self_scores)
+        except Exception:
+            self.metrics.finish(time.time() - start_time, error=True)
+            raise
+        finally:
+            self.slots.release()
+
+        latency = time.time() - start_time
+        self.metrics.finish(latency)
+        return {'results': [[layout_id, float(score)] for layout_id, score in results],
+                'latency_ms': latency * 1000, 'scored': stats['scored'], 'pruned': stats['pruned']}
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+
+
+def parse_search_request(body):
+    """
+    解析并检查 POST /search 的请求体
+    :param body: 请求体（bytes）
+    :return: (布局序列, 结果数)
+    """
+    request = json.loads(body.decode('utf-8'))
+    if not isinstance(request, dict):
+        raise ValueError('request body must be a JSON object.')
+    if 'sequence' not in request:
+        raise ValueError('missing "sequence".')
+    if not isinstance(request['sequence'], str):
+        raise ValueError('"sequence" must be a string.')
+    k = request.get('k', top_k)
+    if not isinstance(k, int) or isinstance(k, bool) or k < 1:
+        raise ValueError('"k" must be a positive integer.')
+    return request['sequence'], k
+
+
+class SimilarityRequestHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, code, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == '/metrics':
+            self.send_json(200, service.metrics.snapshot())
+        elif self.path == '/health':
+            self.send_json(200, {'status': 'ok', 'layouts': len(service.index)})
+        else:
+            self.send_json(404, {'error': 'Not found.'})
+
+    def do_POST(self):
+        if self.path != '/search':
+            self.send_json(404, {'error': 'Not found.'})
+            return
+        try:
+            seq, k = parse_search_request(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            response = self.server.service.query(seq, k)
+        except (ValueError, KeyError, IndexError) as e:
+            self.send_json(400, {'error': 'Invalid request: ' + str(e)})
+        except Exception as e:
+            # 搜索过程中的其他错误（如进程池失败、内存不足）已由 query 计入 metrics 并释放执行名额
+            self.send_json(500, {'error': 'Search failed: ' + type(e).__name__ + ': ' + str(e)})
+        else:
+            self.send_json(200, response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SimilarityServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, service):
+        super().__init__(server_address, SimilarityRequestHandler)
+        self.service = service
+
+
+if __name__ == '__main__':
+    start_time = time.time()
+    print('---------------------------------')
+    print('>>> Loading layout index', index_dir, '...', end=' ')
+    similarity_service = SimilarityService(index_dir)
+    print('OK')
+    print('### Layouts:', len(similarity_service.index), '| Workers:', num_workers,
+          '| Startup: {:.2f} s'.format(time.time() - start_time))
+
+    server = SimilarityServer((host, port), similarity_service)
+    print('### Serving on http://%s:%d (POST /search, GET /metrics, GET /health)' % (host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        similarity_service.close()
+        print('<<< Server stopped.')
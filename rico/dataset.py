@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" 二进制分片格式的 NMT 训练数据 <组件块着色图，布局序列>（generator.py 中 SKETCH_OUTPUT = 'shards' 时生成），
+    代替每张图一个 PNG 文件加文本列表的形式，训练时以 mmap 方式随机读取，不再需要合并复制与 PNG 解码。
+    每个 RICO 子文件夹对应一个分片，目录中的文件：
+        <分片名>.images.npy: 着色图 uint8 数组 (布局数, 高, 宽, 3)，与 PNG 文件解码后的数组相同
+        <分片名>.tokens.npy: 所有布局序列的 token 编号（VOCAB 中的位置）依次拼接
+        <分片名>.offsets.npy: 每个布局序列在 tokens 中的起始位置（长度为布局数 + 1）
+        <分片名>.indices.npy: 每个布局的 Rico 序号
+        meta.json: 格式版本、词汇表、着色图形状与分片列表（分片名、布局数）
+    分片按 Rico 序号排列，分片内按 Rico 序号排序，因此布局的全局位置与 layout_sequence.lst 的行号（index_map.lst）相同。
+
+    用法：
+        dataset = TrainingDataset(dataset_dir)
+        for images, sequences, rico_indices in dataset.batches(32, dataset.list_positions(train_fp), shuffle=True):
+            ...
+"""
+
+import json
+import os
+
+import numpy as np
+
+from utils.files import AtomicWriter, FileTransaction
+from utils.widget import Widget
+
+DATASET_VERSION = 1
+
+VOCAB = ['{', '}'] + [widget.name for widget in Widget]  # 与 vocab.txt 的顺序相同
+TOKEN_IDS = {token: i for i, token in enumerate(VOCAB)}
+
+SHARD_ARRAY_NAMES = ['images', 'tokens', 'offsets', 'indices']
+
+
+def shard_array_path(dataset_dir, shard_name, array_name):
+    return os.path.join(dataset_dir, shard_name + '.' + array_name + '.npy')
+
+
+def shard_array_shard_name(file_name):
+    """
+    :param file_name: 目录中的文件名
+    :return: 分片数组文件（<分片名>.<数组名>.npy 及写入中的 .npy.tmp）所属的分片名，不是分片数组文件时为 None
+    """
+    if file_name.endswith('.tmp'):
+        file_name = file_name[:-len('.tmp')]
+    for array_name in SHARD_ARRAY_NAMES:
+        suffix = '.' + array_name + '.npy'
+        if file_name.endswith(suffix) and len(file_name) > len(suffix):
+            return file_name[:-len(suffix)]
+    return None
+
+
+def encode_tokens(tokens):
+    """
+    :param tokens: 布局序列 token 列表
+    :return: token 编号数组
+    """
+    return np.array([TOKEN_IDS[token] for token in tokens], dtype=np.int8)
+
+
+class ShardWriter(object):
+    """
+    写入一个分片：着色图直接写入预先按布局数分配的 images.npy（open_memmap），序列在 close 时一次写入。
+    所有文件先写入临时文件（.tmp），close 时才替换为正式文件，abort 时删除
+    """
+
+    def __init__(self, dataset_dir, shard_name, num_samples, image_shape):
+        """
+        :param dataset_dir: 训练数据目录
+        :param shard_name: 分片名（RICO 子文件夹名）
+        :param num_samples: 分片中的布局数
+        :param image_shape: 着色图数组形状 (高, 宽, 3)
+        """
+        self.dataset_dir = dataset_dir
+        self.shard_name = shard_name
+        self.num_samples = num_samples
+        self.images_path = shard_array_path(dataset_dir, shard_name, 'images')
+        self.images = np.lib.format.open_memmap(self.images_path + '.tmp', mode='w+', dtype=np.uint8,
+                                                shape=(num_samples,) + tuple(image_shape)) \
+            if num_samples > 0 else np.zeros((0,) + tuple(image_shape), dtype=np.uint8)
+        self.sequences = []
+        self.indices = []
+
+    def add(self, rico_index, image, tokens):
+        """
+        :param rico_index: Rico 序号
+        :param image: 着色图数组（复制到分片中，调用后可以重复使用）
+        :param tokens: 布局序列 token 列表
+        """
+        self.images[len(self.indices)] = image
+        self.sequences.append(encode_tokens(tokens))
+        self.indices.append(int(rico_index))
+
+    def close(self):
+        """
+        :return: 分片中的布局数
+        """
+        if len(self.indices) != self.num_samples:
+            raise Exception('Shard ' + self.shard_name + ' expects ' + str(self.num_samples) + ' samples, got ' +
+                            str(len(self.indices)) + '.')
+        offsets = np.zeros(self.num_samples + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(sequence) for sequence in self.sequences])
+        arrays = {'tokens': np.concatenate(self.sequences) if self.sequences else np.zeros(0, dtype=np.int8),
+                  'offsets': offsets, 'indices': np.array(self.indices, dtype=np.int32)}
+
+        if self.num_samples > 0:
+            self.images.flush()
+        else:
+            with open(self.images_path + '.tmp', 'wb') as f:
+                np.save(f, self.images)
+        self.images = None  # 关闭映射
+        with FileTransaction() as transaction:
+            for name, arr in arrays.items():
+                np.save(transaction.open(shard_array_path(self.dataset_dir, self.shard_name, name), 'wb'), arr)
+        os.replace(self.images_path + '.tmp', self.images_path)
+        return self.num_samples
+
+    def abort(self):
+        self.images = None
+        if os.path.exists(self.images_path + '.tmp'):
+            os.remove(self.images_path + '.tmp')
+
+
+def write_dataset_meta(dataset_dir, shards, image_shape):
+    """
+    所有分片写入完成后写入 meta.json
+    :param dataset_dir: 训练数据目录
+    :param shards: 按 Rico 序号排列的 [(分片名, 布局数)]
+    :param image_shape: 着色图数组形状
+    """
+    meta = {'version': DATASET_VERSION, 'vocab': VOCAB, 'image_shape': list(image_shape),
+            'shards': [{'name': shard_name, 'size': size} for shard_name, size in shards]}
+    with AtomicWriter(os.path.join(dataset_dir, 'meta.json')) as f:
+        json.dump(meta, f)
+
+
+def read_list_indices(lst_fp):
+    """
+    :param lst_fp: train.lst / validate.lst / test_shuffle.lst（每行为 "Rico 序号.png 行号"）
+    :return: Rico 序号列表
+    """
+    with open(lst_fp, 'r') as f:
+        return [int(line.split()[0].split('.')[0]) for line in f if line.strip()]
+
+
+class TrainingDataset(object):
+    """
+    只读加载的二进制分片训练数据。数组通过 np.load(mmap_mode='r') 映射，读取的着色图只占用页缓存，多个进程可共享。
+    布局以全局位置 0..len - 1 编号（即 layout_sequence.lst 的行号）
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        if meta['version'] != DATASET_VERSION:
+            raise Exception('Training dataset version ' + str(meta['version']) + ' is not supported, please rebuild.')
+        self.vocab = meta['vocab']
+        self.image_shape = tuple(meta['image_shape'])
+        self.shard_names = [shard['name'] for shard in meta['shards']]
+        self.shards = [{name: np.load(shard_array_path(path, shard_name, name), mmap_mode='r')
+                        for name in SHARD_ARRAY_NAMES} for shard_name in self.shard_names]
+        # 每个分片第一个布局的全局位置
+        self.shard_starts = np.concatenate([[0], np.cumsum([shard['size'] for shard in meta['shards']])])
+        self.rico_indices = np.concatenate([shard['indices'] for shard in self.shards]) if self.shards else \
+            np.zeros(0, dtype=np.int32)
+        self._positions = None
+
+    def __len__(self):
+        return int(self.shard_starts[-1])
+
+    def locate(self, position):
+        """
+        :return: (分片编号, 分片内位置)
+        """
+        s = int(np.searchsorted(self.shard_starts, position, side='right')) - 1
+        return s, position - int(self.shard_starts[s])
+
+    def sequence(self, position):
+        """
+        :return: 布局序列的 token 编号数组
+        """
+        s, j = self.locate(position)
+        offsets = self.shards[s]['offsets']
+        return np.array(self.shards[s]['tokens'][offsets[j]:offsets[j + 1]])
+
+    def __getitem__(self, position):
+        """
+        :return: (着色图数组（只读映射）, 布局序列的 token 编号数组, Rico 序号)
+        """
+        if not 0 <= position < len(self):
+            raise IndexError('Position ' + str(position) + ' out of range.')
+        s, j = self.locate(position)
+        return self.shards[s]['images'][j], self.sequence(position), int(self.rico_indices[position])
+
+    def decode(self, sequence):
+        """
+        :param sequence: 布局序列的 token 编号数组
+        :return: 布局序列 token 列表
+        """
+        return [self.vocab[token_id] for token_id in sequence.tolist()]
+
+    def position(self, rico_index):
+        """
+        :return: Rico 序号对应的全局位置（不存在时为 None）
+        """
+        if self._positions is None:
+            self._positions = {rico_index: position for position, rico_index in enumerate(self.rico_indices.tolist())}
+        return self._positions.get(int(rico_index))
+
+    def list_positions(self, lst_fp):
+        """
+        :param lst_fp: train.lst 等列表文件
+        :return: 列表中（存在于训练数据中的）布局的全局位置
+        """
+        positions = [self.position(rico_index) for rico_index in read_list_indices(lst_fp)]
+        return [position for position in positions if position is not None]
+
+    def batches(self, batch_size, positions=None, shuffle=False, seed=None):
+        """
+        按批读取训练数据，同一批中同一分片的着色图一次读出
+        :param batch_size: 每批的布局数
+        :param positions: 参与的全局位置（默认为全部）
+        :param shuffle: 是否打乱顺序
+        :param seed: 打乱顺序的随机种子
+        :return: 生成器，每次返回 (着色图数组 (n, 高, 宽, 3), 布局序列 token 编号数组列表, Rico 序号数组)
+        """
+        positions = np.arange(len(self)) if positions is None else np.asarray(positions, dtype=np.int64)
+        if shuffle:
+            positions = np.random.RandomState(seed).permutation(positions)
+        for k in range(0, len(positions), batch_size):
+            batch = positions[k:k + batch_size]
+            shard_ids = np.searchsorted(self.shard_starts, batch, side='right') - 1
+            images = np.empty((len(batch),) + self.image_shape, dtype=np.uint8)
+            for s in np.unique(shard_ids).tolist():
+                selected = np.nonzero(shard_ids == s)[0]
+                local = batch[selected] - self.shard_starts[s]
+                order = np.argsort(local, kind='stable')  # 按文件中的顺序读取
+                images[selected[order]] = self.shards[s]['images'][local[order]]
+            yield images, [self.sequence(position) for position in batch.tolist()], self.rico_indices[batch]
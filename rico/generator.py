@@ -6,20 +6,24 @@
 
 import csv
 import hashlib
+import heapq
 import json
+import math
 import operator
 import os
 import shutil
 import time
 from configparser import ConfigParser, ExtendedInterpolation
 from datetime import datetime
+from multiprocessing import Pool
 
 import numpy as np
 from PIL import Image
-from anytree import Node, RenderTree
 
-from utils.files import check_make_dir
-from utils.widget import Widget, WidgetNode, WidgetColor
+from rico.dataset import ShardWriter, write_dataset_meta, shard_array_path, shard_array_shard_name, SHARD_ARRAY_NAMES
+from utils.files import check_make_dir, AtomicWriter, FileTransaction
+from utils.sketch import SketchCanvas, widget_sketch_boxes
+from utils.widget import Widget, WidgetNode, WidgetTree, WIDGET_COLORS
 
 cfg = ConfigParser(interpolation=ExtendedInterpolation())
 cfg.read('../config.ini')
@@ -30,10 +34,16 @@ layout_sequences_fp = cfg.get('files', 'sequences')
 layout_repo_dir = cfg.get('decode', 'apk_tokens_dir')
 rico_layout_repo_fp = os.path.join(layout_repo_dir, 'rico-layout.lst')
 index_map_fp = cfg.get('files', 'index_map')
+normalization_report_fp = cfg.get('files', 'normalization_report')
 
 rico_divided_dir = cfg.get('dirs', 'rico_divided')
 cleaned_jsons_dir = cfg.get('dirs', 'cleaned_jsons')
 colored_pics_divided_dir = cfg.get('dirs', 'colored_pics_divided')
+training_shards_dir = cfg.get('dirs', 'training_shards')
+# 各进程输出的分片文件目录（合并后删除）
+shards_dir = os.path.join(data_dir, 'shards')
+# 已完成分片的清单（中断后继续运行时使用）
+manifest_fp = os.path.join(shards_dir, 'manifest.json')
 
 WIDGET_CUT_OUT_PATH = cfg.get('debug', 'widget_flakes')
 CSV_FILE_PATH = cfg.get('debug', 'csv_analysis')
@@ -43,8 +53,16 @@ COLUMN_TITLES = json.loads(cfg.get('debug', 'columns'))
 SKETCH_WIDTH = cfg.getint('nmt', 'sketch_width')
 SKETCH_HEIGHT = cfg.getint('nmt', 'sketch_height')
 
+# 生成草图的进程数
+NUM_WORKERS = cfg.getint('nmt', 'workers')
+
+MODE = 'generate'  # generate normalization_report
+RESUME = True  # 上次运行中断时保留已完成的分片（shards_dir 中的清单），只生成其余分片
+
 IMG_MODE = 'color'  # color 为色彩模式，sketch 为草图模式
+SKETCH_BACKEND = 'numpy'  # numpy pil（逐个控件 Image.paste，结果相同）
 TRAINING_DATA_MODE = True  # 构造训练集支持文件
+SKETCH_OUTPUT = 'png'  # png shards（着色图与布局序列写入二进制分片，见 rico/dataset.py）
 CROP_WIDGET = False
 ANALYSIS_MODE = False  # 存储属性分析文件
 PRINT_LOG = False
@@ -53,31 +71,31 @@ PRINT_LOG = False
 WIDTH = 1440
 HEIGHT = 2560
 
+MANIFEST_VERSION = 1
+
+LEGACY_ITERATIONS = 3  # 旧版清理/压缩树结构的轮数（比较报告）
+LEGACY_MAX_ITERATIONS = 100  # 比较报告中旧版多轮清理/压缩的最多轮数
+
+# 草图画布（训练数据模式下直接绘制为旋转 90 度后的方向）
+sketch_canvas = SketchCanvas(SKETCH_WIDTH, SKETCH_HEIGHT, rotate=TRAINING_DATA_MODE)
+
 FILE_READ_BUF_SIZE = 65536  # 用于 File Hash 的缓存大小
 LEN_SHA1 = 10  # 节点 sha1 值的截取保留长度
 
 # 用于 layout 层次间传递辅助参数
 KEY_ANCESTOR_CLICKABLE = 'key_ancestor_clickable'
-KEY_TREE_ROOT = 'tree_root'
-
-seq_line = 0  # xml_sequence 的行号
 
 widgets_count = {}
 container_cnt = {}
 
 
-def sketch_samples_generation(rico_dir, json_dir, sketches_dir, rico_index, seq_file, i2l_map_file):
+def load_widget_tree(json_dir, rico_index):
     """
-    读入 cleaned_json_dir 文件夹中的 json 布局文件，生成处理后的草图文件，保存到 sketches_out_dir 中
-    :param rico_dir: Rico 文件夹存放的用于裁剪的屏幕截图
+    读入 json 布局文件构造控件树，去除大背景、面积过小的控件，并确定被遮盖的控件
     :param json_dir: cleaned json 文件夹路径
-    :param sketches_dir: 输出草图的存放文件夹路径
     :param rico_index: Rico 序号
-    :param seq_file: layout tokens 序列文件路径
-    :param i2l_map_file: index: line_number 字典文件路径
-    :return:
+    :return: WidgetTree, 待删除控件的 key 集合
     """
-    global seq_line
     with open(os.path.join(json_dir, rico_index + '.json'), 'r') as f:
         root_json = json.load(f)
 
@@ -85,187 +103,622 @@ def sketch_samples_generation(rico_dir, json_dir, sketches_dir, rico_index, seq_
     while 'children' in root_json and len(root_json['children']) == 1:
         root_json = root_json['children'][0]
 
-    # 用于裁剪的屏幕截图
-    im_screenshot = Image.open(os.path.join(rico_dir, rico_index + '.jpg')) if CROP_WIDGET else None  # 可能为空
-    # img_sha1 = hash_file_sha1(screenshot_path)  # 生成文件的 sha1 值
-
-    # 空白草图画布
-    im_sketch = Image.new('RGB', (SKETCH_WIDTH, SKETCH_HEIGHT), (255, 255, 255))
-    out_sketch_path = os.path.join(sketches_dir, rico_index + '.png')
-
-    removable_widgets = set()  # 待删除节点用集合表示
-    nodes_dict = {}
-    tree_root = Node(KEY_TREE_ROOT)
+    removable_widgets = set()  # 待删除节点的 key 用集合表示
+    tree = WidgetTree()
 
     args = {KEY_ANCESTOR_CLICKABLE: False}
     ancestor_clickable_stack = [False]  # 用于逐层存放 parent-clickable 属性
-    csv_rows = []  # 分析模式生成 csv 文件
-    tokens = []
 
     # 根据 rico json 文件构造树结构
-    dfs_create_tree(root_json, args, ancestor_clickable_stack, tree_root, nodes_dict, rico_index)
+    node_keys = {}
+    dfs_make_node_keys(root_json, node_keys, {})
+    dfs_create_tree(root_json, args, ancestor_clickable_stack, tree, WidgetTree.ROOT, node_keys, rico_index)
+    tree.finish()
+    del root_json, node_keys  # 之后只使用 tree 中提取出的属性
 
     if PRINT_LOG:
-        for pre, fill, node in RenderTree(tree_root):
-            if node.name != 'tree_root':
-                print("%s%s %s" % (pre, nodes_dict[node.name].w_type.name, nodes_dict[node.name].w_id))
+        for node, depth in tree.iter_nodes():
+            print('    ' * depth + tree.widget_type(node).name, tree.widgets[node].w_id)
+
+    root_children = tree.children[WidgetTree.ROOT]
 
     # 扫描去除大背景、面积过小的控件
-    if len(tree_root.children) > 0:
-        dfs_process_invalid_nodes(tree_root.children[0], nodes_dict)
+    if len(root_children) > 0:
+        dfs_process_invalid_nodes(tree, root_children[0])
 
     # 处理控件遮盖情形，并记录待清除元素到 removable_widgets
-    if len(tree_root.children) > 0:
-        dfs_process_overlapped_widgets(tree_root.children[0], nodes_dict, removable_widgets)
+    if len(root_children) > 0:
+        dfs_process_overlapped_widgets(tree, root_children[0], WidgetBoundsIndex(tree), removable_widgets)
+
+    return tree, removable_widgets
+
+
+def normalize_widget_tree(tree, removable_widgets, legacy_iterations=None):
+    """
+    清理/压缩树结构：去除被遮盖的控件、孤立的 Layout/List/Unclassified 节点，合并单孩子 Layout 及 List { List }。
+    默认由 dfs_normalize_tree 一次遍历得到旧版多轮清理/压缩收敛后的结果；legacy_iterations 不为 None 时使用旧版的多轮
+    dfs_compress_tree / dfs_remove_invalid_leaf（仅用于生成比较报告）
+    :param tree: WidgetTree
+    :param removable_widgets: 待删除控件的 key 集合
+    :param legacy_iterations: 旧版清理/压缩的轮数
+    :return:
+    """
+    root_children = tree.children[WidgetTree.ROOT]
+    if len(root_children) == 0:
+        return
+
+    if legacy_iterations is None:
+        node = dfs_normalize_tree(tree, root_children[0], removable_widgets)
+        tree.set_children(WidgetTree.ROOT, [node] if node != -1 else [])
+    else:
+        # 扫描去除被遮盖的元素
+        dfs_remove_covered_widgets(tree, root_children[0], removable_widgets)
+
+        # 迭代执行多次清理/压缩树结构
+        for i in range(legacy_iterations):
+            if len(root_children) > 0:
+                dfs_compress_tree(tree, root_children[0], 0)
+            if len(root_children) > 0:
+                dfs_remove_invalid_leaf(tree, root_children[0])
+
+
+def make_tree_tokens(tree):
+    tokens = []
+    if len(tree.children[WidgetTree.ROOT]) > 0:
+        dfs_make_tokens(tree, tree.children[WidgetTree.ROOT][0], tokens)
+    return tokens
+
+
+def sketch_samples_generation(rico_dir, json_dir, sketches_dir, rico_index):
+    """
+    读入 cleaned_json_dir 文件夹中的 json 布局文件，生成处理后的草图文件，保存到 sketches_out_dir 中
+    :param rico_dir: Rico 文件夹存放的用于裁剪的屏幕截图
+    :param json_dir: cleaned json 文件夹路径
+    :param sketches_dir: 输出草图的存放文件夹路径（为 None 时不保存草图文件）
+    :param rico_index: Rico 序号
+    :return: layout tokens 序列, 分析模式生成的 csv 行, 草图数组（下一次调用时可能被覆盖）
+    """
+    # 用于裁剪的屏幕截图
+    im_screenshot = Image.open(os.path.join(rico_dir, rico_index + '.jpg')) if CROP_WIDGET else None  # 可能为空
+    # img_sha1 = hash_file_sha1(screenshot_path)  # 生成文件的 sha1 值
 
-    # 扫描去除被遮盖的元素
-    if len(tree_root.children) > 0:
-        dfs_remove_covered_widgets(tree_root.children[0], removable_widgets)
+    csv_rows = []  # 分析模式生成 csv 文件
+    sketch_nodes = []  # 按绘制顺序排列的待绘制控件节点编号
 
-    # 迭代执行多次清理/压缩树结构
-    for i in range(3):
-        if len(tree_root.children) > 0:
-            dfs_compress_tree(tree_root.children[0], 0, nodes_dict)
-        if len(tree_root.children) > 0:
-            dfs_remove_invalid_leaf(tree_root.children[0], nodes_dict)
+    tree, removable_widgets = load_widget_tree(json_dir, rico_index)
+    normalize_widget_tree(tree, removable_widgets)
+    root_children = tree.children[WidgetTree.ROOT]
 
     # 列表的相同子项仅保留一个
-    if len(tree_root.children) > 0:
-        dfs_remove_extra_list_items(tree_root.children[0], nodes_dict)
+    if len(root_children) > 0:
+        dfs_remove_extra_list_items(tree, root_children[0])
 
-    # 绘制草图
-    if len(tree_root.children) > 0:
-        dfs_create_sketch(tree_root.children[0], nodes_dict, im_screenshot, im_sketch, rico_index, csv_rows)
+    # 确定待绘制的控件
+    if len(root_children) > 0:
+        dfs_create_sketch(tree, root_children[0], im_screenshot, sketch_nodes, rico_index, csv_rows)
 
     # 生成 tokens 序列
-    if len(tree_root.children) > 0:
-        dfs_make_tokens(tree_root.children[0], tokens, nodes_dict)
-
-    # 保存草图/制作训练文件
-    if TRAINING_DATA_MODE:
-        im_sketch.rotate(90, expand=1).save(out_sketch_path)
-        open(rico_layout_repo_fp, 'a').write(
-            ' '.join(['1', str(rico_index), str(len(tokens)), ' '.join(tokens)]) + '\n')
-        open(seq_file, 'a').write(' '.join(tokens) + '\n')
-        open(i2l_map_file, 'a').write(str(rico_index) + ' ' + str(seq_line) + '\n')
-        seq_line += 1
+    tokens = make_tree_tokens(tree)
+
+    # 绘制并保存草图（训练文件在所有分片完成后统一合并生成）
+    sketch = render_sketch(tree, sketch_nodes)
+    if sketches_dir is not None:
+        Image.fromarray(sketch, 'RGB').save(os.path.join(sketches_dir, rico_index + '.png'))
+
+    return tokens, csv_rows, sketch
+
+
+def rico_index_key(name):
+    """
+    Rico 文件名（12.json）或子文件夹名（0-999）对应的排序键：Rico 序号（子文件夹取起始序号）
+    """
+    return int(name.split('.')[0].split('-')[0])
+
+
+def generate_shard(case_name):
+    """
+    生成 RICO 子文件夹（分片）中所有布局的草图。按 Rico 序号顺序将 "Rico 序号 tokens 数 tokens 序列" 逐行写入
+    shards_dir 中的分片文件（分析模式下 csv 行写入同名 csv 文件），由 merge_shards 统一分配行号。
+    SKETCH_OUTPUT 为 shards 时草图与序列写入 training_shards_dir 中的同名二进制分片，不保存 PNG 文件。
+    控件类名计数只统计本分片，随结果返回后在主进程中按分片顺序累加
+    :param case_name: 子文件夹名
+    :return: (子文件夹名, 布局数, widgets_count, container_cnt)
+    """
+    widgets_count.clear()
+    container_cnt.clear()
+    input_case_dir = os.path.join(cleaned_jsons_dir, case_name)
+    rico_indices = sorted((file.split('.')[0] for file in os.listdir(input_case_dir) if file.endswith('.json')),
+                          key=rico_index_key)
+
+    if SKETCH_OUTPUT == 'shards':
+        output_case_dir = None
+        shard_writer = ShardWriter(training_shards_dir, case_name, len(rico_indices), sketch_canvas.buffer.shape)
     else:
-        im_sketch.save(out_sketch_path)
+        output_case_dir = os.path.join(colored_pics_divided_dir, case_name)
+        check_make_dir(output_case_dir)
+        shard_writer = None
+
+    # 分片文件在整个分片完成后才出现（先写入临时文件），中途出错时不留下不完整的分片
+    try:
+        with FileTransaction() as transaction:
+            f = transaction.open(os.path.join(shards_dir, case_name + '.lst'))
+            f_csv = transaction.open(os.path.join(shards_dir, case_name + '.csv'), newline='', encoding='utf-8') \
+                if ANALYSIS_MODE else None
+            for rico_index in rico_indices:
+                tokens, csv_rows, sketch = sketch_samples_generation(os.path.join(rico_divided_dir, case_name),
+                                                                     input_case_dir, output_case_dir, rico_index)
+                f.write(' '.join([rico_index, str(len(tokens)), ' '.join(tokens)]) + '\n')
+                if f_csv is not None:
+                    csv.writer(f_csv).writerows(csv_rows)
+                if shard_writer is not None:
+                    shard_writer.add(rico_index, sketch, tokens)
+            if shard_writer is not None:
+                shard_writer.close()
+    except BaseException:
+        if shard_writer is not None:
+            shard_writer.abort()
+        raise
+
+    return case_name, len(rico_indices), dict(widgets_count), dict(container_cnt)
+
+
+def compare_normalization(json_dir, rico_index):
+    """
+    分别使用旧版 LEGACY_ITERATIONS 轮清理/压缩、旧版多轮清理/压缩直到结果不再变化、dfs_normalize_tree 处理布局，
+    返回各自（去除多余表项后）的 tokens 序列
+    :param json_dir: cleaned json 文件夹路径
+    :param rico_index: Rico 序号
+    :return: (旧版 tokens, 旧版收敛后 tokens, 旧版结果发生变化的轮数, 不动点 tokens)
+    """
+    results = []
+    for legacy_iterations in [LEGACY_ITERATIONS, None]:
+        tree, removable_widgets = load_widget_tree(json_dir, rico_index)
+        normalize_widget_tree(tree, removable_widgets, legacy_iterations)
+        if len(tree.children[WidgetTree.ROOT]) > 0:
+            dfs_remove_extra_list_items(tree, tree.children[WidgetTree.ROOT][0])
+        results.append(make_tree_tokens(tree))
+
+    tree, removable_widgets = load_widget_tree(json_dir, rico_index)
+    normalize_widget_tree(tree, removable_widgets, 0)
+    root_children = tree.children[WidgetTree.ROOT]
+    prev_tokens = make_tree_tokens(tree)
+    num_iterations = 0  # 结果发生变化的轮数
+    for i in range(LEGACY_MAX_ITERATIONS):
+        if len(root_children) > 0:
+            dfs_compress_tree(tree, root_children[0], 0)
+        if len(root_children) > 0:
+            dfs_remove_invalid_leaf(tree, root_children[0])
+        tokens = make_tree_tokens(tree)
+        if tokens == prev_tokens:
+            break
+        prev_tokens = tokens
+        num_iterations += 1
+    if len(root_children) > 0:
+        dfs_remove_extra_list_items(tree, root_children[0])
+    return results[0], make_tree_tokens(tree), num_iterations, results[1]
+
+
+def collapse_single_child_lists(tokens):
+    """
+    将 tokens 序列中只含一个子节点的 List 替换为该子节点（比较报告中用于判断差异是否只在于单孩子 List 是否被压缩）
+    :param tokens: 布局 tokens 序列
+    :return: 替换后的 tokens 序列
+    """
+    def collapse(pos):
+        widget_name = tokens[pos]
+        pos += 1
+        children = []
+        if pos < len(tokens) and tokens[pos] == '{':
+            pos += 1
+            while tokens[pos] != '}':
+                child_tokens, pos = collapse(pos)
+                children.append(child_tokens)
+            pos += 1
+        if widget_name == Widget.List.name and len(children) == 1:
+            return children[0], pos
+        return [widget_name] + (['{'] + [t for child_tokens in children for t in child_tokens] + ['}']
+                                if children else []), pos
+
+    return collapse(0)[0] if len(tokens) > 0 else []
+
+
+def normalization_report_shard(case_name):
+    """
+    比较一个子文件夹中所有布局的旧版与不动点清理/压缩结果
+    :param case_name: 子文件夹名
+    :return: (子文件夹名, 布局数, 结果不同的布局列表 [(Rico 序号, 类别, 旧版 tokens, 不动点 tokens, 旧版结果发生变化的轮数)])
+             类别 iterations 表示旧版轮数不足（继续迭代后与不动点结果相同）；list_collapse 表示差异只在于单孩子 List
+             是否被压缩；rules 表示其他规则差异（不动点即旧版收敛后的结果，后两类应为 0）
+    """
+    input_case_dir = os.path.join(cleaned_jsons_dir, case_name)
+    rico_indices = sorted((file.split('.')[0] for file in os.listdir(input_case_dir) if file.endswith('.json')),
+                          key=rico_index_key)
+    differences = []
+    for rico_index in rico_indices:
+        legacy_tokens, legacy_fixpoint_tokens, num_iterations, tokens = compare_normalization(input_case_dir,
+                                                                                              rico_index)
+        if legacy_tokens != tokens:
+            if legacy_fixpoint_tokens == tokens:
+                category = 'iterations'
+            elif collapse_single_child_lists(legacy_fixpoint_tokens) == collapse_single_child_lists(tokens):
+                category = 'list_collapse'
+            else:
+                category = 'rules'
+            differences.append((rico_index, category, legacy_tokens, tokens, num_iterations))
+    return case_name, len(rico_indices), differences
 
-    if ANALYSIS_MODE:
-        with open(CSV_FILE_PATH, 'a', newline='', encoding='utf-8') as f:
-            csv.writer(f).writerows(csv_rows)
 
+def merge_shards(case_names, seq_file, i2l_map_file):
+    """
+    按 Rico 序号顺序合并分片文件，依次分配行号，写入 layout tokens 序列文件、index: line_number 字典文件与布局资产库文件
+    （rico-layout.lst）。结果与进程数无关
+    :param case_names: 子文件夹名列表
+    :param seq_file: layout tokens 序列文件路径
+    :param i2l_map_file: index: line_number 字典文件路径
+    :return: 布局数
+    """
+    seq_line = 0  # xml_sequence 的行号
+    shard_files = [open(os.path.join(shards_dir, case_name + '.lst'), 'r') for case_name in case_names]
+    try:
+        # 三个文件全部写完后才一起替换，中途出错时保留原有文件
+        with FileTransaction() as transaction:
+            f_seq = transaction.open(seq_file)
+            f_i2l = transaction.open(i2l_map_file)
+            f_repo = transaction.open(rico_layout_repo_fp)
+            for line in heapq.merge(*shard_files, key=lambda record: int(record.split(' ', 1)[0])):
+                rico_index, len_tokens, tokens = line.rstrip('\n').split(' ', 2)
+                f_repo.write(' '.join(['1', rico_index, len_tokens, tokens]) + '\n')
+                f_seq.write(tokens + '\n')
+                f_i2l.write(rico_index + ' ' + str(seq_line) + '\n')
+                seq_line += 1
+    finally:
+        for f in shard_files:
+            f.close()
+    return seq_line
+
+
+def merge_shards_csv(case_names):
+    """
+    分析模式下写入表头后按分片顺序将各分片的 csv 行写入 CSV_FILE_PATH
+    """
+    with AtomicWriter(CSV_FILE_PATH, newline='', encoding='utf-8') as f_csv:
+        csv.writer(f_csv).writerow(COLUMN_TITLES)
+        for case_name in case_names:
+            with open(os.path.join(shards_dir, case_name + '.csv'), 'r', newline='', encoding='utf-8') as f:
+                shutil.copyfileobj(f, f_csv)
+
+
+def generation_settings():
+    """
+    :return: 影响分片内容的设置，与清单中记录的不同时不能沿用已完成的分片
+    """
+    return {'version': MANIFEST_VERSION, 'sketch_output': SKETCH_OUTPUT, 'img_mode': IMG_MODE,
+            'training_data_mode': TRAINING_DATA_MODE, 'analysis_mode': ANALYSIS_MODE, 'crop_widget': CROP_WIDGET,
+            'sketch_size': [SKETCH_WIDTH, SKETCH_HEIGHT]}
 
-def are_equivalent(root1, root2, nodes_dict):
-    children1 = root1.children
-    children2 = root2.children
+
+def shard_input_digest(case_name):
+    """
+    :return: 子文件夹中 cleaned json 文件名、大小与修改时间的 sha1，用于判断分片的输入是否改变
+    """
+    input_case_dir = os.path.join(cleaned_jsons_dir, case_name)
+    sha1 = hashlib.sha1()
+    for file in sorted(os.listdir(input_case_dir)):
+        if file.endswith('.json'):
+            stat = os.stat(os.path.join(input_case_dir, file))
+            sha1.update(('%s %d %d\n' % (file, stat.st_size, stat.st_mtime_ns)).encode('utf-8'))
+    return sha1.hexdigest()
+
+
+def make_shard_record(case_name, num_layouts, shard_widgets_count, shard_container_cnt):
+    """
+    :return: 清单中已完成分片的记录
+    """
+    return {'size': num_layouts, 'inputs': shard_input_digest(case_name),
+            'sha1': hash_file_sha1(os.path.join(shards_dir, case_name + '.lst')),
+            'widgets_count': shard_widgets_count, 'container_cnt': shard_container_cnt}
+
+
+def save_manifest(manifest):
+    with AtomicWriter(manifest_fp) as f:
+        json.dump(manifest, f)
+
+
+def verify_shard(case_name, record):
+    """
+    检查已完成分片的输出是否完整、输入是否未改变
+    :param case_name: 子文件夹名
+    :param record: 清单中的分片记录
+    :return: 是否可以沿用
+    """
+    lst_path = os.path.join(shards_dir, case_name + '.lst')
+    if not os.path.isfile(lst_path) or hash_file_sha1(lst_path) != record['sha1']:
+        return False
+    if ANALYSIS_MODE and not os.path.isfile(os.path.join(shards_dir, case_name + '.csv')):
+        return False
+    if not os.path.isdir(os.path.join(cleaned_jsons_dir, case_name)) or \
+            shard_input_digest(case_name) != record['inputs']:
+        return False
+
+    with open(lst_path, 'r') as f:
+        rico_indices = [line.split(' ', 1)[0] for line in f]
+    if len(rico_indices) != record['size']:
+        return False
+    if SKETCH_OUTPUT == 'shards':
+        try:
+            indices = np.load(shard_array_path(training_shards_dir, case_name, 'indices'), mmap_mode='r')
+            return all(os.path.isfile(shard_array_path(training_shards_dir, case_name, name))
+                       for name in SHARD_ARRAY_NAMES) and indices.tolist() == [int(i) for i in rico_indices]
+        except (OSError, ValueError):
+            return False
+    sketch_files = set(os.listdir(os.path.join(colored_pics_divided_dir, case_name))) \
+        if os.path.isdir(os.path.join(colored_pics_divided_dir, case_name)) else set()
+    return all(rico_index + '.png' in sketch_files for rico_index in rico_indices)
+
+
+def load_manifest(case_names):
+    """
+    读取上次运行的清单，只保留通过检查的已完成分片
+    :param case_names: 本次运行的子文件夹名列表
+    :return: 清单 {'settings': ..., 'shards': {子文件夹名: 记录}}，不能沿用时为 None
+    """
+    if not os.path.isfile(manifest_fp):
+        return None
+    with open(manifest_fp, 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('settings') != generation_settings():
+        return None
+    manifest['shards'] = {case_name: record for case_name, record in manifest['shards'].items()
+                          if case_name in case_names and verify_shard(case_name, record)}
+    return manifest
+
+
+def remove_partial_outputs(manifest):
+    """
+    删除未完成分片留下的文件：shards_dir 中的临时文件以及不在清单中的分片文件；SKETCH_OUTPUT 为 shards 时还删除
+    training_shards_dir 中不在清单中的分片的数组文件（<分片名>.<数组名>.npy 及 .npy.tmp），该目录中的其他文件
+    （如已完成数据集的 meta.json）保留
+    """
+    if os.path.isdir(shards_dir):
+        for file in os.listdir(shards_dir):
+            if file == os.path.basename(manifest_fp):
+                continue
+            if file.endswith('.tmp') or file.split('.')[0] not in manifest['shards']:
+                os.remove(os.path.join(shards_dir, file))
+
+    if SKETCH_OUTPUT == 'shards' and os.path.isdir(training_shards_dir):
+        for file in os.listdir(training_shards_dir):
+            shard_name = shard_array_shard_name(file)
+            if shard_name is not None and shard_name not in manifest['shards']:
+                os.remove(os.path.join(training_shards_dir, file))
+
+
+def are_equivalent(tree, root1, root2):
+    children1 = tree.children[root1]
+    children2 = tree.children[root2]
 
     if len(children1) != len(children2):
         return False
     else:
         # 两者子节点数目相等
-        type1 = nodes_dict[root1.name].w_type
-        type2 = nodes_dict[root2.name].w_type
+        type1 = tree.types[root1]
+        type2 = tree.types[root2]
         if len(children1) == 0:
             return type1 == type2
         for i in range(len(children1)):
-            if not are_equivalent(children1[i], children2[i], nodes_dict):
+            if not are_equivalent(tree, children1[i], children2[i]):
                 return False
         return True
 
 
-def dfs_remove_extra_list_items(tree_node, nodes_dict):
+def dfs_remove_extra_list_items(tree, node):
     """
     递归遍历树结构，对于 List 类型的节点判断其唯一的表项根节点，删除其他节点
-    :param tree_node:
-    :param nodes_dict:
+    :param tree: WidgetTree
+    :param node: 节点编号
     :return:
     """
-    widget_type = nodes_dict[tree_node.name].w_type
+    widget_type = tree.widget_type(node)
 
     if widget_type == Widget.List:
-        children = tree_node.children
+        children = tree.children[node]
         if 0 < len(children) < 3:
-            tree_node.children = [children[0]]
+            tree.set_children(node, [children[0]])
         elif len(children) >= 3:
             cnt_equal_to_first = 0
             cnt_equal_to_second = 0
             for child in children:
-                if are_equivalent(children[0], child, nodes_dict):
+                if are_equivalent(tree, children[0], child):
                     cnt_equal_to_first += 1
-                if are_equivalent(children[1], child, nodes_dict):
+                if are_equivalent(tree, children[1], child):
                     cnt_equal_to_second += 1
-            tree_node.children = [children[0]] if cnt_equal_to_first >= cnt_equal_to_second else [children[1]]
+            tree.set_children(node, [children[0]] if cnt_equal_to_first >= cnt_equal_to_second else [children[1]])
         return
 
-    for child in tree_node.children:
-        dfs_remove_extra_list_items(child, nodes_dict)
+    for child in tuple(tree.children[node]):
+        dfs_remove_extra_list_items(tree, child)
+
+
+def dfs_normalize_tree(tree, node, removable_widgets):
+    """
+    一次遍历得到旧版清理/压缩（删除 key 在 removable_widgets 中的控件，多轮 dfs_compress_tree /
+    dfs_remove_invalid_leaf）运行到结果不再变化时以 node 为根的子树。
+    旧版的结果与各节点被删除/替换的轮次有关（如单孩子 Layout 被压缩时链上已是单孩子的 List 也被压缩，
+    之后才变为单孩子的 List 则保留），因此先由 dfs_simulate_slot 推算每个位置的变化过程，再按其最终结果重建子树
+    :param tree: WidgetTree
+    :param node: 节点编号
+    :param removable_widgets: 待删除控件的 key 集合
+    :return: 在父节点中代替 node 的节点编号，node 被删除时为 -1
+    """
+    slots = {}
+    dfs_simulate_slot(tree, node, removable_widgets, frozenset(), slots)
+    if slots[node][1] != math.inf:
+        return -1
+    return dfs_rebuild_tree(tree, node, slots)
 
 
-def dfs_remove_invalid_leaf(tree_node, nodes_dict):
+def dfs_simulate_slot(tree, node, removable_widgets, skipped_rounds, slots):
     """
-    清理 Rico 数据集中孤立 Layout/List/Unclassified 节点
-    :param tree_node: 树节点
-    :param nodes_dict: node_sha1: WidgetNode 字典
+    推算旧版逐轮 dfs_compress_tree / dfs_remove_invalid_leaf 中 node 所在位置的变化过程（只依赖其子孙），
+    保存为 slots[node] = ([(轮次, 占据该位置的节点)], 该位置在第几轮 dfs_remove_invalid_leaf 中被删除（不会被删除时为
+    math.inf）, skipped_rounds)。第 r 轮的压缩看到的是第 r - 1 轮结束时的状态，轮次 0 表示初始状态
+    :param tree: WidgetTree
+    :param node: 节点编号
+    :param removable_widgets: 待删除控件的 key 集合
+    :param skipped_rounds: 子树不被压缩的轮次（祖先 List 在该轮被替换为其子 List 时，旧版不再压缩子 List 的子孙）
+    :param slots: 保存结果的字典
     :return:
     """
-    widget_type = nodes_dict[tree_node.name].w_type
+    children = [child for child in tree.children[node] if tree.keys[child] not in removable_widgets]
+    for child in children:
+        dfs_simulate_slot(tree, child, removable_widgets, skipped_rounds, slots)
+
+    widget_type = tree.widget_type(node)
+    if widget_type == Widget.Unclassified:
+        slots[node] = ([(0, node)], 1, skipped_rounds)
+        return
+    if widget_type != Widget.Layout and widget_type != Widget.List:
+        slots[node] = ([(0, node)], math.inf, skipped_rounds)
+        return
+    if len(children) == 0:
+        slots[node] = ([(0, node)], 1, skipped_rounds)
+        return
+
+    # 只剩一个子节点的轮次为 (second, first]，之后该节点不再含子节点，在第 first + 1 轮被删除
+    removed_rounds = sorted((slots[child][1] for child in children), reverse=True)
+    first = removed_rounds[0]
+    second = removed_rounds[1] if len(removed_rounds) > 1 else 0
+    last_child = next(child for child in children if slots[child][1] == first)
+
+    if widget_type == Widget.Layout and second < first:
+        r = second + 1
+        while r in skipped_rounds:
+            r += 1
+        if r <= first:
+            # 第 r 轮被替换为沿单孩子链向下的第一个不是单孩子的节点（链上的节点不论类型）
+            slot = last_child
+            alt_node = slot_node_at(slots, slot, r)
+            alt_children = remaining_children(tree, alt_node, slots, r)
+            while len(alt_children) == 1:
+                slot = alt_children[0]
+                alt_node = slot_node_at(slots, slot, r)
+                alt_children = remaining_children(tree, alt_node, slots, r)
+            # 链上被删除的节点之后不再替换子孙，去掉它们带来的不压缩轮次
+            valid_rounds = frozenset(i for i in slots[slot][2] if i < r or i in skipped_rounds)
+            if valid_rounds != slots[slot][2]:
+                dfs_simulate_slot(tree, slot, removable_widgets, valid_rounds, slots)
+            adopt_slot(slots, node, slot, r, alt_node, skipped_rounds)
+            return
+    elif second < first:
+        # 位置上的节点不再变化、也没有不压缩的轮次之后，List { List } 是否成立不再改变
+        last_round = max([second] + [i for i, _ in slots[last_child][0]] + list(skipped_rounds)) + 1
+        for r in range(second + 1, min(first, last_round) + 1):
+            child_node = slot_node_at(slots, last_child, r)
+            if r not in skipped_rounds and tree.widget_type(child_node) == Widget.List:
+                dfs_simulate_slot(tree, last_child, removable_widgets, skipped_rounds | {r}, slots)
+                adopt_slot(slots, node, last_child, r, child_node, skipped_rounds)
+                return
+
+    slots[node] = ([(0, node)], first + 1, skipped_rounds)
+
+
+def slot_node_at(slots, slot, r):
+    """
+    第 r 轮压缩开始时占据位置 slot 的节点
+    """
+    return [node for i, node in slots[slot][0] if i < r][-1]
+
+
+def remaining_children(tree, node, slots, r):
+    """
+    第 r 轮压缩开始时 node 尚未被删除的子节点位置
+    """
+    return [child for child in tree.children[node] if child in slots and slots[child][1] >= r]
+
+
+def adopt_slot(slots, node, slot, r, alt_node, skipped_rounds):
+    """
+    node 所在位置在第 r 轮被替换为占据 slot 的 alt_node，之后的变化与 slot 相同
+    """
+    changes = [(0, node), (r, alt_node)] + [(i, n) for i, n in slots[slot][0] if i > r]
+    slots[node] = (changes, slots[slot][1], skipped_rounds)
+
+
+def dfs_rebuild_tree(tree, slot, slots):
+    """
+    按 dfs_simulate_slot 的最终结果重建位置 slot 的子树
+    :return: 最终占据 slot 的节点编号
+    """
+    node = slots[slot][0][-1][1]
+    children = [dfs_rebuild_tree(tree, child, slots) for child in tuple(tree.children[node])
+                if child in slots and slots[child][1] == math.inf]
+    tree.set_children(node, children)
+    return node
+
+
+def dfs_remove_invalid_leaf(tree, node):
+    """
+    清理 Rico 数据集中孤立 Layout/List/Unclassified 节点（旧版，仅用于比较报告）
+    :param tree: WidgetTree
+    :param node: 节点编号
+    :return:
+    """
+    widget_type = tree.widget_type(node)
 
     # 消除不含子节点的 layout/list 或未分类节点
-    if (widget_type == Widget.Layout or widget_type == Widget.List) and len(tree_node.children) == 0 or \
+    if (widget_type == Widget.Layout or widget_type == Widget.List) and len(tree.children[node]) == 0 or \
             widget_type == Widget.Unclassified:
-        tree_node.parent = None
-    for child in tree_node.children:
-        dfs_remove_invalid_leaf(child, nodes_dict)
+        tree.detach(node)
+    for child in tuple(tree.children[node]):
+        dfs_remove_invalid_leaf(tree, child)
 
 
-def dfs_compress_tree(tree_node, idx, nodes_dict):
+def dfs_compress_tree(tree, node, idx):
     """
-    压缩树的深度（递归地合并单孩子节点）
-    :param tree_node: 树节点
-    :param idx: tree_node 在其父节点的孩子节点中的序号
-    :param nodes_dict: node_sha1: WidgetNode 字典
+    压缩树的深度（递归地合并单孩子节点；旧版，仅用于比较报告）
+    :param tree: WidgetTree
+    :param node: 节点编号
+    :param idx: node 在其父节点的孩子节点中的序号
     :return:
     """
-    widget_type = nodes_dict[tree_node.name].w_type
-    node_parent = tree_node.parent
+    widget_type = tree.widget_type(node)
+    node_parent = tree.parents[node]
 
     # 消除 Layout { Layout { ... } } 及 Layout { Layout { Layout { ... } } }
-    if widget_type == Widget.Layout and len(tree_node.children) == 1:
+    if widget_type == Widget.Layout and len(tree.children[node]) == 1:
         # prev_node 的作用是避免过度压缩导致叶子控件平层
-        # prev_node = tree_node
-        alt_node = tree_node.children[0]
-        while nodes_dict[tree_node.name].w_type == Widget.Layout and len(alt_node.children) == 1:
+        # prev_node = node
+        alt_node = tree.children[node][0]
+        while tree.widget_type(node) == Widget.Layout and len(tree.children[alt_node]) == 1:
             # prev_node = alt_node
-            alt_node = alt_node.children[0]
-        node_parent.children = node_parent.children[:idx] + (alt_node,) + node_parent.children[idx + 1:]
-        # node_parent.children = node_parent.children[:idx] + (prev_node,) + node_parent.children[idx + 1:]
-        tree_node = alt_node
+            alt_node = tree.children[alt_node][0]
+        tree.replace_child(node_parent, idx, alt_node)
+        # tree.replace_child(node_parent, idx, prev_node)
+        node = alt_node
 
     # 消除 List { List { ... } }
-    if widget_type == Widget.List and len(tree_node.children) == 1:
-        child_node = tree_node.children[0]
-        if nodes_dict[child_node.name].w_type == Widget.List:
-            node_parent.children = node_parent.children[:idx] + (child_node,) + node_parent.children[idx + 1:]
+    if widget_type == Widget.List and len(tree.children[node]) == 1:
+        child_node = tree.children[node][0]
+        if tree.widget_type(child_node) == Widget.List:
+            tree.replace_child(node_parent, idx, child_node)
 
-    for i, child in enumerate(tree_node.children):
-        dfs_compress_tree(child, i, nodes_dict)
+    for i, child in enumerate(tuple(tree.children[node])):
+        dfs_compress_tree(tree, child, i)
 
 
-def dfs_make_tokens(tree_node, tokens, nodes_dict):
+def dfs_make_tokens(tree, node, tokens):
     """
     生成 tokens 序列保存在 tokens 中
-    :param tree_node: 树节点
+    :param tree: WidgetTree
+    :param node: 节点编号
     :param tokens: 待添加的 tokens 序列
-    :param nodes_dict: node_sha1: WidgetNode 字典
     :return:
     """
-    tokens.append(nodes_dict[tree_node.name].w_type.name)
-    if len(tree_node.children) > 0:
+    tokens.append(tree.widget_type(node).name)
+    if len(tree.children[node]) > 0:
         tokens.append('{')
-        for child in tree_node.children:
-            dfs_make_tokens(child, tokens, nodes_dict)
+        for child in tree.children[node]:
+            dfs_make_tokens(tree, child, tokens)
         tokens.append('}')
 
 
@@ -345,14 +798,47 @@ def append_csv_row(node_sha1, json_obj, widget_type, rico_index, ancestor_clicka
         csv_rows.append(csv_row)
 
 
-def dfs_create_tree(json_obj, args, ancestor_clickable_stack, parent_node, nodes_dict, rico_index):
+def node_sha1(json_obj):
+    """
+    json 节点（含子孙）的 sha1 值（截取前 LEN_SHA1 位），仅用于控件裁剪图文件名与分析文件
+    """
+    return hashlib.sha1(str(json_obj).encode('utf-8')).hexdigest()[:LEN_SHA1]
+
+
+def dfs_make_node_keys(json_obj, node_keys, structure_ids):
+    """
+    自底向上为 json 树的每个节点分配结构编号，作为树节点的 key：当且仅当两个节点（含子孙）的 str(json_obj) 相同时编号相同，
+    与原先使用的 sha1(str(json_obj)) 等价，但每个节点只处理自身属性，总耗时与节点数成线性关系
+    :param json_obj: 当前 json 对象
+    :param node_keys: id(json_obj): 结构编号字典
+    :param structure_ids: (自身属性, 子节点编号): 结构编号 字典
+    :return: 当前节点的结构编号
     """
-    递归创建 anytree 树结构，将 json_obj 所指节点挂在树节点 parent_node 上；在方法内判断 json_obj 所指节点的控件类型
+    items = []
+    child_keys = ()
+    for k, v in json_obj.items():
+        if k == 'children':
+            child_keys = tuple(dfs_make_node_keys(child, node_keys, structure_ids) for child in v)
+            items.append(k)  # 保留 children 在属性中的位置
+        else:
+            items.append((k, repr(v)))
+    structure = (tuple(items), child_keys)
+    if structure not in structure_ids:
+        structure_ids[structure] = len(structure_ids)
+    node_keys[id(json_obj)] = structure_ids[structure]
+    return structure_ids[structure]
+
+
+def dfs_create_tree(json_obj, args, ancestor_clickable_stack, tree, parent, node_keys, rico_index):
+    """
+    递归创建控件树，将 json_obj 所指节点挂在 tree 的 parent 节点上；在方法内判断 json_obj 所指节点的控件类型。
+    树中只保存后续处理需要的属性（控件裁剪图与分析文件所需的 sha1 / json 仅在对应模式下保存）
     :param json_obj: 当前 json 对象
     :param args: 传递的参数用于控件类型判断
     :param ancestor_clickable_stack: 用于保存隔层传递的 clickable 参数的栈
-    :param parent_node: 当前控件在树上的父节点
-    :param nodes_dict: node_sha1: WidgetNode 字典
+    :param tree: WidgetTree
+    :param parent: 当前控件在树上的父节点编号
+    :param node_keys: dfs_make_node_keys 生成的 id(json_obj): 结构编号字典
     :param rico_index: Rico 序号
     :return:
     """
@@ -364,13 +850,11 @@ def dfs_create_tree(json_obj, args, ancestor_clickable_stack, parent_node, nodes
             widget_type == Widget.List and json_obj['bounds'][3] - json_obj['bounds'][1] < 600:
         widget_type = Widget.Layout
 
-    node_sha1 = hashlib.sha1(str(json_obj).encode('utf-8')).hexdigest()
-    tree_node_key = node_sha1[:LEN_SHA1]
-    tree_node = Node(tree_node_key, parent=parent_node)
-
-    widget_node = WidgetNode(widget_type, json_obj, json_obj['resource-id'] if 'resource-id' in json_obj else None,
-                             json_obj['class'], json_obj['bounds'], args[KEY_ANCESTOR_CLICKABLE])
-    nodes_dict[tree_node_key] = widget_node
+    widget_node = WidgetNode(json_obj['resource-id'] if 'resource-id' in json_obj else None, json_obj['class'],
+                             args[KEY_ANCESTOR_CLICKABLE],
+                             node_sha1(json_obj) if CROP_WIDGET or ANALYSIS_MODE else None,
+                             json_obj if ANALYSIS_MODE else None)
+    node = tree.add_node(parent, node_keys[id(json_obj)], widget_type, json_obj['bounds'], widget_node)
 
     # 传递参数：如果外层 layout/list 的 clickable 属性为真，则传递该参数用于后续类型判断（递归传递）
     if widget_type == Widget.Layout or widget_type == Widget.List:
@@ -409,49 +893,81 @@ def dfs_create_tree(json_obj, args, ancestor_clickable_stack, parent_node, nodes
 
             for i in range(len_children):
                 child_json_obj = json_obj['children'][sorted_child_midpoint[i][0]]
-                dfs_create_tree(child_json_obj, args, ancestor_clickable_stack, tree_node, nodes_dict, rico_index)
+                dfs_create_tree(child_json_obj, args, ancestor_clickable_stack, tree, node, node_keys, rico_index)
         elif len_children == 1:
-            dfs_create_tree(json_obj['children'][0], args, ancestor_clickable_stack, tree_node, nodes_dict, rico_index)
+            dfs_create_tree(json_obj['children'][0], args, ancestor_clickable_stack, tree, node, node_keys, rico_index)
 
     # 清除传递的参数
     if widget_type == Widget.Layout:
         args[KEY_ANCESTOR_CLICKABLE] = ancestor_clickable_stack.pop()
 
 
-def dfs_process_invalid_nodes(tree_node, nodes_dict):
+def dfs_process_invalid_nodes(tree, node):
     """
     在刚开始分析 XML 时从树上删除孤立 Layout/Unclassified 节点、面积过小的控件、面积过大的叶子控件
-    :param tree_node:
-    :param nodes_dict:
+    :param tree: WidgetTree
+    :param node: 节点编号
     :return:
     """
-    widget_node = nodes_dict[tree_node.name]
-    widget_type = widget_node.w_type
-    widget_bounds = widget_node.w_bounds
+    widget_type = tree.widget_type(node)
+    widget_bounds = tree.widget_bounds(node)
     w = max(0, widget_bounds[2] - widget_bounds[0]) + 1
     h = max(0, widget_bounds[3] - widget_bounds[1]) + 1
 
     if (widget_type == Widget.Layout or widget_type == Widget.Unclassified or widget_type == Widget.List) and \
-            len(tree_node.children) == 0 or w <= 40 or h <= 50 or widget_type == Widget.TextView and w <= 80 or \
+            len(tree.children[node]) == 0 or w <= 40 or h <= 50 or widget_type == Widget.TextView and w <= 80 or \
             (w * h) / (WIDTH * HEIGHT) > 0.8 and widget_type != Widget.Layout and widget_type != Widget.List:
-        tree_node.parent = None
+        tree.detach(node)
     else:
-        for child in tree_node.children:
-            dfs_process_invalid_nodes(child, nodes_dict)
+        for child in tuple(tree.children[node]):
+            dfs_process_invalid_nodes(tree, child)
+
 
+class WidgetBoundsIndex(object):
+    """
+    一个屏幕中参与遮盖判断的控件（非 Layout/Unclassified/List 且面积小于 1000000 的控件，包括已从树上删除的节点，
+    key 相同的节点只保留一个）的 bounds 索引。控件按左边界排序，查询时二分查找左边界不超过目标右边界的前缀，
+    再批量过滤出与目标有交叠（交集面积大于 0）的控件
+    """
 
-def dfs_process_overlapped_widgets(tree_node, nodes_dict, removable_widgets):
+    def __init__(self, tree):
+        nodes = np.array(list(tree.key_nodes.values()), dtype=np.int64)  # 按 key 首次出现的顺序
+        types = tree.types[nodes]
+        bounds = tree.bounds[nodes]
+        areas = (np.maximum(0, bounds[:, 2] - bounds[:, 0]) + 1) * (np.maximum(0, bounds[:, 3] - bounds[:, 1]) + 1)
+        selected = np.flatnonzero((types != Widget.Layout.value) & (types != Widget.Unclassified.value) &
+                                  (types != Widget.List.value) & (areas < 1000000))
+        order = selected[np.argsort(bounds[selected, 0], kind='stable')]
+        self.nodes = nodes[order]
+        self.positions = order  # 在 key 首次出现顺序中的位置
+        self.bounds = bounds[order]
+
+    def overlapping(self, bounds):
+        """
+        :param bounds: 目标控件 bounds
+        :return: 与目标交集面积大于 0 的控件节点编号（每个 key 一个，按 key 首次出现的顺序）
+        """
+        end = np.searchsorted(self.bounds[:, 0], bounds[2], side='right')
+        candidates = self.bounds[:end]
+        mask = (candidates[:, 2] >= bounds[0]) & (candidates[:, 2] >= candidates[:, 0]) & \
+               (candidates[:, 1] <= bounds[3]) & (candidates[:, 3] >= bounds[1]) & \
+               (candidates[:, 3] >= candidates[:, 1]) & (bounds[2] >= bounds[0]) & (bounds[3] >= bounds[1])
+        hits = np.flatnonzero(mask)
+        return self.nodes[hits[np.argsort(self.positions[hits])]].tolist()
+
+
+def dfs_process_overlapped_widgets(tree, node, bounds_index, removable_widgets):
     """
     处理控件重叠情况，遍历完成后确定不需绘制的控件，将其加入到 removable_widgets
-    :param tree_node: 树节点
-    :param nodes_dict: 节点字典
-    :param removable_widgets: 不需绘制的控件 sha1 值（方法最终返回后统一删除）
+    :param tree: WidgetTree
+    :param node: 节点编号
+    :param bounds_index: tree 的 WidgetBoundsIndex
+    :param removable_widgets: 不需绘制的控件 key（方法最终返回后统一删除）
     :return:
     """
-    widget_node = nodes_dict[tree_node.name]
-
-    widget_type = widget_node.w_type
-    widget_bounds = widget_node.w_bounds
+    widget_type = tree.widget_type(node)
+    widget_bounds = tree.widget_bounds(node)
+    node_key = tree.keys[node]
     tree_node_area = (max(0, widget_bounds[2] - widget_bounds[0]) + 1) * (
             max(0, widget_bounds[3] - widget_bounds[1]) + 1)
 
@@ -460,30 +976,30 @@ def dfs_process_overlapped_widgets(tree_node, nodes_dict, removable_widgets):
         part_covered_widgets = set()  # 部分被遮盖的控件
         identical_widgets = set()  # 完全重叠的控件
 
-        for sha, node in nodes_dict.items():
-            if sha != tree_node.name and node.w_type != Widget.Layout and node.w_type != Widget.Unclassified and node.w_type != Widget.List:
-                node_bounds = node.w_bounds
+        # 只有交集面积大于 0 的控件可能被判定为遮盖、交叠或重叠（不判断面积很大的控件、也可加入面积过小的判断）
+        for other in bounds_index.overlapping(widget_bounds):
+            sha = tree.keys[other]
+            if sha != node_key:
+                node_bounds = tree.widget_bounds(other)
                 dict_node_area = (max(0, node_bounds[2] - node_bounds[0]) + 1) * (
                         max(0, node_bounds[3] - node_bounds[1]) + 1)
-                # 不判断面积很大的控件、也可加入面积过小的判断
-                if dict_node_area < 1000000:
-                    xia = max(widget_bounds[0], node_bounds[0])
-                    yia = max(widget_bounds[1], node_bounds[1])
-                    xib = min(widget_bounds[2], node_bounds[2])
-                    yib = min(widget_bounds[3], node_bounds[3])
-                    intersection_area = max(0, xib - xia + 1) * max(0, yib - yia + 1)
-                    union_area = tree_node_area + dict_node_area - intersection_area
-                    # 回避相同位置重叠多个相同控件的情形
-                    if intersection_area / dict_node_area > 0.95 and intersection_area / union_area < 0.99:  # 该控件绝大部分被当前控件覆盖
-                        most_covered_widgets.add(sha)
-                    elif 0.01 < intersection_area / union_area < 0.99:  # 该控件并未被完全覆盖但与当前控件有交叠
-                        part_covered_widgets.add(sha)
-                    elif intersection_area / union_area == 1.00:
-                        identical_widgets.add(sha)
+                xia = max(widget_bounds[0], node_bounds[0])
+                yia = max(widget_bounds[1], node_bounds[1])
+                xib = min(widget_bounds[2], node_bounds[2])
+                yib = min(widget_bounds[3], node_bounds[3])
+                intersection_area = max(0, xib - xia + 1) * max(0, yib - yia + 1)
+                union_area = tree_node_area + dict_node_area - intersection_area
+                # 回避相同位置重叠多个相同控件的情形
+                if intersection_area / dict_node_area > 0.95 and intersection_area / union_area < 0.99:  # 该控件绝大部分被当前控件覆盖
+                    most_covered_widgets.add(sha)
+                elif 0.01 < intersection_area / union_area < 0.99:  # 该控件并未被完全覆盖但与当前控件有交叠
+                    part_covered_widgets.add(sha)
+                elif intersection_area / union_area == 1.00:
+                    identical_widgets.add(sha)
 
         # if len(most_covered_widgets) >= 4 or len(most_covered_widgets) > 1 and len(most_covered_widgets) > 3:
         if len(most_covered_widgets) >= 3:  # 覆盖很多其他控件的控件如背景图片
-            tree_node.parent = None
+            tree.detach(node)
         elif 0 < len(most_covered_widgets) < 3:  # 如果覆盖 1~2 个则保留该控件但删去被覆盖控件和有交叠的控件
             removable_widgets.update(most_covered_widgets)
             removable_widgets.update(part_covered_widgets)
@@ -492,56 +1008,81 @@ def dfs_process_overlapped_widgets(tree_node, nodes_dict, removable_widgets):
             #     to_remove_widgets.extend(part_covered_widgets)
             pass
 
-        if len(identical_widgets) > 0 and tree_node.name not in removable_widgets:
+        if len(identical_widgets) > 0 and node_key not in removable_widgets:
             removable_widgets.update(identical_widgets)
 
-    for child in tree_node.children:
-        dfs_process_overlapped_widgets(child, nodes_dict, removable_widgets)
+    for child in tuple(tree.children[node]):
+        dfs_process_overlapped_widgets(tree, child, bounds_index, removable_widgets)
 
 
-def dfs_remove_covered_widgets(tree_node, removable_widgets):
+def dfs_remove_covered_widgets(tree, node, removable_widgets):
     """
-    递归删除 sha1 值在 removable_widgets 列表中的控件
-    :param tree_node: 当前树节点
-    :param removable_widgets: 待删除控件 sha1 值列表
+    递归删除 key 在 removable_widgets 列表中的控件（旧版，仅用于比较报告）
+    :param tree: WidgetTree
+    :param node: 当前节点编号
+    :param removable_widgets: 待删除控件 key 列表
     :return:
     """
-    if tree_node.name in removable_widgets:
-        tree_node.parent = None
+    if tree.keys[node] in removable_widgets:
+        tree.detach(node)
     else:
-        for child in tree_node.children:
-            dfs_remove_covered_widgets(child, removable_widgets)
+        for child in tuple(tree.children[node]):
+            dfs_remove_covered_widgets(tree, child, removable_widgets)
 
 
-def dfs_create_sketch(tree_node, nodes_dict, im_screenshot, im_sketch, rico_index, csv_rows):
+def dfs_create_sketch(tree, node, im_screenshot, sketch_nodes, rico_index, csv_rows):
     """
-    递归绘制草图
-    :param tree_node: 当前树节点
-    :param nodes_dict: node_sha1: WidgetNode 字典
+    递归确定草图中待绘制的控件（同时裁剪控件、生成分析模式的 csv 行）
+    :param tree: WidgetTree
+    :param node: 当前节点编号
     :param im_screenshot: 用于裁剪控件的屏幕截图 Pillow 对象
-    :param im_sketch: 用于绘制草图的 Pillow 对象
+    :param sketch_nodes: 按绘制顺序保存待绘制控件节点编号的列表
     :param rico_index: Rico 序号
     :return:
     """
-    widget_node = nodes_dict[tree_node.name]
+    widget_node = tree.widgets[node]
 
-    widget_type = widget_node.w_type
-    widget_bounds = widget_node.w_bounds
+    widget_type = tree.widget_type(node)
+    widget_bounds = tree.widget_bounds(node)
     widget_id = widget_node.w_id
     widget_class = widget_node.w_class
 
     if widget_type != Widget.Layout:
         if CROP_WIDGET:
-            crop_widget(im_screenshot, rico_index, widget_type, widget_bounds, widget_id, widget_class, tree_node.name)
+            crop_widget(im_screenshot, rico_index, widget_type, widget_bounds, widget_id, widget_class,
+                        widget_node.w_sha1)
         if widget_type != Widget.Unclassified:
-            draw_widget(im_sketch, widget_type, widget_bounds)
+            sketch_nodes.append(node)
 
     if ANALYSIS_MODE:
-        append_csv_row(tree_node.name, widget_node.w_json, widget_type, rico_index,
+        append_csv_row(widget_node.w_sha1, widget_node.w_json, widget_type, rico_index,
                        widget_node.w_ancestor_clickable, csv_rows)
 
-    for child in tree_node.children:
-        dfs_create_sketch(child, nodes_dict, im_screenshot, im_sketch, rico_index, csv_rows)
+    for child in tree.children[node]:
+        dfs_create_sketch(tree, child, im_screenshot, sketch_nodes, rico_index, csv_rows)
+
+
+def render_sketch(tree, sketch_nodes):
+    """
+    按顺序绘制控件色块，训练数据模式下得到逆时针旋转 90 度后的草图
+    :param tree: WidgetTree
+    :param sketch_nodes: 按绘制顺序排列的待绘制控件节点编号
+    :return: 草图 uint8 数组 (高, 宽, 3)（NumPy 绘制时为 sketch_canvas 的缓冲区，下一次绘制时被覆盖）
+    """
+    if SKETCH_BACKEND == 'pil':
+        im_sketch = Image.new('RGB', (SKETCH_WIDTH, SKETCH_HEIGHT), (255, 255, 255))
+        for node in sketch_nodes:
+            draw_widget(im_sketch, tree.widget_type(node), tree.widget_bounds(node))
+        if TRAINING_DATA_MODE:
+            im_sketch = im_sketch.rotate(90, expand=1)
+        return np.asarray(im_sketch)
+
+    if IMG_MODE != 'color':
+        raise Exception("Unsupported sketch mode.")
+    nodes = np.array(sketch_nodes, dtype=np.intp)
+    types = tree.types[nodes]
+    boxes = widget_sketch_boxes(types, tree.bounds[nodes], (WIDTH, HEIGHT), (SKETCH_WIDTH, SKETCH_HEIGHT))
+    return sketch_canvas.draw(types, boxes)
 
 
 def crop_widget(im_screenshot, rico_index, widget_type, widget_bounds, widget_id, widget_class, node_sha1):
@@ -750,34 +1291,14 @@ def draw_widget(im, widget_type, bounds):
 
 def draw_colored_image(im, widget_type, bounds):
     """
-    在 Image 对象上绘制与控件类型对应的彩色图
+    在 Image 对象上绘制与控件类型对应的彩色图（颜色见 WIDGET_COLORS）
     :param im: Image 对象
     :param widget_type: 控件类型（据此绘制颜色不同的色块）
     :param bounds: 实际绘制到 im 上的坐标值
     :return:
     """
-    if widget_type == Widget.Button:
-        im.paste(im=WidgetColor.BLUE_RGB, box=bounds)
-    elif widget_type == Widget.TextView:
-        im.paste(im=WidgetColor.BLACK_RGB, box=bounds)
-    # elif widget_type == Widget.TextLink:
-    #     im.paste(im=WidgetColor.NAVY_RGB, box=bounds)
-    elif widget_type == Widget.EditText:
-        im.paste(im=WidgetColor.LIME_RGB, box=bounds)
-    elif widget_type == Widget.ImageView:
-        im.paste(im=WidgetColor.RED_RGB, box=bounds)
-    # elif widget_type == Widget.ImageLink:
-    #     im.paste(im=WidgetColor.MAROON_RGB, box=bounds)
-    elif widget_type == Widget.CheckBox:
-        im.paste(im=WidgetColor.MAGENTA_RGB, box=bounds)
-    elif widget_type == Widget.Switch:
-        im.paste(im=WidgetColor.CYAN_RGB, box=bounds)
-    elif widget_type == Widget.RadioButton:
-        im.paste(im=WidgetColor.YELLOW_RGB, box=bounds)
-    elif widget_type == Widget.Toolbar:
-        im.paste(im=WidgetColor.GREEN_RGB, box=bounds)
-    elif widget_type == Widget.List:
-        im.paste(im=WidgetColor.GRAY_RGB, box=bounds)
+    if widget_type in WIDGET_COLORS:
+        im.paste(im=WIDGET_COLORS[widget_type], box=bounds)
 
 
 def hash_file_sha1(file_path):
@@ -800,74 +1321,145 @@ if __name__ == '__main__':
 
     start_time = time.time()
     print('---------------------------------')
-    print('### Cleaned json files location:', cleaned_jsons_dir)
-
-    print('### Checking directories to save generated sketches:', colored_pics_divided_dir, '...', end=' ')
-    check_make_dir(colored_pics_divided_dir)
-    print('OK')
-
-    # 初始化放置控件裁切的位置
-    if CROP_WIDGET:
-        print('### Directories to save widget crops:', WIDGET_CUT_OUT_PATH)
-        # for widget in Widget:
-        #     dir_path = os.path.join(WIDGET_CUT_OUT_PATH, widget.name)
-        #     if os.path.exists(dir_path):
-        #         shutil.rmtree(dir_path)
-        #     os.makedirs(dir_path)
-        if os.path.exists(WIDGET_CUT_OUT_PATH):
-            shutil.rmtree(WIDGET_CUT_OUT_PATH)
-        os.makedirs(WIDGET_CUT_OUT_PATH)
-
-    if TRAINING_DATA_MODE:
-        # 先创建/覆盖文件用于添加内容
-        check_make_dir(data_dir)
-        check_make_dir(layout_repo_dir)
-        print('### Checking data directory to save training related files:', data_dir, '... OK')
-
-        open(layout_sequences_fp, 'w', newline='')
-        open(index_map_fp, 'w', newline='')
-        open(rico_layout_repo_fp, 'w', newline='')
-        print('### Creating training related files ... OK')
 
-    if ANALYSIS_MODE:
-        with open(CSV_FILE_PATH, 'w', newline='') as f:
-            csv.writer(f).writerow(COLUMN_TITLES)
-
-    for case_name in os.listdir(rico_divided_dir):
-        if not case_name.startswith('.'):  # hidden files
-            input_case_dir = os.path.join(cleaned_jsons_dir, case_name)
-            output_case_dir = os.path.join(colored_pics_divided_dir, case_name)
-            print('[' + datetime.now().strftime('%m-%d %H:%M:%S') + '] >>> Processing', output_case_dir, '...', end=' ')
-
-            check_make_dir(output_case_dir)
-            for file in os.listdir(input_case_dir):
-                if file.endswith('.json'):
-                    sketch_samples_generation(os.path.join(rico_divided_dir, case_name),
-                                              os.path.join(cleaned_jsons_dir, case_name),
-                                              os.path.join(colored_pics_divided_dir, case_name),
-                                              file.split('.')[0], layout_sequences_fp, index_map_fp)
+    if MODE == 'generate':
+        print('### Cleaned json files location:', cleaned_jsons_dir)
+
+        # 每个子文件夹为一个分片，按 Rico 序号顺序排列（hidden files 除外）
+        case_names = sorted((case_name for case_name in os.listdir(rico_divided_dir) if not case_name.startswith('.')),
+                            key=rico_index_key)
+
+        # 继续上次中断的运行：沿用清单中通过检查的分片，删除其他分片留下的文件
+        manifest = load_manifest(case_names) if RESUME else None
+        if manifest is not None:
+            remove_partial_outputs(manifest)
+            print('### Resuming:', len(manifest['shards']), 'of', len(case_names), 'directories already completed')
+        else:
+            manifest = {'settings': generation_settings(), 'shards': {}}
+            if os.path.exists(shards_dir):
+                shutil.rmtree(shards_dir)
+            if SKETCH_OUTPUT == 'shards' and os.path.exists(training_shards_dir):
+                shutil.rmtree(training_shards_dir)
+        check_make_dir(shards_dir)
+        save_manifest(manifest)
+
+        sketches_out_dir = training_shards_dir if SKETCH_OUTPUT == 'shards' else colored_pics_divided_dir
+        print('### Checking directories to save generated sketches:', sketches_out_dir, '...', end=' ')
+        check_make_dir(sketches_out_dir)
+        print('OK')
+
+        # 初始化放置控件裁切的位置（继续运行时保留已完成分片的裁切）
+        if CROP_WIDGET:
+            print('### Directories to save widget crops:', WIDGET_CUT_OUT_PATH)
+            # for widget in Widget:
+            #     dir_path = os.path.join(WIDGET_CUT_OUT_PATH, widget.name)
+            #     if os.path.exists(dir_path):
+            #         shutil.rmtree(dir_path)
+            #     os.makedirs(dir_path)
+            if len(manifest['shards']) == 0 and os.path.exists(WIDGET_CUT_OUT_PATH):
+                shutil.rmtree(WIDGET_CUT_OUT_PATH)
+            check_make_dir(WIDGET_CUT_OUT_PATH)
+
+        if TRAINING_DATA_MODE:
+            # 先创建/覆盖文件用于添加内容
+            check_make_dir(data_dir)
+            check_make_dir(layout_repo_dir)
+            print('### Checking data directory to save training related files:', data_dir, '... OK')
+
+        pending_case_names = [case_name for case_name in case_names if case_name not in manifest['shards']]
+        print('### Generating sketches of', len(pending_case_names), 'directories with', NUM_WORKERS, 'processes')
+        pool = Pool(NUM_WORKERS) if NUM_WORKERS > 1 else None
+        shard_results = pool.imap(generate_shard, pending_case_names) if pool is not None else \
+            map(generate_shard, pending_case_names)
+        for case_name, num_layouts, shard_widgets_count, shard_container_cnt in shard_results:
+            # 每完成一个分片即更新清单
+            manifest['shards'][case_name] = make_shard_record(case_name, num_layouts, shard_widgets_count,
+                                                              shard_container_cnt)
+            save_manifest(manifest)
+            print('[' + datetime.now().strftime('%m-%d %H:%M:%S') + '] >>> Processed',
+                  os.path.join(sketches_out_dir, case_name), '(' + str(num_layouts) + ' layouts) ... OK')
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        # 按分片顺序累加，计数与首次出现的顺序均与单进程、不中断运行相同
+        total_widgets_count = {}
+        total_container_cnt = {}
+        shard_sizes = []
+        for case_name in case_names:
+            record = manifest['shards'][case_name]
+            shard_sizes.append((case_name, record['size']))
+            for key, value in record['widgets_count'].items():
+                total_widgets_count[key] = total_widgets_count.get(key, 0) + value
+            for key, value in record['container_cnt'].items():
+                total_container_cnt[key] = total_container_cnt.get(key, 0) + value
+
+        if SKETCH_OUTPUT == 'shards':
+            write_dataset_meta(training_shards_dir, shard_sizes, sketch_canvas.buffer.shape)
+        print('<<< Generated sketches saved in', sketches_out_dir)
+
+        if TRAINING_DATA_MODE:
+            print('>>> Merging', len(case_names), 'shards ...', end=' ')
+            num_sequences = merge_shards(case_names, layout_sequences_fp, index_map_fp)
             print('OK')
+            print('<<<', num_sequences, 'layout sequences saved in', layout_sequences_fp)
+        if ANALYSIS_MODE:
+            merge_shards_csv(case_names)
+        shutil.rmtree(shards_dir)
 
-    print('<<< Generated sketches saved in', colored_pics_divided_dir)
-
-    if CROP_WIDGET:
-        print('<<< Cropped widget images saved in', WIDGET_CUT_OUT_PATH)
-    if ANALYSIS_MODE:
-        print('<<< Analysis csv file saved in ', CSV_FILE_PATH)
-
-    sorted_map = sorted(widgets_count.items(), key=operator.itemgetter(1), reverse=True)
-    cnt_sum = 0
-    for i, (key, value) in enumerate(sorted_map):
-        print(i + 1, key, value)
-        cnt_sum += value
-    print('Total widget counts:', cnt_sum)
-
-    sorted_map = sorted(container_cnt.items(), key=operator.itemgetter(1), reverse=True)
-    cnt_sum = 0
-    for i, (key, value) in enumerate(sorted_map):
-        print(i + 1, key, value)
-        cnt_sum += value
-    print('Total container counts:', cnt_sum)
+        if CROP_WIDGET:
+            print('<<< Cropped widget images saved in', WIDGET_CUT_OUT_PATH)
+        if ANALYSIS_MODE:
+            print('<<< Analysis csv file saved in ', CSV_FILE_PATH)
+
+        sorted_map = sorted(total_widgets_count.items(), key=operator.itemgetter(1), reverse=True)
+        cnt_sum = 0
+        for i, (key, value) in enumerate(sorted_map):
+            print(i + 1, key, value)
+            cnt_sum += value
+        print('Total widget counts:', cnt_sum)
+
+        sorted_map = sorted(total_container_cnt.items(), key=operator.itemgetter(1), reverse=True)
+        cnt_sum = 0
+        for i, (key, value) in enumerate(sorted_map):
+            print(i + 1, key, value)
+            cnt_sum += value
+        print('Total container counts:', cnt_sum)
+
+    if MODE == 'normalization_report':
+        # 比较旧版三轮清理/压缩与不动点清理/压缩的结果，不生成草图
+        case_names = sorted((case_name for case_name in os.listdir(cleaned_jsons_dir) if not case_name.startswith('.')),
+                            key=rico_index_key)
+        check_make_dir(data_dir)
+        print('>>> Comparing tree normalization of', len(case_names), 'directories in', cleaned_jsons_dir, '...')
+        pool = Pool(NUM_WORKERS) if NUM_WORKERS > 1 else None
+        shard_results = pool.imap(normalization_report_shard, case_names) if pool is not None else \
+            map(normalization_report_shard, case_names)
+        num_layouts = 0
+        category_counts = {'iterations': 0, 'list_collapse': 0, 'rules': 0}
+        iteration_counts = {}
+        with AtomicWriter(normalization_report_fp) as f:
+            f.write('\t'.join(['rico_index', 'category', 'legacy_iterations', 'legacy_tokens', 'tokens']) + '\n')
+            for case_name, num_case_layouts, differences in shard_results:
+                num_layouts += num_case_layouts
+                for rico_index, category, legacy_tokens, tokens, num_iterations in differences:
+                    category_counts[category] += 1
+                    iteration_counts[num_iterations] = iteration_counts.get(num_iterations, 0) + 1
+                    f.write('\t'.join([rico_index, category, str(num_iterations), ' '.join(legacy_tokens),
+                                       ' '.join(tokens)]) + '\n')
+        if pool is not None:
+            pool.close()
+            pool.join()
+        num_differences = sum(category_counts.values())
+        print('### Layouts:', num_layouts, '| Identical:', num_layouts - num_differences,
+              '| Different:', num_differences)
+        print('### Different because', LEGACY_ITERATIONS, 'iterations were not enough:', category_counts['iterations'],
+              '| Different in single-child List collapse:', category_counts['list_collapse'],
+              '| Different because of other rules:', category_counts['rules'])
+        if iteration_counts:
+            print('### Legacy iterations (with changes) of different layouts:',
+                  ', '.join('%d: %d' % item for item in sorted(iteration_counts.items())))
+        print('<<< Normalization report saved in', normalization_report_fp)
 
     print('---------------------------------')
     print('Duration: {:.2f} s'.format(time.time() - start_time))
@@ -9,6 +9,7 @@ import random
 import time
 from configparser import ConfigParser, ExtendedInterpolation
 
+from rico.dataset import VOCAB
 from utils.widget import Widget
 
 cfg = ConfigParser(interpolation=ExtendedInterpolation())
@@ -36,8 +37,7 @@ def gen_vocab_file(vocab_file_path):
     :return:
     """
     with open(vocab_file_path, 'w') as f:
-        f.write('{\n}\n')
-        f.write('\n'.join([widget.name for widget in Widget]))
+        f.write('\n'.join(VOCAB))
     print('>>> Generating Vocabulary file', vocab_file_path, '... OK')
 
 
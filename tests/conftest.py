@@ -0,0 +1,7 @@
+import os
+import sys
+
+# 与直接运行各脚本时相同：项目根目录在 sys.path 中，工作目录为项目根目录的子目录（模块读取 ../config.ini）
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+os.chdir(TESTS_DIR)
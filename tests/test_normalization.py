@@ -0,0 +1,101 @@
+"""
+dfs_normalize_tree 与旧版多轮 dfs_compress_tree / dfs_remove_invalid_leaf 运行到不再变化时的结果比较
+"""
+import random
+
+import pytest
+
+from rico.generator import normalize_widget_tree, make_tree_tokens, LEGACY_MAX_ITERATIONS
+from utils.widget import Widget, WidgetTree
+
+
+def make_tree(spec):
+    """
+    由 (Widget, [子节点 spec]) 构造 WidgetTree，各节点 key 不同
+    """
+    tree = WidgetTree()
+
+    def add(parent, node_spec):
+        widget_type, children = node_spec
+        node = tree.add_node(parent, len(tree), widget_type, [0, 0, 1, 1], None)
+        for child_spec in children:
+            add(node, child_spec)
+
+    add(WidgetTree.ROOT, spec)
+    tree.finish()
+    return tree
+
+
+def normalized_tokens(spec, removable_widgets=(), legacy_iterations=None):
+    tree = make_tree(spec)
+    normalize_widget_tree(tree, set(removable_widgets), legacy_iterations)
+    return make_tree_tokens(tree)
+
+
+def legacy_fixpoint_tokens(spec, removable_widgets=()):
+    return normalized_tokens(spec, removable_widgets, LEGACY_MAX_ITERATIONS)
+
+
+def leaf(widget_type):
+    return widget_type, []
+
+
+LAYOUT, LIST, UNCLASSIFIED = Widget.Layout, Widget.List, Widget.Unclassified
+BUTTON, CHECKBOX = leaf(Widget.Button), leaf(Widget.CheckBox)
+
+SINGLE_CHILD_LIST_TREES = [
+    # 单孩子 Layout 被压缩时已是单孩子的 List 一并被压缩
+    (LAYOUT, [(LIST, [BUTTON])]),
+    (LAYOUT, [(LAYOUT, [(LIST, [BUTTON])])]),
+    # 与其他子节点并列的单孩子 List 保留
+    (LAYOUT, [(LIST, [BUTTON]), CHECKBOX, CHECKBOX, CHECKBOX]),
+    # 清理其他子节点之后才变为单孩子的 List：上层 Layout 已先被替换为该 List
+    (LAYOUT, [(LIST, [BUTTON, leaf(LAYOUT)])]),
+    (LAYOUT, [(LIST, [BUTTON, (LAYOUT, [leaf(LIST)])])]),
+    # 清理之后才变为单孩子的 Layout 被压缩时，链上已是单孩子的 List 被压缩
+    (LAYOUT, [leaf(UNCLASSIFIED), (LIST, [BUTTON])]),
+    (LAYOUT, [(LAYOUT, [leaf(LAYOUT)]), (LIST, [(LIST, [BUTTON])])]),
+    # List { List }
+    (LIST, [(LIST, [BUTTON, CHECKBOX])]),
+    (LIST, [(UNCLASSIFIED, [leaf(LIST)]), (LIST, [BUTTON])]),
+    (LIST, [leaf(LAYOUT), (LIST, [(LAYOUT, [BUTTON])])]),
+    # 单孩子链经过 Unclassified 时其子孙被保留
+    (LAYOUT, [(UNCLASSIFIED, [(LIST, [BUTTON])])]),
+]
+
+
+@pytest.mark.parametrize('spec', SINGLE_CHILD_LIST_TREES)
+def test_single_child_lists_match_legacy_fixpoint(spec):
+    assert normalized_tokens(spec) == legacy_fixpoint_tokens(spec)
+
+
+def test_late_single_child_list_is_kept():
+    spec = (LAYOUT, [(LIST, [BUTTON, leaf(LAYOUT)])])
+    assert normalized_tokens(spec) == ['List', '{', 'Button', '}']
+    spec = (LAYOUT, [(LIST, [BUTTON]), CHECKBOX, CHECKBOX, CHECKBOX])
+    assert normalized_tokens(spec) == ['Layout', '{', 'List', '{', 'Button', '}', 'CheckBox', 'CheckBox', 'CheckBox',
+                                       '}']
+
+
+def random_spec(rng, depth):
+    widget_type = rng.choice([LAYOUT, LAYOUT, LIST, LIST, UNCLASSIFIED, Widget.Button, Widget.TextView])
+    num_children = 0 if depth == 0 else rng.choice([0, 1, 1, 1, 2, 3])
+    return widget_type, [random_spec(rng, depth - 1) for _ in range(num_children)]
+
+
+def test_random_trees_match_legacy_fixpoint():
+    rng = random.Random(0)
+    for i in range(2000):
+        spec = random_spec(rng, rng.randint(1, 7))
+        removable_widgets = [key for key in range(2, 40) if rng.random() < 0.05]
+        assert normalized_tokens(spec, removable_widgets) == legacy_fixpoint_tokens(spec, removable_widgets), spec
+
+
+def test_normalization_is_idempotent():
+    rng = random.Random(1)
+    for i in range(500):
+        tree = make_tree(random_spec(rng, rng.randint(1, 7)))
+        normalize_widget_tree(tree, set())
+        tokens = make_tree_tokens(tree)
+        normalize_widget_tree(tree, set())
+        assert make_tree_tokens(tree) == tokens
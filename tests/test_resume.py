@@ -0,0 +1,56 @@
+"""
+中断后继续运行时 remove_partial_outputs 只删除未完成分片留下的文件
+"""
+import os
+
+import pytest
+
+from rico import generator
+
+
+def touch(dir_path, *file_names):
+    os.makedirs(dir_path, exist_ok=True)
+    for file_name in file_names:
+        with open(os.path.join(dir_path, file_name), 'w') as f:
+            f.write('x')
+
+
+@pytest.fixture
+def output_dirs(tmp_path, monkeypatch):
+    shards_dir = str(tmp_path / 'data' / 'shards')
+    training_shards_dir = str(tmp_path / 'training-shards')
+    monkeypatch.setattr(generator, 'shards_dir', shards_dir)
+    monkeypatch.setattr(generator, 'manifest_fp', os.path.join(shards_dir, 'manifest.json'))
+    monkeypatch.setattr(generator, 'training_shards_dir', training_shards_dir)
+
+    touch(shards_dir, 'manifest.json', '0.lst', '0.csv', '1.lst.tmp', '2.lst')
+    # 已完成的二进制数据集（其他运行生成）与 0 号分片、1 号分片（未完成）
+    touch(training_shards_dir, 'meta.json', 'meta.json.tmp', 'notes.txt',
+          '0.images.npy', '0.tokens.npy', '0.offsets.npy', '0.indices.npy',
+          '1.images.npy.tmp', '1.tokens.npy', '1.indices.npy.tmp',
+          '2.images.npy', '1.images.png')
+    return shards_dir, training_shards_dir
+
+
+MANIFEST = {'settings': {}, 'shards': {'0': {}}}
+
+
+def test_resume_shards_keeps_unrelated_files(output_dirs, monkeypatch):
+    shards_dir, training_shards_dir = output_dirs
+    monkeypatch.setattr(generator, 'SKETCH_OUTPUT', 'shards')
+    generator.remove_partial_outputs(MANIFEST)
+
+    assert sorted(os.listdir(shards_dir)) == ['0.csv', '0.lst', 'manifest.json']
+    assert sorted(os.listdir(training_shards_dir)) == ['0.images.npy', '0.indices.npy', '0.offsets.npy',
+                                                       '0.tokens.npy', '1.images.png', 'meta.json',
+                                                       'meta.json.tmp', 'notes.txt']
+
+
+def test_resume_png_keeps_training_shards(output_dirs, monkeypatch):
+    shards_dir, training_shards_dir = output_dirs
+    before = sorted(os.listdir(training_shards_dir))
+    monkeypatch.setattr(generator, 'SKETCH_OUTPUT', 'png')
+    generator.remove_partial_outputs(MANIFEST)
+
+    assert sorted(os.listdir(shards_dir)) == ['0.csv', '0.lst', 'manifest.json']
+    assert sorted(os.listdir(training_shards_dir)) == before
@@ -19,6 +19,8 @@ MODE = 'divide_rico'  # divide_rico merge_sketches file_copy
 NUM_PER_DIR = 1000
 # NUM_PER_DIR = 2
 
+WRITE_BUF_SIZE = 1 << 20  # AtomicWriter 的写入缓冲区大小
+
 cfg = ConfigParser(interpolation=ExtendedInterpolation())
 cfg.read('../config.ini')
 
@@ -62,6 +64,96 @@ def move_file(src_path, dst_path):
         shutil.move(src_path, dst_path)
 
 
+class AtomicWriter(object):
+    """
+    先写入同目录下的临时文件（path + '.tmp'），以 WRITE_BUF_SIZE 大小的块写出；commit 时刷新到磁盘后用 os.replace 替换 path，
+    未 commit 就 abort 时删除临时文件。因此 path 要么不存在 / 保持原内容，要么是完整写入的新内容
+    """
+
+    def __init__(self, path, mode='w', buffer_size=None, **kwargs):
+        """
+        :param path: 目标文件路径
+        :param mode: 'w' 或 'wb'
+        :param buffer_size: 写入缓冲区大小（默认为 WRITE_BUF_SIZE）
+        :param kwargs: 传给 open 的其他参数（newline、encoding 等）
+        """
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.file = open(self.tmp_path, mode, buffering=buffer_size or WRITE_BUF_SIZE, **kwargs)
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def sync(self):
+        """
+        将缓冲区中的内容写出并刷新到磁盘，然后关闭临时文件
+        """
+        if not self.file.closed:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+
+    def commit(self):
+        self.sync()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+class FileTransaction(object):
+    """
+    同时写入的一组文件（AtomicWriter）：全部写完后先统一刷新到磁盘再依次替换目标文件，出错时全部放弃。
+    用法：
+        with FileTransaction() as transaction:
+            f_a = transaction.open(path_a)
+            f_b = transaction.open(path_b)
+            ...
+    """
+
+    def __init__(self):
+        self.writers = []
+
+    def open(self, path, mode='w', **kwargs):
+        writer = AtomicWriter(path, mode, **kwargs)
+        self.writers.append(writer)
+        return writer
+
+    def commit(self):
+        try:
+            for writer in self.writers:
+                writer.sync()
+        except BaseException:
+            self.abort()
+            raise
+        for writer in self.writers:
+            writer.commit()
+
+    def abort(self):
+        for writer in self.writers:
+            writer.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
 def make_sub_dir(src_dir, output_dir):
     check_make_dir(output_dir)
     print('### Checking/Making root directory to save divided directories ... OK')
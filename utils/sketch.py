@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" 组件块着色图的 NumPy 绘制（rico/generator.py 与 cga/sketch_parser.py 共用）。
+    一张图的全部控件以类型编码数组与绘制范围数组的形式给出，按顺序（后绘制的覆盖先绘制的）填充到预先分配的 uint8 缓冲区中，
+    结果与逐个控件执行 Image.paste 的像素完全相同；rotate 为 True 时直接绘制为逆时针旋转 90 度
+    （即 Image.rotate(90, expand=1)）后的方向。
+"""
+
+import numpy as np
+from PIL import Image
+
+from utils.widget import Widget, WIDGET_COLORS
+
+# 控件草图四周的留白：宽（高）小于第 j 个阈值时留白为第 j 项，不小于所有阈值时为最后一项
+X_MARGIN_THRESHOLDS = [10, 25, 40, 70, 90, 120, 150, 180, 210, 240, 270]
+X_MARGINS = [0, 1, 2, 3, 5, 7, 9, 11, 13, 15, 17, 19]
+Y_MARGIN_THRESHOLDS = [30, 60, 100, 150, 180, 210, 240, 270]
+Y_MARGINS = [1, 2, 3, 5, 6, 8, 10, 12, 14]
+LIST_MARGIN = 2  # List 固定的留白
+
+
+def make_margin_table(thresholds, margins):
+    """
+    :return: 以宽（高）为下标的留白查找表，下标超出范围时截断到 [0, len - 1]
+    """
+    return np.repeat(np.array(margins, dtype=np.int64), np.diff([0] + thresholds + [thresholds[-1] + 1]))
+
+
+X_MARGIN_TABLE = make_margin_table(X_MARGIN_THRESHOLDS, X_MARGINS)
+Y_MARGIN_TABLE = make_margin_table(Y_MARGIN_THRESHOLDS, Y_MARGINS)
+
+# 以类型编码为下标的颜色表与是否绘制的标记（Layout、Unclassified 等没有颜色的类型不绘制）
+COLOR_TABLE = np.zeros((len(Widget), 3), dtype=np.uint8)
+DRAWN_TABLE = np.zeros(len(Widget), dtype=bool)
+for widget, color in WIDGET_COLORS.items():
+    COLOR_TABLE[widget.value] = color
+    DRAWN_TABLE[widget.value] = True
+
+
+def widget_sketch_boxes(types, bounds, screen_size, sketch_size):
+    """
+    将控件在屏幕上的 bounds 按比例缩放到草图画布上，并去除与控件大小对应的留白，得到实际绘制的范围
+    :param types: 控件类型编码数组
+    :param bounds: 控件 bounds 数组 (n, 4)
+    :param screen_size: 屏幕宽高
+    :param sketch_size: 草图画布宽高
+    :return: 绘制范围数组 (n, 4)
+    """
+    types = np.asarray(types, dtype=np.intp)
+    bounds = np.asarray(bounds, dtype=np.int64).reshape(-1, 4)
+    scale = np.array([sketch_size[0], sketch_size[1]] * 2, dtype=np.float64)
+    screen = np.array([screen_size[0], screen_size[1]] * 2, dtype=np.float64)
+    boxes = np.trunc(bounds / screen * scale).astype(np.int64)  # 与 int(b / WIDTH * SKETCH_WIDTH) 相同
+
+    w = boxes[:, 2] - boxes[:, 0] + 1
+    h = boxes[:, 3] - boxes[:, 1] + 1
+    x_margins = X_MARGIN_TABLE[np.clip(w, 0, len(X_MARGIN_TABLE) - 1)]
+    y_margins = Y_MARGIN_TABLE[np.clip(h, 0, len(Y_MARGIN_TABLE) - 1)]
+    is_list = types == Widget.List.value
+    x_margins[is_list] = LIST_MARGIN
+    y_margins[is_list] = LIST_MARGIN
+
+    boxes[:, 0] += x_margins
+    boxes[:, 1] += y_margins
+    boxes[:, 2] -= x_margins
+    boxes[:, 3] -= y_margins
+    return boxes
+
+
+class SketchCanvas(object):
+    """
+    预先分配的草图画布缓冲区，可以重复用于绘制多张图
+    """
+
+    def __init__(self, width, height, rotate=False):
+        """
+        :param width: 草图宽
+        :param height: 草图高
+        :param rotate: 是否绘制为逆时针旋转 90 度后的方向（缓冲区形状为 width × height × 3）
+        """
+        self.width = width
+        self.height = height
+        self.rotate = rotate
+        self.buffer = np.empty((width, height, 3) if rotate else (height, width, 3), dtype=np.uint8)
+
+    def draw(self, types, boxes):
+        """
+        清空画布后按顺序绘制控件色块，boxes 的含义与 Image.paste 的 box 相同（右、下边界不含，超出画布的部分截断）
+        :param types: 控件类型编码数组
+        :param boxes: 绘制范围数组 (n, 4)
+        :return: 缓冲区
+        """
+        self.buffer.fill(255)
+        types = np.asarray(types, dtype=np.intp)
+        boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+
+        x0 = np.maximum(boxes[:, 0], 0)
+        y0 = np.maximum(boxes[:, 1], 0)
+        x1 = np.minimum(boxes[:, 2], self.width)
+        y1 = np.minimum(boxes[:, 3], self.height)
+        drawn = DRAWN_TABLE[types] & (x0 < x1) & (y0 < y1)
+        x0, y0, x1, y1 = x0[drawn], y0[drawn], x1[drawn], y1[drawn]
+        colors = COLOR_TABLE[types[drawn]]
+
+        if self.rotate:
+            # 旋转后第 r 行为原图第 width - 1 - r 列，第 c 列为原图第 c 行
+            rows, cols = (self.width - x1, self.width - x0), (y0, y1)
+        else:
+            rows, cols = (y0, y1), (x0, x1)
+        for r0, r1, c0, c1, color in zip(rows[0].tolist(), rows[1].tolist(), cols[0].tolist(), cols[1].tolist(),
+                                         colors):
+            self.buffer[r0:r1, c0:c1] = color
+        return self.buffer
+
+    def image(self):
+        """
+        :return: 当前画布内容的 Image 对象（复制缓冲区）
+        """
+        return Image.fromarray(self.buffer.copy(), 'RGB')
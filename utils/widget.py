@@ -6,6 +6,8 @@
 
 from enum import Enum
 
+import numpy as np
+
 
 class Widget(Enum):
     Layout = 0
@@ -37,6 +39,20 @@ class WidgetColor(object):
     NAVY_RGB = (0, 0, 128)  # TextLink 不再使用
 
 
+# 组件块着色图中各控件类型的颜色（不在其中的类型不绘制）
+WIDGET_COLORS = {
+    Widget.Button: WidgetColor.BLUE_RGB,
+    Widget.TextView: WidgetColor.BLACK_RGB,
+    Widget.EditText: WidgetColor.LIME_RGB,
+    Widget.ImageView: WidgetColor.RED_RGB,
+    Widget.CheckBox: WidgetColor.MAGENTA_RGB,
+    Widget.Switch: WidgetColor.CYAN_RGB,
+    Widget.RadioButton: WidgetColor.YELLOW_RGB,
+    Widget.Toolbar: WidgetColor.GREEN_RGB,
+    Widget.List: WidgetColor.GRAY_RGB,
+}
+
+
 # class WidgetSketch(object):
 #     widget_sketches_dir = config.DIRECTORY_CONFIG['widget_sketches_dir']
 #
@@ -50,13 +66,111 @@ class WidgetColor(object):
 
 
 class WidgetNode(object):
-    def __init__(self, w_type, w_json, w_id, w_class, w_bounds, w_ancestor_clickable):
-        self.w_type = w_type
-        self.w_json = w_json
-        self.w_bounds = w_bounds
+    """
+    控件树节点除类型与 bounds 以外的属性（sha1 仅在裁剪控件或分析模式下保存，json 仅在分析模式下保存）
+    """
+    __slots__ = ('w_id', 'w_class', 'w_ancestor_clickable', 'w_sha1', 'w_json')
+
+    def __init__(self, w_id, w_class, w_ancestor_clickable, w_sha1=None, w_json=None):
         self.w_id = w_id
         self.w_class = w_class
         self.w_ancestor_clickable = w_ancestor_clickable
+        self.w_sha1 = w_sha1
+        self.w_json = w_json
+
+
+WIDGETS = list(Widget)  # 以类型编码为下标的 Widget 列表
+
+
+class WidgetTree(object):
+    """
+    草图生成使用的紧凑控件树。节点为整数编号（0 为虚拟根节点，其余按创建顺序编号），父节点编号（-1 表示没有父节点）、
+    控件类型编码与 bounds 保存在 NumPy 数组中，每个节点的子节点编号保存在列表中。
+    key 为节点的结构编号，key 相同（含子孙完全相同）的节点共用最后创建的一个的类型与属性
+    """
+    ROOT = 0
+
+    def __init__(self):
+        self.keys = [None]
+        self.parents = [-1]
+        self.children = [[]]
+        self.types = [Widget.Layout.value]
+        self.bounds = [[0, 0, 0, 0]]
+        self.widgets = [None]
+        self.key_nodes = {}  # { key: 最后创建的节点编号 }，按 key 首次出现的顺序排列
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add_node(self, parent, key, widget_type, bounds, widget_node):
+        """
+        创建节点并作为 parent 的最后一个子节点
+        :return: 节点编号
+        """
+        node = len(self.keys)
+        self.keys.append(key)
+        self.parents.append(parent)
+        self.children.append([])
+        self.children[parent].append(node)
+        self.types.append(widget_type.value)
+        self.bounds.append(bounds[:4])
+        self.widgets.append(widget_node)
+        self.key_nodes[key] = node
+        return node
+
+    def finish(self):
+        """
+        创建完成后调用：key 相同的节点统一使用最后创建的节点的类型与属性，并将父节点、类型与 bounds 转换为数组
+        """
+        last = [self.key_nodes.get(key, node) for node, key in enumerate(self.keys)]
+        self.parents = np.array(self.parents, dtype=np.int32)
+        self.types = np.array(self.types, dtype=np.int8)[last]
+        self.bounds = np.array(self.bounds, dtype=np.int64).reshape(-1, 4)[last]
+        self.widgets = [self.widgets[j] for j in last]
+
+    def widget_type(self, node):
+        return WIDGETS[self.types[node]]
+
+    def widget_bounds(self, node):
+        return self.bounds[node].tolist()
+
+    def set_parent(self, node, parent):
+        """
+        将节点（连同其子孙）移动为 parent 的最后一个子节点，parent 为 -1 时从树上删除
+        """
+        if self.parents[node] != -1:
+            self.children[self.parents[node]].remove(node)
+        self.parents[node] = parent
+        if parent != -1:
+            self.children[parent].append(node)
+
+    def detach(self, node):
+        self.set_parent(node, -1)
+
+    def set_children(self, node, children):
+        """
+        将节点的子节点替换为 children（原有的子节点先全部删除）
+        """
+        for child in self.children[node]:
+            self.parents[child] = -1
+        self.children[node].clear()
+        for child in children:
+            self.set_parent(child, node)
+
+    def replace_child(self, node, idx, new_child):
+        """
+        将节点的第 idx 个子节点替换为 new_child（new_child 从原位置移出）
+        """
+        children = self.children[node]
+        self.set_children(node, children[:idx] + [new_child] + children[idx + 1:])
+
+    def iter_nodes(self, node=ROOT, depth=0):
+        """
+        先序遍历 node 的子孙，产生 (节点编号, 深度)
+        """
+        for child in self.children[node]:
+            yield child, depth
+            yield from self.iter_nodes(child, depth + 1)
 
 
 class MatchTreeNode: